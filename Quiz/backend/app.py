@@ -7,14 +7,30 @@ from flask_mail import Mail
 from celery_config import init_celery
 import os
 from dotenv import load_dotenv
+import logging
+from logging_config import init_logging
 from email_service import init_mail
+from migrations import upgrade_schema
+from database import init_database_config
+from submission_buffer import init_submission_buffer
+from leaderboards import init_leaderboards
+from passwords import DEFAULT_WORKERS as DEFAULT_HASH_WORKERS, init_password_hasher
+from attempts import init_autosave_journal
+from quiz_payloads import init_quiz_payloads
+from serialization import init_serialization
+from instrumentation import init_instrumentation
+from profiling import init_profiling
 
 # Load environment variables
 load_dotenv()
 
+# JSON log lines written by a background thread
+init_logging()
+logger = logging.getLogger(__name__)
+
 app = Flask(__name__)
-# Enable CORS for all routes and all origins
-CORS(app)
+# Enable CORS for all routes and all origins, and let the frontend read the paging and retry headers
+CORS(app, expose_headers=["X-Next-Cursor", "Link", "Retry-After", "X-Profile-Id"])
 
 # Initialize Celery
 celery = init_celery(app)
@@ -24,14 +40,60 @@ init_mail(app)
 
 # Import routes after app is created to avoid circular imports
 from routes import routes
+import tasks  # Registers the scheduled Celery tasks
 
 # App configuration
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///quiz_master2.db'
+init_database_config(app)  # DATABASE_URL, pool and SQLite pragma settings
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SECRET_KEY'] = 'supersecret'
 app.config['JWT_SECRET_KEY'] = 'jwt_secret'
 app.config['JWT_TOKEN_LOCATION'] = ['headers']
 app.config['JWT_ACCESS_TOKEN_EXPIRES'] = False  # Set to a number of seconds if you want tokens to expire
+app.config['BCRYPT_LOG_ROUNDS'] = int(os.getenv('BCRYPT_LOG_ROUNDS', 12))  # Stored hashes with another cost are upgraded on login
+app.config['PASSWORD_HASH_WORKERS'] = int(os.getenv('PASSWORD_HASH_WORKERS', DEFAULT_HASH_WORKERS))  # 0 hashes inline
+if __name__ == "__main__":
+    # Pool workers start by re-running the parent's __main__, which here is this whole file
+    app.config['PASSWORD_HASH_WORKERS'] = 0
+app.config['PASSWORD_HASH_MAX_PENDING'] = int(os.getenv('PASSWORD_HASH_MAX_PENDING', 0)) or None  # Default 4 per worker
+app.config['IDENTITY_CACHE_TTL'] = int(os.getenv('IDENTITY_CACHE_TTL', 300))  # Seconds an email -> user id lookup for older tokens stays cached
+app.config['EXPORT_DIR'] = os.getenv('EXPORT_DIR')  # Defaults to <instance>/exports
+app.config['SUBMISSION_QUEUE_PATH'] = os.getenv('SUBMISSION_QUEUE_PATH')  # Defaults to <instance>/submissions.log
+app.config['SUBMISSION_FLUSH_INTERVAL'] = float(os.getenv('SUBMISSION_FLUSH_INTERVAL', 0.5))
+app.config['SUBMISSION_BATCH_SIZE'] = int(os.getenv('SUBMISSION_BATCH_SIZE', 500))
+app.config['SUBMISSION_FSYNC'] = os.getenv('SUBMISSION_FSYNC', '1') != '0'  # fsync each queued submission
+app.config['AUTOSAVE_JOURNAL_PATH'] = os.getenv('AUTOSAVE_JOURNAL_PATH')  # Defaults to <instance>/autosave.log
+app.config['AUTOSAVE_FLUSH_INTERVAL'] = float(os.getenv('AUTOSAVE_FLUSH_INTERVAL', 2.0))  # Seconds between autosave batches
+app.config['AUTOSAVE_FSYNC'] = os.getenv('AUTOSAVE_FSYNC', '0') != '0'  # Autosaves survive a process crash without it
+app.config['AUTOSAVE_GRACE_SECONDS'] = int(os.getenv('AUTOSAVE_GRACE_SECONDS', 5))  # Late autosaves accepted after the deadline
+app.config['QUIZ_PAYLOAD_PREWARM_SECONDS'] = int(os.getenv('QUIZ_PAYLOAD_PREWARM_SECONDS', 60))  # Build quiz payloads this long before start; 0 disables
+app.config['JSON_ENCODER'] = os.getenv('JSON_ENCODER', 'orjson')  # 'stdlib' skips orjson even when installed
+app.config['COMPRESS_MIN_SIZE'] = int(os.getenv('COMPRESS_MIN_SIZE', 1024))  # Bytes; smaller responses go out as is, 0 disables
+app.config['COMPRESS_LEVEL'] = int(os.getenv('COMPRESS_LEVEL', 6))
+app.config['REQUEST_METRICS'] = os.getenv('REQUEST_METRICS', '1') != '0'  # Per-request SQL stats and /metrics
+app.config['METRICS_TOKEN'] = os.getenv('METRICS_TOKEN')  # If set, /metrics needs "Authorization: Bearer <token>"
+app.config['SERVER_TIMING'] = os.getenv('SERVER_TIMING', '0') != '0'  # Add a Server-Timing header to responses
+app.config['N_PLUS_ONE_THRESHOLD'] = int(os.getenv('N_PLUS_ONE_THRESHOLD', 5))  # Repeats of one statement that get logged
+app.config['SLOW_QUERY_SECONDS'] = float(os.getenv('SLOW_QUERY_SECONDS', 0.25))
+app.config['PROFILING_ENABLED'] = os.getenv('PROFILING_ENABLED', '1') != '0'  # Admins can profile live requests
+app.config['PROFILE_DIR'] = os.getenv('PROFILE_DIR')  # Defaults to <instance>/profiles
+app.config['PROFILE_MAX_FILES'] = int(os.getenv('PROFILE_MAX_FILES', 50))  # Older profiles are deleted
+app.config['PROFILE_SAMPLE_INTERVAL'] = float(os.getenv('PROFILE_SAMPLE_INTERVAL', 0.005))  # Seconds between stack samples
+app.config['PROFILE_ARM_TTL'] = int(os.getenv('PROFILE_ARM_TTL', 600))  # Armed profiling lapses after this many seconds
+app.config['EXPORT_TTL_SECONDS'] = int(os.getenv('EXPORT_TTL_SECONDS', 600))  # Finished exports are reused for this long
+app.config['LEADERBOARD_REDIS_URL'] = os.getenv('LEADERBOARD_REDIS_URL', 'redis://localhost:6379/0')
+app.config['LEADERBOARD_BACKEND'] = os.getenv('LEADERBOARD_BACKEND', 'redis')  # 'memory' keeps boards in-process
+
+# Query counts, SQL time and N+1 warnings per request; registered first so its timing includes compression
+init_instrumentation(app)
+
+# Admin-triggered sampling of live requests
+init_profiling(app)
+
+# orjson-backed jsonify and gzip/deflate for large responses
+init_serialization(app)
+
+# Hash passwords on a bounded process pool
+init_password_hasher(app)
 
 # Connect SQLAlchemy db, bcrypt, jwt to the app
 db.init_app(app)
@@ -41,7 +103,8 @@ jwt = JWTManager(app)
 # Create the database
 with app.app_context():
     db.create_all()
-    print("Database and tables created successfully!")
+    upgrade_schema()
+    logger.info("Database and tables created successfully!")
     # Check if admin already exists before adding
     admin = User.query.filter_by(email="admin@example.com").first()
     if not admin:
@@ -53,9 +116,15 @@ with app.app_context():
         admin.set_password("admin1234")
         db.session.add(admin)
         db.session.commit()
-        print("Admin user created successfully!")
+        logger.info("Admin user created successfully!")
     else:
-        print("Admin user already exists!")
+        logger.debug("Admin user already exists!")
+
+# Flush buffered quiz submissions in the background
+init_submission_buffer(app)
+init_autosave_journal(app)
+init_leaderboards(app)
+init_quiz_payloads(app)
 
 # Register routes from routes.py
 app.register_blueprint(routes)
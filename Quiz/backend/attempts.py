@@ -0,0 +1,445 @@
+"""Server-side quiz attempt sessions with coalesced answer autosave.
+
+An attempt opens when a student starts a quiz. It stores the quiz's question ids
+(fixed at start) and one byte per question holding the chosen option, plus a
+deadline: the earlier of the quiz window's end and start + quiz duration.
+
+Autosaves are small {question_id: option} deltas. They are appended to a shared
+journal without touching the database; a flusher applies all pending deltas in
+one transaction every AUTOSAVE_FLUSH_INTERVAL seconds, so the write rate does
+not grow with the number of students or how often they save. Each delta carries
+a client sequence number and deltas at or below the stored revision are ignored,
+which makes journal replays and client retries harmless.
+
+Submitting (or the expiry sweep) reads that attempt's not yet applied deltas
+straight from the journal files, so it never waits for a flush. It then grades
+the merged answers against the answer key and queues the score under the
+attempt id.
+"""
+import datetime
+import glob
+import json
+import logging
+import os
+import threading
+import uuid
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from celery import shared_task
+from sqlalchemy import bindparam, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.attributes import set_committed_value
+from models import db, AttemptSession
+from grading import get_answer_key, parse_option
+from submission_buffer import JournalBuffer, queue_submission
+from quiz_schedule import ist_now
+from quiz_payloads import get_quiz_payload
+
+logger = logging.getLogger(__name__)
+
+# attempt id -> (user_id, deadline) of open attempts, so autosaves are checked without a query
+OPEN_ATTEMPT_CACHE_ENTRIES = 10000
+_open_attempts = OrderedDict()
+_open_attempts_lock = threading.Lock()
+
+
+class AttemptError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def pack_question_ids(question_ids):
+    return array('q', question_ids).tobytes()
+
+
+def unpack_question_ids(raw):
+    question_ids = array('q')
+    question_ids.frombytes(raw)
+    return question_ids
+
+
+def _remember_open(attempt_id, user_id, deadline):
+    with _open_attempts_lock:
+        _open_attempts[attempt_id] = (user_id, deadline)
+        _open_attempts.move_to_end(attempt_id)
+        if len(_open_attempts) > OPEN_ATTEMPT_CACHE_ENTRIES:
+            _open_attempts.popitem(last=False)
+
+
+def _forget_open(attempt_id):
+    with _open_attempts_lock:
+        _open_attempts.pop(attempt_id, None)
+
+
+def is_expired(session, now=None):
+    """Past its deadline plus the autosave grace period; the sweep and requests agree on this"""
+    return session.deadline + autosave_journal.grace < (now or ist_now())
+
+
+def attempt_deadline(quiz, started_at):
+    hours = quiz.duration_hours if quiz.duration_hours is not None else 0
+    minutes = quiz.duration_minutes if quiz.duration_minutes is not None else 30
+    return min(quiz.end_datetime, started_at + datetime.timedelta(hours=hours, minutes=minutes))
+
+
+def open_attempt(user_id, quiz_id):
+    """The user's open attempt at this quiz, or a new one; returns (session, created)"""
+    now = ist_now()
+    quiz = get_quiz_payload(quiz_id)
+    if quiz is None:
+        raise AttemptError(404, "Quiz not found")
+    if not quiz.is_active(now):
+        raise AttemptError(403, "Quiz is not currently active")
+
+    session = AttemptSession.query.filter_by(user_id=user_id, quiz_id=quiz_id, status='open').first()
+    if session is not None and is_expired(session, now):
+        # Time ran out before it was submitted; grade what was saved and start afresh
+        finalize_attempt(session)
+        session = None
+    if session is not None:
+        return resume_attempt(session), False
+
+    key = get_answer_key(quiz_id)
+    if not len(key):
+        raise AttemptError(404, "Quiz has no questions")
+    session = AttemptSession(
+        id=uuid.uuid4().hex,
+        user_id=user_id,
+        quiz_id=quiz_id,
+        started_at=now,
+        deadline=attempt_deadline(quiz, now),
+        question_ids=pack_question_ids(key.question_ids),
+        answers=bytes(len(key))
+    )
+    db.session.add(session)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Opened concurrently, e.g. from a second tab
+        db.session.rollback()
+        session = AttemptSession.query.filter_by(user_id=user_id, quiz_id=quiz_id, status='open').one()
+        return resume_attempt(session), False
+    _remember_open(session.id, user_id, session.deadline)
+    return session, True
+
+
+def get_attempt(attempt_id, user_id):
+    session = db.session.get(AttemptSession, attempt_id)
+    if session is None or session.user_id != user_id:
+        raise AttemptError(404, "Attempt not found")
+    return session
+
+
+def merged_answers(session):
+    """An attempt's answer bytes and revision including autosaves still in the journal.
+
+    Refreshes the row after reading the journal: a file flushed in between is then
+    either in the row or in the records read, never in neither.
+    """
+    records = autosave_journal.pending(session.id)
+    db.session.refresh(session)
+    answers = bytearray(session.answers)
+    revision = session.revision
+    question_ids = unpack_question_ids(session.question_ids)
+    for record in records:
+        if autosave_applies(record, session.user_id, revision, session.deadline + autosave_journal.grace):
+            apply_delta(question_ids, answers, record['answers'])
+            revision = record['seq']
+    return answers, revision
+
+
+def resume_attempt(session):
+    """Bring an open attempt up to date with journaled autosaves so its revision is current.
+
+    The merge is in memory only; the flusher still writes the deltas to the row.
+    """
+    if session.status == 'open':
+        answers, revision = merged_answers(session)
+        # The refresh may show it was submitted meanwhile; its stored answers are then final
+        if session.status == 'open':
+            set_committed_value(session, 'answers', bytes(answers))
+            set_committed_value(session, 'revision', revision)
+            _remember_open(session.id, session.user_id, session.deadline)
+    return session
+
+
+def attempt_json(session, with_questions=True):
+    """State a client needs to (re)render an attempt"""
+    question_ids = unpack_question_ids(session.question_ids)
+    result = {
+        'attempt_id': session.id,
+        'quiz_id': session.quiz_id,
+        'status': session.status,
+        'deadline': session.deadline.isoformat(),
+        'seconds_remaining': max(0, int((session.deadline - ist_now()).total_seconds())),
+        'revision': session.revision,
+        'answers': {str(question_id): option
+                    for question_id, option in zip(question_ids, session.answers) if option},
+        'score': session.score
+    }
+    if with_questions:
+        payload = get_quiz_payload(session.quiz_id)
+        questions = payload.questions if payload else []
+        if [q['id'] for q in questions] != list(question_ids):
+            # The quiz changed since the attempt opened; show only the attempt's questions
+            wanted = set(question_ids)
+            questions = [q for q in questions if q['id'] in wanted]
+        result['questions'] = questions
+    return result
+
+
+def parse_answer_delta(answers):
+    """{question_id: option} from a client delta; option None or 0 clears an answer"""
+    if not isinstance(answers, dict):
+        raise AttemptError(400, "answers must map question ids to options")
+    delta = {}
+    for question_id, option in answers.items():
+        try:
+            question_id = int(question_id)
+        except (TypeError, ValueError):
+            raise AttemptError(400, f"Invalid question id: {question_id}")
+        if option in (None, 0, ''):
+            delta[str(question_id)] = 0
+            continue
+        parsed = parse_option(option)
+        if parsed is None:
+            raise AttemptError(400, f"Invalid option for question {question_id}: {option}")
+        delta[str(question_id)] = parsed
+    return delta
+
+
+def _open_attempt_owner(attempt_id):
+    """(user_id, deadline) of an open attempt, from the cache or one narrow query; None if not open"""
+    with _open_attempts_lock:
+        entry = _open_attempts.get(attempt_id)
+    if entry is not None:
+        return entry
+    row = db.session.query(AttemptSession.user_id, AttemptSession.deadline).filter(
+        AttemptSession.id == attempt_id, AttemptSession.status == 'open'
+    ).first()
+    if row is None:
+        return None
+    _remember_open(attempt_id, row.user_id, row.deadline)
+    return row.user_id, row.deadline
+
+
+def save_answers(attempt_id, user_id, seq, answers):
+    """Journal an autosave delta for the user's open attempt; applied by the next flush"""
+    if not isinstance(seq, int) or isinstance(seq, bool) or seq < 1:
+        raise AttemptError(400, "seq must be a positive integer")
+    delta = parse_answer_delta(answers)
+    entry = _open_attempt_owner(attempt_id)
+    if entry is None or entry[0] != user_id:
+        # Submitted attempts are not told apart from missing ones; both take no more answers
+        raise AttemptError(404, "Attempt not found or already submitted")
+    if ist_now() > entry[1] + autosave_journal.grace:
+        raise AttemptError(409, "Attempt time is over")
+    autosave_journal.append(attempt_id, user_id, seq, delta)
+
+
+def grade_attempt(session, answers=None):
+    """Score answer bytes (the stored ones by default) against the quiz's current answer key"""
+    answers = session.answers if answers is None else answers
+    key = get_answer_key(session.quiz_id)
+    question_ids = unpack_question_ids(session.question_ids)
+    if list(question_ids) == list(key.question_ids):
+        score = sum(1 for given, correct in zip(answers, key.correct_options) if given and given == correct)
+    else:
+        # Questions changed since the attempt opened; only surviving ones count
+        score = sum(1 for question_id, given in zip(question_ids, answers)
+                    if given and key.correct_option(question_id) == given)
+    return score, len(key)
+
+
+def apply_delta(question_ids, answers, delta):
+    """Write a parsed delta into an attempt's answer bytes; unknown question ids are ignored"""
+    for question_id, option in delta.items():
+        position = bisect_left(question_ids, int(question_id))
+        if position < len(question_ids) and question_ids[position] == int(question_id):
+            answers[position] = option
+
+
+def finalize_attempt(session, answers=None):
+    """Apply any last answers, grade the attempt and queue its score; returns (score, total)"""
+    delta = parse_answer_delta(answers) if answers else None
+    # Deltas still in the journal are merged here rather than waiting for a flush
+    answers, revision = merged_answers(session)
+    if session.status != 'open':
+        _forget_open(session.id)
+        return session.score, len(get_answer_key(session.quiz_id))
+
+    if delta and not is_expired(session):
+        apply_delta(unpack_question_ids(session.question_ids), answers, delta)
+    score, total = grade_attempt(session, answers)
+    claimed = db.session.execute(
+        update(AttemptSession).where(AttemptSession.id == session.id, AttemptSession.status == 'open')
+        .values(answers=bytes(answers), revision=revision, status='submitted', score=score, submitted_at=ist_now())
+    ).rowcount
+    db.session.commit()
+    _forget_open(session.id)
+    if claimed:
+        queue_submission(session.user_id, session.quiz_id, score, session.id)
+    db.session.refresh(session)
+    return session.score, total
+
+
+def autosave_applies(record, user_id, revision, accept_until):
+    """Whether a journaled delta still applies to an attempt at `revision`"""
+    if record['user_id'] != user_id or record['seq'] <= revision:
+        return False
+    return datetime.datetime.fromisoformat(record['saved_at']) <= accept_until
+
+
+class AutosaveJournal(JournalBuffer):
+    """Journal of answer deltas, folded into attempt_session rows in one transaction per flush"""
+    thread_name = 'autosave-flusher'
+
+    def __init__(self, app, path, grace_seconds=5, **kwargs):
+        super().__init__(app, path, **kwargs)
+        self.grace = datetime.timedelta(seconds=grace_seconds)
+        self._index_lock = threading.Lock()
+        # attempt id -> {seq: record} for records in journal files, and per file (dev, inode):
+        # its first bytes, how far it has been read and the (attempt id, seq) keys it held
+        self._pending = {}
+        self._tails = {}
+
+    def append(self, attempt_id, user_id, seq, delta):
+        self._write({
+            'attempt_id': attempt_id,
+            'user_id': int(user_id),
+            'seq': seq,
+            'answers': delta,
+            'saved_at': ist_now().isoformat()
+        })
+
+    def pending(self, attempt_id):
+        """Journaled deltas for one attempt that may not be applied yet, by seq.
+
+        Served from an in-memory index of the live file and the files being flushed,
+        so a submit neither waits on a flush nor rereads the journal; records already
+        applied are filtered out by their seq.
+        """
+        with self._index_lock:
+            self._catch_up()
+            records = self._pending.get(attempt_id, {})
+            return [records[seq] for seq in sorted(records)]
+
+    def _catch_up(self):
+        """Index the records appended since the last call, whichever process wrote them.
+
+        Each file is read from where the previous call stopped; it is tracked by inode,
+        so rotating the live file does not read it again. Once a file is gone its
+        records have been applied, and they are dropped from the index.
+        """
+        seen = set()
+        # The live file first: if it is rotated meanwhile, the glob still finds it
+        for path in [self.path, *sorted(glob.glob(f'{self.path}.*.flushing'))]:
+            try:
+                f = open(path, 'rb')
+            except FileNotFoundError:
+                continue
+            with f:
+                stat = os.fstat(f.fileno())
+                file_id = (stat.st_dev, stat.st_ino)
+                if file_id in seen:
+                    continue
+                seen.add(file_id)
+                head = f.read(64)
+                tail = self._tails.get(file_id)
+                if tail is None or not head.startswith(tail['head']):
+                    # A new file, or a new one that reused the inode of a flushed one
+                    self._forget_file(file_id)
+                    tail = self._tails[file_id] = {'head': head, 'offset': 0, 'keys': []}
+                f.seek(tail['offset'])
+                data = f.read()
+            # Leave a line still being appended for the next call
+            complete = data[:data.rfind(b'\n') + 1]
+            tail['offset'] += len(complete)
+            for line in complete.splitlines():
+                try:
+                    record = json.loads(line)
+                    key = (record['attempt_id'], record['seq'])
+                except (ValueError, KeyError, TypeError):
+                    # The flusher moves it to the dead-letter file
+                    continue
+                self._pending.setdefault(key[0], {})[key[1]] = record
+                tail['keys'].append(key)
+        for file_id in set(self._tails) - seen:
+            self._forget_file(file_id)
+
+    def _forget_file(self, file_id):
+        tail = self._tails.pop(file_id, None)
+        for attempt_id, seq in tail['keys'] if tail else ():
+            records = self._pending.get(attempt_id)
+            if records is not None:
+                records.pop(seq, None)
+                if not records:
+                    del self._pending[attempt_id]
+
+    def _insert(self, records):
+        with self.app.app_context():
+            attempt_ids = {record['attempt_id'] for record in records}
+            rows = db.session.query(
+                AttemptSession.id, AttemptSession.user_id, AttemptSession.deadline,
+                AttemptSession.question_ids, AttemptSession.answers, AttemptSession.revision
+            ).filter(AttemptSession.id.in_(attempt_ids), AttemptSession.status == 'open').all()
+            sessions = {row.id: {'user_id': row.user_id, 'deadline': row.deadline,
+                                 'question_ids': unpack_question_ids(row.question_ids),
+                                 'answers': bytearray(row.answers), 'revision': row.revision,
+                                 'changed': False} for row in rows}
+
+            for record in records:
+                session = sessions.get(record['attempt_id'])
+                if session is None or not autosave_applies(record, session['user_id'], session['revision'],
+                                                           session['deadline'] + self.grace):
+                    continue
+                apply_delta(session['question_ids'], session['answers'], record['answers'])
+                session['revision'] = record['seq']
+                session['changed'] = True
+
+            changed = [{'b_id': attempt_id, 'b_answers': bytes(session['answers']), 'b_revision': session['revision']}
+                       for attempt_id, session in sessions.items() if session['changed']]
+            if changed:
+                table = AttemptSession.__table__
+                db.session.execute(
+                    update(table).where(table.c.id == bindparam('b_id'), table.c.status == 'open')
+                    .values(answers=bindparam('b_answers'), revision=bindparam('b_revision')),
+                    changed
+                )
+                db.session.commit()
+            logger.debug("Applied %d autosaves to %d attempts", len(records), len(changed))
+            return len(records)
+
+
+autosave_journal = None
+
+
+def init_autosave_journal(app):
+    global autosave_journal
+    path = app.config.get('AUTOSAVE_JOURNAL_PATH') or os.path.join(app.instance_path, 'autosave.log')
+    autosave_journal = AutosaveJournal(
+        app,
+        path,
+        grace_seconds=int(app.config.get('AUTOSAVE_GRACE_SECONDS', 5)),
+        flush_interval=float(app.config.get('AUTOSAVE_FLUSH_INTERVAL', 2.0)),
+        batch_size=int(app.config.get('AUTOSAVE_BATCH_SIZE', 2000)),
+        fsync=app.config.get('AUTOSAVE_FSYNC', False)
+    )
+    autosave_journal.start()
+    return autosave_journal
+
+
+@shared_task
+def finalize_expired_attempts():
+    """Grade attempts whose deadline passed without a submit"""
+    cutoff = ist_now() - autosave_journal.grace  # The same test as is_expired()
+    expired = AttemptSession.query.filter(
+        AttemptSession.status == 'open', AttemptSession.deadline < cutoff
+    ).all()
+    for session in expired:
+        finalize_attempt(session)
+    if expired:
+        logger.info("Finalized %d expired attempts", len(expired))
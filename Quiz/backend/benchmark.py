@@ -0,0 +1,348 @@
+"""Load-test harness for the quiz API.
+
+Seeds a synthetic dataset with bulk inserts into a throwaway database, then runs
+concurrent simulated students through the Flask test client:
+
+    login -> /api/subjects -> start attempt -> autosave answers -> submit attempt -> /api/quiz-history
+
+and prints p50/p95/p99 latency, throughput, CPU time, response bytes and SQL
+queries per request for each endpoint as JSON. The dataset and the request mix are derived from --seed, so
+runs at the same settings are comparable across commits:
+
+    python benchmark.py --users 2000 --concurrency 16 --output before.json
+    python benchmark.py --users 2000 --concurrency 16 --compare before.json
+"""
+import argparse
+import datetime
+import gzip
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+PASSWORD = 'benchmark-password'
+IST = datetime.timezone(datetime.timedelta(hours=5, minutes=30))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=200, help='student accounts to seed')
+    parser.add_argument('--subjects', type=int, default=5)
+    parser.add_argument('--chapters', type=int, default=4, help='chapters per subject')
+    parser.add_argument('--quizzes', type=int, default=5, help='quizzes per chapter')
+    parser.add_argument('--questions', type=int, default=20, help='questions per quiz')
+    parser.add_argument('--scores', type=int, default=5, help='past scores per user')
+    parser.add_argument('--active-ratio', type=float, default=0.5, help='share of quizzes open right now')
+    parser.add_argument('--concurrency', type=int, default=8, help='simulated students running at once')
+    parser.add_argument('--iterations', type=int, default=3, help='scenarios each simulated student runs')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--accept-encoding', default='gzip, deflate',
+                        help="Accept-Encoding sent with every request ('' for uncompressed responses)")
+    parser.add_argument('--database-url', help='benchmark against this database instead of a temporary SQLite file')
+    parser.add_argument('--output', help='also write the JSON report to this file')
+    parser.add_argument('--compare', help='earlier JSON report to compare p95 latencies against')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed relative p95 slowdown before --compare fails (default 0.2 = 20%%)')
+    return parser.parse_args(argv)
+
+
+def configure_environment(args, workdir):
+    """Point the app at a scratch database, journals and boards before it is imported.
+
+    Nothing a run writes may land in the developer's instance/ folder or Redis.
+    """
+    os.environ['DATABASE_URL'] = args.database_url or f"sqlite:///{os.path.join(workdir, 'benchmark.db')}"
+    os.environ['SUBMISSION_QUEUE_PATH'] = os.path.join(workdir, 'submissions.log')
+    os.environ['AUTOSAVE_JOURNAL_PATH'] = os.path.join(workdir, 'autosave.log')
+    os.environ['EXPORT_DIR'] = os.path.join(workdir, 'exports')
+    os.environ['PROFILE_DIR'] = os.path.join(workdir, 'profiles')
+    os.environ['LEADERBOARD_BACKEND'] = 'memory'
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+
+def seed(args, db, models, bcrypt):
+    """Bulk insert the synthetic dataset; returns the active quiz ids and student emails"""
+    from sqlalchemy import insert
+    import stats
+    rng = random.Random(args.seed)
+    now = datetime.datetime.now(IST).replace(tzinfo=None)
+    password_hash = bcrypt.generate_password_hash(PASSWORD).decode('utf-8')
+
+    def next_id(model):
+        return (db.session.query(db.func.max(model.id)).scalar() or 0) + 1
+
+    user_start = next_id(models.User)
+    emails = [f'student{i}@bench.example' for i in range(args.users)]
+    db.session.execute(insert(models.User), [
+        {'id': user_start + i, 'email': email, 'password': password_hash,
+         'full_name': f'Student {i}', 'role': 'user'}
+        for i, email in enumerate(emails)
+    ])
+
+    subject_start = next_id(models.Subject)
+    db.session.execute(insert(models.Subject), [
+        {'id': subject_start + i, 'name': f'Subject {i}', 'description': 'Benchmark subject'}
+        for i in range(args.subjects)
+    ])
+
+    chapter_start = next_id(models.Chapter)
+    chapters = []
+    for s in range(args.subjects):
+        for c in range(args.chapters):
+            chapters.append({'id': chapter_start + len(chapters), 'subject_id': subject_start + s,
+                             'name': f'Chapter {s}.{c}', 'description': 'Benchmark chapter'})
+    db.session.execute(insert(models.Chapter), chapters)
+
+    quiz_start = next_id(models.Quiz)
+    quizzes, active_ids = [], []
+    for chapter in chapters:
+        for q in range(args.quizzes):
+            quiz_id = quiz_start + len(quizzes)
+            if rng.random() < args.active_ratio:
+                start = now - datetime.timedelta(minutes=30)
+                active_ids.append(quiz_id)
+            else:
+                start = now - datetime.timedelta(days=rng.randint(2, 365))
+            quizzes.append({'id': quiz_id, 'chapter_id': chapter['id'], 'title': f'Quiz {quiz_id}',
+                            'start_datetime': start, 'end_datetime': start + datetime.timedelta(hours=3),
+                            'duration_hours': 3, 'duration_minutes': 0, 'question_count': args.questions})
+    db.session.execute(insert(models.Quiz), quizzes)
+
+    questions = [
+        {'quiz_id': quiz['id'], 'question_text': f'Question {n} of quiz {quiz["id"]}?',
+         'option1': 'Alpha', 'option2': 'Beta', 'option3': 'Gamma', 'option4': 'Delta',
+         'correct_option': rng.randint(1, 4)}
+        for quiz in quizzes for n in range(args.questions)
+    ]
+    for i in range(0, len(questions), 5000):
+        db.session.execute(insert(models.Question), questions[i:i + 5000])
+
+    scores = [
+        {'user_id': user_start + u, 'quiz_id': rng.choice(quizzes)['id'],
+         'score': rng.randint(0, args.questions), 'date_taken': now - datetime.timedelta(days=rng.randint(0, 365))}
+        for u in range(args.users) for _ in range(args.scores)
+    ]
+    for i in range(0, len(scores), 5000):
+        db.session.execute(insert(models.Score), scores[i:i + 5000])
+
+    stats.rebuild_stats()
+    db.session.commit()
+    return active_ids or [quizzes[0]['id']], emails
+
+
+class QueryCounter:
+    """Counts SQL statements issued by the current thread"""
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+        self._local = threading.local()
+        event.listen(engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args):
+        self._local.count = getattr(self._local, 'count', 0) + 1
+
+    def reset(self):
+        self._local.count = 0
+
+    @property
+    def count(self):
+        return getattr(self._local, 'count', 0)
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {}
+
+    def add(self, endpoint, seconds, queries, ok, cpu_seconds=0.0, size=0):
+        with self._lock:
+            self.samples.setdefault(endpoint, []).append((seconds, queries, ok, cpu_seconds, size))
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def decode_body(body, encoding):
+    if encoding == 'gzip':
+        return gzip.decompress(body)
+    if encoding == 'deflate':
+        return zlib.decompress(body)
+    return body
+
+
+def run_load(app, counter, args, active_ids, emails):
+    recorder = Recorder()
+    rng = random.Random(args.seed + 1)
+    plans = [(rng.choice(emails), [rng.choice(active_ids) for _ in range(args.iterations)], rng.random())
+             for _ in range(args.concurrency)]
+
+    def call(client, endpoint, method, path, headers=None, **kwargs):
+        headers = dict(headers or {})
+        if args.accept_encoding:
+            headers['Accept-Encoding'] = args.accept_encoding
+        counter.reset()
+        started = time.perf_counter()
+        cpu_started = time.thread_time()
+        response = client.open(path, method=method, headers=headers, **kwargs)
+        elapsed = time.perf_counter() - started
+        size = len(response.get_data())
+        recorder.add(endpoint, elapsed, counter.count, response.status_code < 400,
+                     time.thread_time() - cpu_started, size)
+        if response.content_encoding:
+            # Decode for the caller, as an HTTP client would
+            response.set_data(decode_body(response.get_data(), response.content_encoding))
+            del response.headers['Content-Encoding']
+        return response
+
+    def student(plan):
+        email, quiz_ids, seed = plan
+        answer_rng = random.Random(seed)
+        client = app.test_client()
+        for quiz_id in quiz_ids:
+            response = call(client, 'POST /login', 'POST', '/login', json={'email': email, 'password': PASSWORD})
+            if response.status_code != 200:
+                continue
+            headers = {'Authorization': f"Bearer {response.get_json()['access_token']}"}
+            call(client, 'GET /api/subjects', 'GET', '/api/subjects', headers=headers)
+            # The attempt flow the quiz page uses: start, autosave half the answers, submit the rest
+            attempt = call(client, 'POST /api/quizzes/<id>/attempts', 'POST', f'/api/quizzes/{quiz_id}/attempts',
+                           headers=headers)
+            if attempt.status_code not in (200, 201):
+                continue
+            attempt = attempt.get_json()
+            answers = {str(question['id']): answer_rng.randint(1, 4) for question in attempt['questions']}
+            saved = dict(list(answers.items())[:len(answers) // 2])
+            path = f"/api/attempts/{attempt['attempt_id']}"
+            call(client, 'PATCH /api/attempts/<id>/answers', 'PATCH', f'{path}/answers', headers=headers,
+                 json={'seq': 1, 'answers': saved})
+            call(client, 'POST /api/attempts/<id>/submit', 'POST', f'{path}/submit', headers=headers,
+                 json={'answers': {key: value for key, value in answers.items() if key not in saved}})
+            call(client, 'GET /api/quiz-history', 'GET', '/api/quiz-history', headers=headers)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(student, plans))
+    return recorder, time.perf_counter() - started
+
+
+def summarize(recorder, wall_seconds):
+    endpoints = {}
+    for endpoint, samples in sorted(recorder.samples.items()):
+        latencies = sorted(sample[0] * 1000 for sample in samples)
+        queries = [sample[1] for sample in samples]
+        endpoints[endpoint] = {
+            'requests': len(samples),
+            'errors': sum(1 for sample in samples if not sample[2]),
+            'p50_ms': round(percentile(latencies, 0.50), 3),
+            'p95_ms': round(percentile(latencies, 0.95), 3),
+            'p99_ms': round(percentile(latencies, 0.99), 3),
+            'mean_ms': round(sum(latencies) / len(latencies), 3),
+            'throughput_rps': round(len(samples) / wall_seconds, 2),
+            'cpu_ms_per_request': round(sum(sample[3] for sample in samples) * 1000 / len(samples), 3),
+            'bytes_per_request': round(sum(sample[4] for sample in samples) / len(samples)),
+            'queries_per_request': round(sum(queries) / len(queries), 2),
+            'max_queries': max(queries)
+        }
+    total_requests = sum(e['requests'] for e in endpoints.values())
+    return endpoints, {
+        'requests': total_requests,
+        'errors': sum(e['errors'] for e in endpoints.values()),
+        'wall_seconds': round(wall_seconds, 3),
+        'throughput_rps': round(total_requests / wall_seconds, 2) if wall_seconds else None
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report, baseline, tolerance):
+    """Endpoints whose p95 grew by more than `tolerance` relative to the baseline report"""
+    regressions = []
+    for endpoint, stats in report['endpoints'].items():
+        before = baseline.get('endpoints', {}).get(endpoint)
+        if before and before['p95_ms'] and stats['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+            regressions.append({'endpoint': endpoint, 'baseline_p95_ms': before['p95_ms'], 'p95_ms': stats['p95_ms']})
+    return regressions
+
+
+def run(args, workdir):
+    """Seed a database in `workdir`, run the load and return the report"""
+    configure_environment(args, workdir)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    import app as app_module
+    import attempts
+    import models
+    import submission_buffer
+    app = app_module.app
+
+    with app.app_context():
+        seed_started = time.perf_counter()
+        active_ids, emails = seed(args, models.db, models, models.bcrypt)
+        seed_seconds = time.perf_counter() - seed_started
+        counter = QueryCounter(models.db.engine)
+
+    recorder, wall_seconds = run_load(app, counter, args, active_ids, emails)
+    # Drain the journals while their files still exist
+    attempts.autosave_journal.stop()
+    submission_buffer.submission_buffer.stop()
+    endpoints, total = summarize(recorder, wall_seconds)
+
+    return {
+        'meta': {
+            'commit': git_commit(),
+            'started_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'database': app.config['SQLALCHEMY_DATABASE_URI'].split('://', 1)[0],
+            'seed_seconds': round(seed_seconds, 3),
+            'settings': {key: value for key, value in vars(args).items()
+                         if key not in ('output', 'compare', 'tolerance', 'database_url')}
+        },
+        'endpoints': endpoints,
+        'total': total
+    }
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    with tempfile.TemporaryDirectory(prefix='quiz-benchmark-') as workdir:
+        report = run(args, workdir)
+
+    exit_code = 0
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get('meta', {}).get('settings') != report['meta']['settings']:
+            print('warning: baseline was recorded with different settings', file=sys.stderr)
+        report['regressions'] = compare(report, baseline, args.tolerance)
+        exit_code = 1 if report['regressions'] else 0
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    return exit_code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
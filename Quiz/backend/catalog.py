@@ -0,0 +1,150 @@
+import datetime
+import json
+import threading
+from bisect import bisect_left, bisect_right
+from sqlalchemy.orm import selectinload
+from models import db, Subject, Chapter, Score
+from versions import bump_version, current_version
+
+IST = datetime.timezone(datetime.timedelta(hours=5, minutes=30))
+
+CATALOG_VERSION = 'catalog'
+
+# Stands in for each quiz's status in the cached JSON; swapped for the real status per request
+STATUS_PLACEHOLDER = json.dumps('\u0000quiz-status\u0000')
+
+_cached_snapshot = None
+_build_lock = threading.Lock()
+
+
+def bump_catalog_version():
+    """Invalidate the cached catalog once the current transaction commits"""
+    bump_version(CATALOG_VERSION)
+
+
+def quiz_status(start_time, end_time, now):
+    if not start_time:
+        return 'upcoming'
+    if now < start_time:
+        return 'upcoming'
+    elif now > end_time:
+        return 'expired'
+    return 'active'
+
+
+class StatusTemplate:
+    """Serialized JSON with a placeholder for each quiz status, in the order of `windows`"""
+
+    def __init__(self, data):
+        self.windows = []
+        self._data = data
+
+    def add_quiz(self, start_time, end_time):
+        self.windows.append((start_time, end_time))
+        return None
+
+    def seal(self):
+        body = json.dumps(self._data, separators=(',', ':'))
+        self.fragments = body.replace('"status":null', '"status":' + STATUS_PLACEHOLDER).split(STATUS_PLACEHOLDER)
+        del self._data
+        return self
+
+    def render(self, now):
+        parts = [self.fragments[0]]
+        for (start_time, end_time), fragment in zip(self.windows, self.fragments[1:]):
+            parts.append(json.dumps(quiz_status(start_time, end_time, now)))
+            parts.append(fragment)
+        return ''.join(parts)
+
+
+class CatalogSnapshot:
+    """Subjects, chapters and quizzes of one catalog version, serialized once"""
+
+    def __init__(self, version):
+        self.version = version
+        subjects = Subject.query.options(
+            selectinload(Subject.chapters).selectinload(Chapter.quizzes)
+        ).order_by(Subject.id).all()
+        self.question_counts = {}
+
+        windows = {}
+        tree, flat_subjects, flat_chapters, flat_quizzes = [], [], [], []
+        tree_template = StatusTemplate(tree)
+        for subject in subjects:
+            flat_subjects.append({'id': subject.id, 'name': subject.name, 'description': subject.description})
+            subject_entry = {'id': subject.id, 'name': subject.name, 'description': subject.description,
+                             'chapters': []}
+            for chapter in sorted(subject.chapters, key=lambda c: c.id):
+                flat_chapters.append({'id': chapter.id, 'name': chapter.name,
+                                      'description': chapter.description, 'subject_id': subject.id})
+                chapter_entry = {'id': chapter.id, 'name': chapter.name, 'description': chapter.description,
+                                 'quizzes': []}
+                for quiz in sorted(chapter.quizzes, key=lambda q: q.id):
+                    start_time = quiz.start_datetime.replace(tzinfo=IST) if quiz.start_datetime else None
+                    end_time = quiz.end_datetime.replace(tzinfo=IST) if quiz.end_datetime else None
+                    windows[quiz.id] = (start_time, end_time)
+                    self.question_counts[quiz.id] = quiz.question_count
+                    entry = {
+                        'id': quiz.id,
+                        'title': quiz.title,
+                        'start_datetime': quiz.start_datetime.isoformat() if quiz.start_datetime else None,
+                        'duration_hours': quiz.duration_hours,
+                        'duration_minutes': quiz.duration_minutes,
+                        'end_datetime': quiz.end_datetime.isoformat() if quiz.end_datetime else None,
+                        'question_count': quiz.question_count,
+                        'status': tree_template.add_quiz(start_time, end_time)
+                    }
+                    chapter_entry['quizzes'].append(entry)
+                    flat_quizzes.append(dict(entry, chapter_id=chapter.id))
+                subject_entry['chapters'].append(chapter_entry)
+            tree.append(subject_entry)
+
+        self.quiz_titles = {quiz['id']: quiz['title'] for quiz in flat_quizzes}
+        self.tree = tree_template.seal()
+
+        flat_quizzes.sort(key=lambda q: q['id'])
+        self.lists = StatusTemplate({'subjects': flat_subjects, 'chapters': flat_chapters, 'quizzes': flat_quizzes})
+        for quiz in flat_quizzes:
+            self.lists.add_quiz(*windows[quiz['id']])
+        self.lists.seal()
+
+        # Every quiz status is fixed between two consecutive window boundaries
+        self._starts = sorted(start for start, _ in windows.values() if start)
+        self._ends = sorted(end for _, end in windows.values() if end)
+
+    def status_epoch(self, now):
+        """Identifies the current set of quiz statuses; changes only when a quiz starts or ends"""
+        return bisect_right(self._starts, now), bisect_left(self._ends, now)
+
+
+def catalog_snapshot():
+    """The cached snapshot for the current catalog version, rebuilt when the version moves"""
+    global _cached_snapshot
+    version = current_version(CATALOG_VERSION)
+    snapshot = _cached_snapshot
+    if snapshot is None or snapshot.version != version:
+        with _build_lock:
+            snapshot = _cached_snapshot
+            if snapshot is None or snapshot.version != version:
+                snapshot = _cached_snapshot = CatalogSnapshot(version)
+    return snapshot
+
+
+def catalog_tree_json(now=None):
+    """Return the subjects -> chapters -> quizzes tree as JSON, with each quiz's status as of now"""
+    return catalog_snapshot().tree.render(now or datetime.datetime.now(IST))
+
+
+def quiz_history(user_id, snapshot=None):
+    """A user's attempts with quiz titles and question counts taken from the catalog snapshot"""
+    snapshot = snapshot or catalog_snapshot()
+    scores = db.session.query(Score.quiz_id, Score.score, Score.date_taken).filter(
+        Score.user_id == user_id
+    ).order_by(Score.id).all()
+    return [{
+        'quiz_id': quiz_id,
+        'quiz_title': snapshot.quiz_titles.get(quiz_id),
+        'score': score,
+        'total_questions': snapshot.question_counts.get(quiz_id, 0),
+        'date_taken': date_taken.strftime('%Y-%m-%d %H:%M:%S')
+    } for quiz_id, score, date_taken in scores]
@@ -13,9 +13,13 @@ def init_celery(app: Flask):
         timezone='UTC',
         beat_schedule={
             'send-daily-quiz-reminder': {
-                'task': 'backend.tasks.send_daily_quiz_reminder',
+                'task': 'tasks.send_daily_quiz_reminder',
                 'schedule': 3600.0,  # Run every hour (adjust as needed)
             },
+            'finalize-expired-attempts': {
+                'task': 'attempts.finalize_expired_attempts',
+                'schedule': 60.0,  # Grade attempts left open past their deadline
+            },
         }
     )
 
@@ -0,0 +1,58 @@
+import os
+import sqlite3
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Engine, make_url
+
+DEFAULT_DATABASE_URL = 'sqlite:///quiz_master2.db'
+
+# Read by the connect hook, which runs outside any app context
+_sqlite_settings = {'busy_timeout': 5000}
+
+
+def database_url():
+    url = os.getenv('DATABASE_URL', DEFAULT_DATABASE_URL)
+    # Heroku-style URLs use a scheme SQLAlchemy no longer accepts
+    if url.startswith('postgres://'):
+        url = 'postgresql://' + url[len('postgres://'):]
+    return url
+
+
+def engine_options(url):
+    """Engine options for the configured backend; pool settings only apply to server databases"""
+    if make_url(url).get_backend_name() == 'sqlite':
+        return {}
+    return {
+        'pool_size': int(os.getenv('DB_POOL_SIZE', 10)),
+        'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', 20)),
+        'pool_timeout': int(os.getenv('DB_POOL_TIMEOUT', 30)),
+        'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', 1800)),
+        'pool_pre_ping': os.getenv('DB_POOL_PRE_PING', '1') != '0'
+    }
+
+
+def dialect_insert(bind, table):
+    """INSERT construct for the bound database that supports on_conflict_do_nothing()"""
+    insert = postgresql.insert if bind.dialect.name == 'postgresql' else sqlite.insert
+    return insert(table)
+
+
+def init_database_config(app):
+    """Load the database URI and engine options into the app config"""
+    url = database_url()
+    app.config['SQLALCHEMY_DATABASE_URI'] = url
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(url)
+    app.config['SQLITE_BUSY_TIMEOUT_MS'] = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', 5000))
+    _sqlite_settings['busy_timeout'] = app.config['SQLITE_BUSY_TIMEOUT_MS']
+
+
+# Let readers run alongside the writer and wait for the write lock instead of failing
+@event.listens_for(Engine, 'connect')
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA busy_timeout = {int(_sqlite_settings['busy_timeout'])}")
+    cursor.execute('PRAGMA journal_mode = WAL')
+    cursor.execute('PRAGMA synchronous = NORMAL')
+    cursor.close()
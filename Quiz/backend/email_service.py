@@ -1,14 +1,18 @@
 from flask_mail import Mail, Message
-from models import User
+from celery import shared_task
+from models import db, User
 import os
+import logging
+import smtplib
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
+logger = logging.getLogger(__name__)
 mail_settings = {
-    'MAIL_SERVER': 'smtp.gmail.com',
-    'MAIL_PORT': 587,
-    'MAIL_USE_TLS': True,
+    'MAIL_SERVER': os.getenv('MAIL_SERVER', 'smtp.gmail.com'),
+    'MAIL_PORT': int(os.getenv('MAIL_PORT', 587)),
+    'MAIL_USE_TLS': os.getenv('MAIL_USE_TLS', '1') != '0',
     'MAIL_USERNAME': os.getenv('MAIL_USERNAME'),
     'MAIL_PASSWORD': os.getenv('MAIL_PASSWORD'),
     'MAIL_DEFAULT_SENDER': os.getenv('MAIL_DEFAULT_SENDER')
@@ -24,7 +28,7 @@ def init_mail(app):
 def send_registration_confirmation(user):
     """Send a confirmation email to newly registered user"""
     if not mail:
-        print("Mail not initialized")
+        logger.warning("Mail not initialized")
         return
         
     try:
@@ -48,39 +52,99 @@ def send_registration_confirmation(user):
             """
         )
         mail.send(msg)
-        print(f"Registration confirmation email sent to {user.email}")
+        logger.info("Registration confirmation email sent to %s", user.email)
     except Exception as e:
-        print(f"Failed to send registration email: {str(e)}")
+        logger.error("Failed to send registration email: %s", e)
+
+# Recipients per batch task; each batch reuses one SMTP connection
+MAIL_BATCH_SIZE = int(os.getenv('MAIL_BATCH_SIZE', 100))
+# Retries for recipients whose send failed, with exponential backoff starting at this many seconds
+MAIL_MAX_RETRIES = int(os.getenv('MAIL_MAX_RETRIES', 5))
+MAIL_RETRY_BACKOFF = int(os.getenv('MAIL_RETRY_BACKOFF', 30))
+
+def new_quiz_message(email, full_name, quiz_title, quiz_subject):
+    return Message(
+        subject=f"New Quiz Available: {quiz_title}",
+        recipients=[email],
+        body=f"""
+        Hello {full_name},
+
+        A new quiz has been added to Quiz Master!
+
+        Quiz Details:
+        - Title: {quiz_title}
+        - Subject: {quiz_subject}
+
+        Login to your account to take the quiz and test your knowledge!
+
+        Best regards,
+        Quiz Master Team
+        """
+    )
 
 def send_new_quiz_notification(quiz_title, quiz_subject):
-    """Send notification to all non-admin users about a new quiz"""
-    if not mail:
-        print("Mail not initialized")
-        return
-        
+    """Queue a notification to all non-admin users about a new quiz"""
     try:
-        users = User.query.filter(User.role != 'admin').all()
-        
-        for user in users:
-            msg = Message(
-                subject=f"New Quiz Available: {quiz_title}",
-                recipients=[user.email],
-                body=f"""
-                Hello {user.full_name},
-
-                A new quiz has been added to Quiz Master!
-
-                Quiz Details:
-                - Title: {quiz_title}
-                - Subject: {quiz_subject}
-
-                Login to your account to take the quiz and test your knowledge!
-
-                Best regards,
-                Quiz Master Team
-                """
-            )
-            mail.send(msg)
-        print(f"New quiz notification sent to {len(users)} users")
+        notify_new_quiz.delay(quiz_title, quiz_subject)
     except Exception as e:
-        print(f"Failed to send new quiz notification: {str(e)}")
+        logger.error("Failed to queue new quiz notification: %s", e)
+
+@shared_task
+def notify_new_quiz(quiz_title, quiz_subject):
+    """Split the non-admin users into batches and queue one send task per batch"""
+    users = db.session.query(User.email, User.full_name).filter(
+        User.role != 'admin'
+    ).order_by(User.id).yield_per(1000)
+
+    batches = 0
+    batch = []
+    for email, full_name in users:
+        batch.append((email, full_name))
+        if len(batch) >= MAIL_BATCH_SIZE:
+            send_new_quiz_batch.delay(batch, quiz_title, quiz_subject)
+            batches += 1
+            batch = []
+    if batch:
+        send_new_quiz_batch.delay(batch, quiz_title, quiz_subject)
+        batches += 1
+    logger.info("New quiz notification for %s queued in %d batches", quiz_title, batches)
+
+def send_messages(messages):
+    """Send (key, Message) pairs over one SMTP connection; returns the keys whose send failed"""
+    failed = []
+    attempted = 0
+    try:
+        with mail.connect() as connection:
+            for key, message in messages:
+                try:
+                    connection.send(message)
+                except smtplib.SMTPServerDisconnected:
+                    raise
+                except Exception as e:
+                    logger.warning("Failed to send email to %s: %s", message.recipients, e)
+                    failed.append(key)
+                attempted += 1
+    except Exception as e:
+        # Could not connect or the connection dropped: everyone not attempted yet failed
+        logger.warning("SMTP connection failed: %s", e)
+        failed.extend(key for key, _ in messages[attempted:])
+    return failed
+
+def retry_failed(task, failed, args):
+    """Retry a batch task for its failed recipients with exponential backoff"""
+    if task.request.retries >= task.max_retries:
+        logger.error("Giving up on %s for %d recipients", task.name, len(failed))
+        return
+    raise task.retry(args=args, countdown=MAIL_RETRY_BACKOFF * (2 ** task.request.retries))
+
+@shared_task(bind=True, max_retries=MAIL_MAX_RETRIES)
+def send_new_quiz_batch(self, recipients, quiz_title, quiz_subject):
+    """Send one batch over a single SMTP connection; retry only the recipients that failed"""
+    messages = [
+        ((email, full_name), new_quiz_message(email, full_name, quiz_title, quiz_subject))
+        for email, full_name in recipients
+    ]
+    failed = send_messages(messages)
+    logger.info("New quiz notification sent to %d of %d users", len(recipients) - len(failed), len(recipients))
+    if failed:
+        retry_failed(self, failed, (failed, quiz_title, quiz_subject))
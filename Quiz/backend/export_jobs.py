@@ -0,0 +1,178 @@
+import datetime
+import hashlib
+import json
+import os
+import re
+import time
+from celery import shared_task
+from flask import current_app
+from models import User
+from reports import user_performance_rows, generate_user_performance_csv
+
+JOB_ID_PATTERN = re.compile(r'^[0-9a-f]{20}$')
+
+# Write the job progress every this many rows
+PROGRESS_EVERY = 500
+
+
+def build_user_performance_export():
+    """Return (row count, CSV chunks) for the user performance report"""
+    return User.query.count(), generate_user_performance_csv(user_performance_rows())
+
+
+# Reports that can be exported in the background
+EXPORT_REPORTS = {
+    'user-performance': {
+        'build': build_user_performance_export,
+        'filename': 'user_performance_report',
+        'extension': 'csv',
+        'mimetype': 'text/csv'
+    }
+}
+
+
+class ExportDispatchError(Exception):
+    """Raised when an export job could not be handed to Celery"""
+
+
+def export_dir():
+    path = current_app.config.get('EXPORT_DIR') or os.path.join(current_app.instance_path, 'exports')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def export_ttl():
+    return int(current_app.config.get('EXPORT_TTL_SECONDS', 600))
+
+
+def export_job_id(report, params=None):
+    """Same report and params always give the same job id, so repeat requests share one job"""
+    key = json.dumps({'report': report, 'params': params or {}}, sort_keys=True)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:20]
+
+
+def _job_path(job_id, suffix):
+    if not JOB_ID_PATTERN.match(job_id):
+        raise ValueError('Invalid job id')
+    return os.path.join(export_dir(), f'{job_id}.{suffix}')
+
+
+def artifact_path(job):
+    return _job_path(job['job_id'], EXPORT_REPORTS[job['report']]['extension'])
+
+
+def _write_job(job):
+    path = _job_path(job['job_id'], 'json')
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(job, f)
+    os.replace(tmp_path, path)
+
+
+def _remove_job(job_id):
+    for suffix in ('json', 'lock', 'csv', 'csv.part'):
+        try:
+            os.remove(_job_path(job_id, suffix))
+        except FileNotFoundError:
+            pass
+
+
+def read_job(job_id):
+    """Load a job's metadata, or None if it does not exist or has expired"""
+    try:
+        with open(_job_path(job_id, 'json')) as f:
+            job = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    if job['expires_at'] <= time.time():
+        _remove_job(job_id)
+        return None
+    return job
+
+
+def purge_expired_exports():
+    """Delete artifacts and job files past their TTL"""
+    now = time.time()
+    for name in os.listdir(export_dir()):
+        job_id = name.split('.', 1)[0]
+        if not JOB_ID_PATTERN.match(job_id):
+            continue
+        path = os.path.join(export_dir(), name)
+        if name.endswith('.json'):
+            read_job(job_id)
+        elif os.path.exists(path) and os.path.getmtime(path) + export_ttl() <= now:
+            _remove_job(job_id)
+
+
+def start_export(report):
+    """Start an export job, or return the live one for the same report within the TTL"""
+    purge_expired_exports()
+    job_id = export_job_id(report)
+
+    job = read_job(job_id)
+    if job and job['status'] == 'failed':
+        _remove_job(job_id)
+        job = None
+    if job:
+        return job
+
+    # Claim the job so two admins starting the same export enqueue a single task
+    try:
+        os.close(os.open(_job_path(job_id, 'lock'), os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+    except FileExistsError:
+        return read_job(job_id) or {'job_id': job_id, 'report': report, 'status': 'pending', 'progress': 0}
+
+    now = time.time()
+    job = {
+        'job_id': job_id,
+        'report': report,
+        'status': 'pending',
+        'progress': 0,
+        'rows': 0,
+        'error': None,
+        'created_at': now,
+        'expires_at': now + export_ttl()
+    }
+    _write_job(job)
+
+    try:
+        run_export.delay(job_id)
+    except Exception as e:
+        job.update(status='failed', error=str(e))
+        _write_job(job)
+        raise ExportDispatchError(str(e))
+    return job
+
+
+def export_download_name(job):
+    report = EXPORT_REPORTS[job['report']]
+    created = datetime.datetime.fromtimestamp(job['created_at']).strftime('%Y%m%d_%H%M%S')
+    return f"{report['filename']}_{created}.{report['extension']}"
+
+
+@shared_task
+def run_export(job_id):
+    """Build an export artifact on disk, recording progress in the job file"""
+    job = read_job(job_id)
+    if not job or job['status'] != 'pending':
+        return
+
+    job['status'] = 'running'
+    _write_job(job)
+
+    path = artifact_path(job)
+    part_path = path + '.part'
+    try:
+        total, chunks = EXPORT_REPORTS[job['report']]['build']()
+        rows = 0
+        with open(part_path, 'w', newline='') as f:
+            for rows, chunk in enumerate(chunks):
+                f.write(chunk)
+                if rows and rows % PROGRESS_EVERY == 0:
+                    job.update(rows=rows, progress=min(99, int(rows * 100 / total)) if total else 0)
+                    _write_job(job)
+        os.replace(part_path, path)
+        job.update(status='done', rows=rows, progress=100, finished_at=time.time())
+    except Exception as e:
+        job.update(status='failed', error=str(e))
+    _write_job(job)
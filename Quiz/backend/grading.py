@@ -0,0 +1,98 @@
+import threading
+from array import array
+from bisect import bisect_left
+from models import db, Question
+from versions import KeyedLocks, bump_version, current_version
+
+# Answers may arrive as option letters or as option numbers 1-4
+OPTION_LETTERS = {'A': 1, 'B': 2, 'C': 3, 'D': 4}
+
+_answer_keys = {}
+_lock = threading.Lock()
+_build_locks = KeyedLocks()
+
+
+class AnswerError(ValueError):
+    """Submitted answers that cannot be graded"""
+
+
+class AnswerKey:
+    """Correct options of one quiz: sorted question ids with a parallel byte array of options"""
+    __slots__ = ('version', 'question_ids', 'correct_options')
+
+    def __init__(self, version, rows):
+        self.version = version
+        self.question_ids = array('l', (question_id for question_id, _ in rows))
+        self.correct_options = bytes(correct_option for _, correct_option in rows)
+
+    def __len__(self):
+        return len(self.question_ids)
+
+    def correct_option(self, question_id):
+        position = bisect_left(self.question_ids, question_id)
+        if position < len(self.question_ids) and self.question_ids[position] == question_id:
+            return self.correct_options[position]
+        return None
+
+
+def _answer_key_version(quiz_id):
+    return f'answer-key:{quiz_id}'
+
+
+def invalidate_answer_key(quiz_id):
+    """Drop a quiz's cached answer key once the current transaction commits"""
+    bump_version(_answer_key_version(quiz_id))
+
+
+def get_answer_key(quiz_id):
+    version = current_version(_answer_key_version(quiz_id))
+    key = _answer_keys.get(quiz_id)
+    if key is None or key.version != version:
+        # Concurrent graders of the same quiz wait for one query instead of each running it
+        with _build_locks(quiz_id):
+            key = _answer_keys.get(quiz_id)
+            if key is None or key.version != version:
+                rows = db.session.query(Question.id, Question.correct_option).filter_by(
+                    quiz_id=quiz_id
+                ).order_by(Question.id).all()
+                key = AnswerKey(version, rows)
+                with _lock:
+                    _answer_keys[quiz_id] = key
+    return key
+
+
+def parse_option(value):
+    if isinstance(value, str):
+        value = value.strip().upper()
+        if value in OPTION_LETTERS:
+            return OPTION_LETTERS[value]
+    try:
+        option = int(value)
+    except (TypeError, ValueError):
+        return None
+    return option if 1 <= option <= 4 else None
+
+
+def grade_answers(quiz_id, answers):
+    """Score {question_id: option} against the quiz's answer key; returns (score, total questions).
+
+    Keys are compared as integers, so "12" and " 12" are the same question; a question
+    answered under two spellings raises AnswerError rather than scoring twice.
+    """
+    key = get_answer_key(quiz_id)
+    given = {}
+    for question_id, answer in answers.items():
+        try:
+            question_id = int(question_id)
+        except (TypeError, ValueError):
+            continue
+        if question_id in given:
+            raise AnswerError(f"Question {question_id} is answered more than once")
+        given[question_id] = answer
+
+    score = 0
+    for question_id, answer in given.items():
+        correct = key.correct_option(question_id)
+        if correct is not None and parse_option(answer) == correct:
+            score += 1
+    return score, len(key)
@@ -0,0 +1,69 @@
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app
+from flask_jwt_extended import get_jwt
+from models import db, User
+
+
+class TTLCache:
+    """Small thread-safe LRU cache whose entries also expire after `ttl` seconds"""
+
+    def __init__(self, max_size=10000, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# Only tokens issued before the uid claim existed need this: email -> user id
+_user_ids_by_email = TTLCache()
+
+
+def current_user_id():
+    """The caller's user id, read from the JWT without touching the database"""
+    claims = get_jwt()
+    if 'uid' in claims:
+        return claims['uid']
+
+    # Tokens issued before the uid claim existed only carry the email
+    email = claims['sub']
+    user_id = _user_ids_by_email.get(email)
+    if user_id is None:
+        user_id = db.session.query(User.id).filter_by(email=email).scalar()
+        if user_id is not None:
+            _user_ids_by_email.ttl = current_app.config.get('IDENTITY_CACHE_TTL', 300)
+            _user_ids_by_email.put(email, user_id)
+    return user_id
+
+
+def invalidate_user(email):
+    """Forget a deleted user's email, so a new account with it is not resolved to the old id"""
+    _user_ids_by_email.invalidate(email)
@@ -0,0 +1,239 @@
+"""Per-request SQL instrumentation and Prometheus metrics.
+
+While a request runs, every SQL statement it issues is counted and timed, the
+slowest one is kept, and statements are grouped by fingerprint (the SQL text with
+expanded IN lists collapsed). A fingerprint repeated N_PLUS_ONE_THRESHOLD times in
+one request is logged as a likely N+1 pattern. Per-endpoint histograms are served
+in the Prometheus text format at /metrics, and with SERVER_TIMING set each
+response carries a Server-Timing header.
+
+query_budget() applies the same counting to any block of code, e.g. to assert
+that an endpoint stays within a number of queries.
+"""
+import contextvars
+import logging
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from flask import Blueprint, Response, current_app, g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+# Collectors of the current request (and any enclosing query_budget); empty almost always
+_collectors = contextvars.ContextVar('sql_collectors', default=())
+_in_list = re.compile(r'\((?:\s*[?]\s*,)+\s*[?]\s*\)|\((?:\s*%\(\w+\)s\s*,)+\s*%\(\w+\)s\s*\)')
+
+metrics = Blueprint('metrics', __name__)
+
+
+def fingerprint(statement):
+    """SQL text with whitespace normalized and expanded IN lists collapsed"""
+    return _in_list.sub('(?)', ' '.join(statement.split()))
+
+
+class QueryStats:
+    """SQL issued during one request or query_budget() block"""
+    __slots__ = ('queries', 'seconds', 'slowest', 'slowest_statement', 'fingerprints')
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+        self.slowest = 0.0
+        self.slowest_statement = None
+        self.fingerprints = Counter()
+
+    def record(self, statement, seconds):
+        self.queries += 1
+        self.seconds += seconds
+        if seconds >= self.slowest:
+            self.slowest = seconds
+            self.slowest_statement = statement
+        self.fingerprints[fingerprint(statement)] += 1
+
+    def repeated(self, threshold):
+        """(fingerprint, count) of statements run at least `threshold` times"""
+        return [(sql, count) for sql, count in self.fingerprints.most_common() if count >= threshold]
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _collectors.get():
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    collectors = _collectors.get()
+    started = conn.info.get('query_started')
+    if not collectors or not started:
+        return
+    elapsed = time.perf_counter() - started.pop()
+    for stats in collectors:
+        stats.record(statement, elapsed)
+
+
+def _push(stats):
+    return _collectors.set(_collectors.get() + (stats,))
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+@contextmanager
+def query_budget(max_queries):
+    """Fail with QueryBudgetExceeded if the block issues more than `max_queries` statements.
+
+        with query_budget(3):
+            client.get('/api/subjects', headers=headers)
+    """
+    stats = QueryStats()
+    token = _push(stats)
+    try:
+        yield stats
+    finally:
+        _collectors.reset(token)
+    if stats.queries > max_queries:
+        repeated = ''.join(f"\n  {count}x {sql[:200]}" for sql, count in stats.repeated(2))
+        raise QueryBudgetExceeded(f"{stats.queries} queries, budget {max_queries}{repeated}")
+
+
+class Histogram:
+    def __init__(self, name, documentation, buckets, labelnames):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        self.labelnames = labelnames
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for labels, (counts, total, count) in sorted(self._series.items()):
+                label_text = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, labels))
+                for bound, bucket_count in zip(self.buckets, counts):
+                    lines.append(f'{self.name}_bucket{{{label_text},le="{bound}"}} {bucket_count}')
+                lines.append(f'{self.name}_bucket{{{label_text},le="+Inf"}} {count}')
+                lines.append(f'{self.name}_sum{{{label_text}}} {total}')
+                lines.append(f'{self.name}_count{{{label_text}}} {count}')
+        return lines
+
+
+class CounterMetric:
+    def __init__(self, name, documentation, labelnames):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = Counter()
+        self._lock = threading.Lock()
+
+    def inc(self, labels, amount=1):
+        with self._lock:
+            self._values[labels] += amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                label_text = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, labels))
+                lines.append(f'{self.name}{{{label_text}}} {value}')
+        return lines
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+LABELS = ('method', 'endpoint')
+REQUEST_SECONDS = Histogram('quiz_request_duration_seconds', 'Request handling time.', DURATION_BUCKETS, LABELS)
+SQL_QUERIES = Histogram('quiz_request_sql_queries', 'SQL statements issued per request.', QUERY_BUCKETS, LABELS)
+SQL_SECONDS = Histogram('quiz_request_sql_seconds', 'Time spent in SQL per request.', DURATION_BUCKETS, LABELS)
+SLOWEST_SQL_SECONDS = Histogram('quiz_request_slowest_sql_seconds', 'Slowest SQL statement per request.',
+                                DURATION_BUCKETS, LABELS)
+N_PLUS_ONE = CounterMetric('quiz_request_n_plus_one_total',
+                           'Requests that repeated one SQL statement N_PLUS_ONE_THRESHOLD times or more.', LABELS)
+ALL_METRICS = (REQUEST_SECONDS, SQL_QUERIES, SQL_SECONDS, SLOWEST_SQL_SECONDS, N_PLUS_ONE)
+
+
+def _endpoint_labels():
+    return request.method, request.url_rule.rule if request.url_rule else 'unmatched'
+
+
+def _start_request():
+    g.query_stats = QueryStats()
+    g.query_stats_token = _push(g.query_stats)
+    g.request_started = time.perf_counter()
+
+
+def _finish_request(response):
+    stats = g.get('query_stats')
+    if stats is None:
+        return response
+    elapsed = time.perf_counter() - g.request_started
+    labels = _endpoint_labels()
+    REQUEST_SECONDS.observe(labels, elapsed)
+    SQL_QUERIES.observe(labels, stats.queries)
+    SQL_SECONDS.observe(labels, stats.seconds)
+    SLOWEST_SQL_SECONDS.observe(labels, stats.slowest)
+
+    config = current_app.config
+    repeated = stats.repeated(config.get('N_PLUS_ONE_THRESHOLD', 5))
+    if repeated:
+        N_PLUS_ONE.inc(labels)
+        logger.warning("Possible N+1 queries in %s %s", *labels,
+                       extra={'repeated': [{'count': count, 'sql': sql[:500]} for sql, count in repeated]})
+    if stats.slowest >= config.get('SLOW_QUERY_SECONDS', 0.25):
+        logger.warning("Slow SQL in %s %s", *labels,
+                       extra={'sql_seconds': round(stats.slowest, 4), 'sql': stats.slowest_statement[:500]})
+    if config.get('SERVER_TIMING'):
+        response.headers.add('Server-Timing', f'db;dur={stats.seconds * 1000:.1f};desc="{stats.queries} queries"')
+        response.headers.add('Server-Timing', f'app;dur={elapsed * 1000:.1f}')
+        # Browsers only show Server-Timing to other origins when allowed; the API already serves any origin
+        response.headers['Timing-Allow-Origin'] = '*'
+    return response
+
+
+def _end_request(exc):
+    token = g.pop('query_stats_token', None)
+    if token is not None:
+        _collectors.reset(token)
+
+
+@metrics.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    token = current_app.config.get('METRICS_TOKEN')
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return Response('Forbidden\n', status=403, mimetype='text/plain')
+    lines = []
+    for metric in ALL_METRICS:
+        lines.extend(metric.render())
+    return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+
+def init_instrumentation(app):
+    """Instrument every request unless REQUEST_METRICS is off"""
+    if not app.config.get('REQUEST_METRICS', True):
+        return
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.teardown_request(_end_request)
+    app.register_blueprint(metrics)
@@ -0,0 +1,343 @@
+"""Per-quiz, per-chapter and global leaderboards in Redis sorted sets.
+
+A user's entry on a quiz board is their best score on that quiz; on a chapter
+board and on the global board it is the sum of their best quiz scores. Boards
+are updated after every inserted score and can be rebuilt from the Score table.
+Reads (top N, a user's rank) are O(log n) sorted-set lookups with no SQL.
+
+Without a reachable Redis (or with LEADERBOARD_BACKEND=memory) an in-process
+store with the same semantics is used, which is enough for a single process
+and for offline testing. It is rebuilt from the Score table at startup.
+"""
+import logging
+import threading
+from bisect import bisect_left, insort
+import redis
+from sqlalchemy import func
+from models import db, Quiz, Score
+
+logger = logging.getLogger(__name__)
+
+GLOBAL_KEY = 'leaderboard:global'
+
+
+def quiz_key(quiz_id):
+    return f'leaderboard:quiz:{quiz_id}'
+
+
+def chapter_key(chapter_id):
+    return f'leaderboard:chapter:{chapter_id}'
+
+
+# KEYS: quiz, chapter, global boards; ARGV: member, score.
+# Raise the member's best on the quiz board and add the improvement to the other two.
+SUBMIT_SCRIPT = """
+local old = redis.call('ZSCORE', KEYS[1], ARGV[1])
+local new = tonumber(ARGV[2])
+if old and tonumber(old) >= new then
+    return 0
+end
+redis.call('ZADD', KEYS[1], new, ARGV[1])
+local delta = new - (tonumber(old) or 0)
+redis.call('ZINCRBY', KEYS[2], delta, ARGV[1])
+redis.call('ZINCRBY', KEYS[3], delta, ARGV[1])
+return 1
+"""
+
+# KEYS: quiz, chapter, global boards. Take a deleted quiz's scores back out of the totals,
+# dropping members left with nothing.
+DISCARD_SCRIPT = """
+local entries = redis.call('ZRANGE', KEYS[1], 0, -1, 'WITHSCORES')
+for i = 1, #entries, 2 do
+    for k = 2, 3 do
+        if tonumber(redis.call('ZINCRBY', KEYS[k], -tonumber(entries[i + 1]), entries[i])) <= 0 then
+            redis.call('ZREM', KEYS[k], entries[i])
+        end
+    end
+end
+redis.call('DEL', KEYS[1])
+return #entries / 2
+"""
+
+# KEYS: quiz, old chapter, new chapter boards. Move a quiz's scores between chapter totals.
+MOVE_SCRIPT = """
+local entries = redis.call('ZRANGE', KEYS[1], 0, -1, 'WITHSCORES')
+for i = 1, #entries, 2 do
+    local score = tonumber(entries[i + 1])
+    if tonumber(redis.call('ZINCRBY', KEYS[2], -score, entries[i])) <= 0 then
+        redis.call('ZREM', KEYS[2], entries[i])
+    end
+    redis.call('ZINCRBY', KEYS[3], score, entries[i])
+end
+return #entries / 2
+"""
+
+
+class RedisLeaderboardStore:
+    def __init__(self, client):
+        self.client = client
+        self._submit = client.register_script(SUBMIT_SCRIPT)
+        self._discard = client.register_script(DISCARD_SCRIPT)
+        self._move = client.register_script(MOVE_SCRIPT)
+
+    def submit(self, entries):
+        """Apply (keys, member, score) entries in one round trip"""
+        pipe = self.client.pipeline(transaction=False)
+        for keys, member, score in entries:
+            self._submit(keys=keys, args=[member, score], client=pipe)
+        pipe.execute()
+
+    def discard(self, keys):
+        self._discard(keys=keys)
+
+    def move(self, keys):
+        self._move(keys=keys)
+
+    def remove(self, keys, member):
+        pipe = self.client.pipeline(transaction=False)
+        for key in keys:
+            pipe.zrem(key, member)
+        pipe.execute()
+
+    def top(self, key, limit):
+        return self.client.zrevrange(key, 0, limit - 1, withscores=True)
+
+    def rank(self, key, member):
+        pipe = self.client.pipeline(transaction=False)
+        pipe.zrevrank(key, member)
+        pipe.zscore(key, member)
+        return tuple(pipe.execute())
+
+    def replace(self, boards):
+        """Swap in freshly built boards ({key: {member: score}}) and drop boards not in it"""
+        stale = set(self.client.scan_iter('leaderboard:*')) - {key.encode() for key in boards}
+        pipe = self.client.pipeline(transaction=True)
+        for key, entries in boards.items():
+            staging = f'{key}:rebuild'
+            pipe.delete(staging)
+            pending = list(entries.items())
+            for i in range(0, len(pending), 1000):
+                pipe.zadd(staging, dict(pending[i:i + 1000]))
+            pipe.rename(staging, key)
+        if stale:
+            pipe.delete(*stale)
+        pipe.execute()
+
+
+class SortedSet:
+    """Minimal sorted set: scores by member plus (score, member) pairs kept in order"""
+
+    def __init__(self):
+        self.scores = {}
+        self.ordered = []
+
+    def add(self, member, score):
+        self.remove(member)
+        self.scores[member] = score
+        insort(self.ordered, (score, member))
+
+    def remove(self, member):
+        old = self.scores.pop(member, None)
+        if old is not None:
+            del self.ordered[bisect_left(self.ordered, (old, member))]
+
+    def increment(self, member, amount):
+        """Add to a member's score; like the Lua scripts, drop it once nothing is left"""
+        score = self.scores.get(member, 0) + amount
+        if score <= 0 and amount < 0:
+            self.remove(member)
+        else:
+            self.add(member, score)
+
+    def rev_rank(self, member):
+        score = self.scores.get(member)
+        if score is None:
+            return None
+        return len(self.ordered) - 1 - bisect_left(self.ordered, (score, member))
+
+
+class MemoryLeaderboardStore:
+    """In-process stand-in for RedisLeaderboardStore, ordered the same way as ZREVRANGE"""
+
+    def __init__(self):
+        self.boards = {}
+        self._lock = threading.Lock()
+
+    def _board(self, key):
+        return self.boards.setdefault(key, SortedSet())
+
+    def submit(self, entries):
+        with self._lock:
+            for (quiz, chapter, overall), member, score in entries:
+                old = self._board(quiz).scores.get(member)
+                if old is not None and old >= score:
+                    continue
+                self._board(quiz).add(member, score)
+                delta = score - (old or 0)
+                for key in (chapter, overall):
+                    board = self._board(key)
+                    board.add(member, board.scores.get(member, 0) + delta)
+
+    def discard(self, keys):
+        quiz, chapter, overall = keys
+        with self._lock:
+            removed = self.boards.pop(quiz, SortedSet())
+            for key in (chapter, overall):
+                board = self._board(key)
+                for member, score in removed.scores.items():
+                    board.increment(member, -score)
+
+    def move(self, keys):
+        quiz, old_chapter, new_chapter = keys
+        with self._lock:
+            entries = list(self._board(quiz).scores.items())
+            for member, score in entries:
+                self._board(old_chapter).increment(member, -score)
+                self._board(new_chapter).increment(member, score)
+
+    def remove(self, keys, member):
+        with self._lock:
+            for key in keys:
+                board = self.boards.get(key)
+                if board is not None:
+                    board.remove(member)
+
+    def top(self, key, limit):
+        with self._lock:
+            board = self.boards.get(key)
+            if board is None:
+                return []
+            return [(member, score) for score, member in reversed(board.ordered[-limit:])] if limit > 0 else []
+
+    def rank(self, key, member):
+        with self._lock:
+            board = self.boards.get(key)
+            if board is None:
+                return None, None
+            return board.rev_rank(member), board.scores.get(member)
+
+    def replace(self, boards):
+        fresh = {}
+        for key, entries in boards.items():
+            board = fresh[key] = SortedSet()
+            for member, score in entries.items():
+                board.add(member, score)
+        with self._lock:
+            self.boards = fresh
+
+
+store = MemoryLeaderboardStore()
+
+
+def init_leaderboards(app):
+    """Use Redis when it answers, otherwise the in-process store, filled from the Score table"""
+    global store
+    if app.config.get('LEADERBOARD_BACKEND') != 'memory':
+        client = redis.Redis.from_url(app.config.get('LEADERBOARD_REDIS_URL', 'redis://localhost:6379/0'),
+                                      socket_timeout=2, socket_connect_timeout=2)
+        try:
+            client.ping()
+            store = RedisLeaderboardStore(client)
+            return store
+        except redis.RedisError as e:
+            logger.warning("Redis unavailable for leaderboards (%s); using the in-process store", e)
+    store = MemoryLeaderboardStore()
+    # Redis keeps its boards across restarts; this store starts empty
+    with app.app_context():
+        boards = rebuild_leaderboards()
+    logger.info("Built %d in-process leaderboards", boards)
+    return store
+
+
+def _member(user_id):
+    return str(user_id)
+
+
+def _score(value):
+    # Redis hands scores back as floats
+    value = float(value)
+    return int(value) if value.is_integer() else value
+
+
+def update_leaderboards(scores):
+    """Apply newly inserted (user_id, quiz_id, score, date_taken) rows to the boards.
+
+    Call after the scores are committed. A Redis failure is logged rather than
+    raised; the boards can be rebuilt from the Score table.
+    """
+    scores = [row for row in scores if row[2] is not None]
+    if not scores:
+        return
+    chapters = dict(db.session.query(Quiz.id, Quiz.chapter_id).filter(
+        Quiz.id.in_({quiz_id for _, quiz_id, _, _ in scores})
+    ))
+    entries = [
+        ([quiz_key(quiz_id), chapter_key(chapters[quiz_id]), GLOBAL_KEY], _member(user_id), score)
+        for user_id, quiz_id, score, _ in scores if quiz_id in chapters
+    ]
+    try:
+        store.submit(entries)
+    except redis.RedisError:
+        logger.exception("Failed to update leaderboards")
+
+
+def discard_quiz(quiz_id, chapter_id):
+    """Remove a deleted quiz's board and its share of the chapter and global totals"""
+    try:
+        store.discard([quiz_key(quiz_id), chapter_key(chapter_id), GLOBAL_KEY])
+    except redis.RedisError:
+        logger.exception("Failed to remove quiz %s from the leaderboards", quiz_id)
+
+
+def move_quiz(quiz_id, old_chapter_id, new_chapter_id):
+    """Move a quiz's scores from one chapter's totals to another's after the quiz changed chapter"""
+    if old_chapter_id == new_chapter_id:
+        return
+    try:
+        store.move([quiz_key(quiz_id), chapter_key(old_chapter_id), chapter_key(new_chapter_id)])
+    except redis.RedisError:
+        logger.exception("Failed to move quiz %s between chapter leaderboards", quiz_id)
+
+
+def discard_user(user_id, quiz_chapters):
+    """Take a deleted user off the global board and the boards of the (quiz_id, chapter_id) pairs they scored on"""
+    keys = {GLOBAL_KEY}
+    for quiz_id, chapter_id in quiz_chapters:
+        keys.update((quiz_key(quiz_id), chapter_key(chapter_id)))
+    try:
+        store.remove(sorted(keys), _member(user_id))
+    except redis.RedisError:
+        logger.exception("Failed to remove user %s from the leaderboards", user_id)
+
+
+def rebuild_leaderboards():
+    """Recompute every board from users' best score per quiz; returns the number of boards"""
+    best = db.session.query(
+        Score.quiz_id, Quiz.chapter_id, Score.user_id, func.max(Score.score)
+    ).join(Quiz, Quiz.id == Score.quiz_id).filter(
+        Score.score.isnot(None)
+    ).group_by(Score.quiz_id, Quiz.chapter_id, Score.user_id).yield_per(5000)
+
+    boards = {}
+    for quiz_id, chapter_id, user_id, score in best:
+        member = _member(user_id)
+        boards.setdefault(quiz_key(quiz_id), {})[member] = score
+        for key in (chapter_key(chapter_id), GLOBAL_KEY):
+            totals = boards.setdefault(key, {})
+            totals[member] = totals.get(member, 0) + score
+    store.replace(boards)
+    return len(boards)
+
+
+def leaderboard(key, user_id=None, limit=10):
+    """Top `limit` entries of a board and, if given, the user's own rank (1-based)"""
+    top = [
+        {'rank': position, 'user_id': int(member), 'score': _score(score)}
+        for position, (member, score) in enumerate(store.top(key, limit), start=1)
+    ]
+    result = {'top': top, 'me': None}
+    if user_id is not None:
+        rank, score = store.rank(key, _member(user_id))
+        if rank is not None:
+            result['me'] = {'rank': rank + 1, 'user_id': user_id, 'score': _score(score)}
+    return result
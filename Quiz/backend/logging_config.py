@@ -0,0 +1,76 @@
+import atexit
+import copy
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+
+# Attributes every LogRecord has; anything else was passed through `extra=` and goes into the JSON line
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'taskName'}
+
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Format each record as one JSON object per line"""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that renders the message on the caller and leaves the JSON to the listener"""
+
+    def prepare(self, record):
+        # Render %-args now, so a mutable argument changed after the call is logged as it was.
+        # The traceback and the JSON line are left to the listener thread.
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        return record
+
+
+def init_logging(level=None, stream=None):
+    """Route all logging through an in-memory queue drained by a background thread.
+
+    Request threads render the message and enqueue the record; formatting the
+    traceback, serializing the JSON line and the write to the stream happen on
+    the listener thread. Safe to call more than once.
+    """
+    global _listener
+    root = logging.getLogger()
+    root.setLevel((level or os.getenv('LOG_LEVEL', 'INFO')).upper())
+    if _listener is not None:
+        return
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(JsonFormatter())
+
+    log_queue = queue.SimpleQueue()
+    root.handlers = [_DeferredQueueHandler(log_queue)]
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+    """Flush queued records and stop the listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,135 @@
+import datetime
+import logging
+from sqlalchemy import inspect, select, text, update
+from sqlalchemy.schema import CreateIndex
+from database import dialect_insert
+from models import db, Chapter, Quiz, Question, Score, SchemaMigration, quiz_end_datetime
+from question_counts import repair_question_counts
+from stats import rebuild_stats
+
+logger = logging.getLogger(__name__)
+
+# (version, description, function), applied in version order and recorded in schema_migration
+MIGRATIONS = []
+
+
+def migration(version, description):
+    def register(fn):
+        MIGRATIONS.append((version, description, fn))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return fn
+    return register
+
+
+def _add_column(inspector, column):
+    """Add a model column to an existing table if it is missing; returns True if it was added"""
+    table = column.table.name
+    if column.name in {c['name'] for c in inspector.get_columns(table)}:
+        return False
+    dialect = db.engine.dialect
+    preparer = dialect.identifier_preparer
+    # Existing rows need the server default before a NOT NULL column can be added
+    default = ''
+    if column.server_default is not None:
+        default = f' DEFAULT {column.server_default.arg}'
+        if not column.nullable:
+            default = ' NOT NULL' + default
+    with db.engine.begin() as connection:
+        connection.execute(text(
+            f'ALTER TABLE {preparer.quote(table)} ADD COLUMN {preparer.quote(column.name)} '
+            f'{column.type.compile(dialect=dialect)}{default}'
+        ))
+    return True
+
+
+def _create_index(index):
+    """Create a model index if it is missing, without blocking writes on PostgreSQL"""
+    dialect = db.engine.dialect
+    ddl = str(CreateIndex(index, if_not_exists=True).compile(dialect=dialect))
+    if dialect.name == 'postgresql':
+        # CONCURRENTLY keeps the table writable during the build but cannot run in a transaction
+        ddl = ddl.replace('INDEX', 'INDEX CONCURRENTLY', 1)
+        with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+            connection.execute(text(ddl))
+    else:
+        with db.engine.begin() as connection:
+            connection.execute(text(ddl))
+
+
+@migration(1, 'Store quiz end_datetime')
+def add_quiz_end_datetime(inspector):
+    if _add_column(inspector, Quiz.__table__.c.end_datetime):
+        # Backfill the stored window for existing quizzes. Core only: the Quiz model may have
+        # columns that later migrations have not added yet
+        quiz = Quiz.__table__
+        with db.engine.begin() as connection:
+            rows = connection.execute(select(
+                quiz.c.id, quiz.c.start_datetime, quiz.c.duration_hours, quiz.c.duration_minutes
+            )).all()
+            for row in rows:
+                connection.execute(update(quiz).where(quiz.c.id == row.id).values(
+                    end_datetime=quiz_end_datetime(row.start_datetime, row.duration_hours, row.duration_minutes)
+                ))
+    for index in Quiz.__table__.indexes:
+        if index.name in ('ix_quiz_start_datetime', 'ix_quiz_end_datetime'):
+            _create_index(index)
+
+
+@migration(2, 'Add score attempt_key')
+def add_score_attempt_key(inspector):
+    # Its unique index, per user, is created by migration 6
+    _add_column(inspector, Score.__table__.c.attempt_key)
+
+
+@migration(3, 'Index foreign keys used by hot queries')
+def index_foreign_keys(inspector):
+    for model in (Score, Question, Quiz, Chapter):
+        for index in model.__table__.indexes:
+            _create_index(index)
+
+
+@migration(4, 'Store quiz question_count')
+def add_quiz_question_count(inspector):
+    _add_column(inspector, Quiz.__table__.c.question_count)
+    repair_question_counts()
+
+
+@migration(5, 'Backfill user and quiz score rollups')
+def backfill_score_rollups(inspector):
+    rebuild_stats()
+    db.session.commit()
+
+
+@migration(6, 'Make score attempt_key unique per user')
+def scope_score_attempt_key(inspector):
+    if 'ix_score_attempt_key' in {index['name'] for index in inspector.get_indexes('score')}:
+        with db.engine.begin() as connection:
+            connection.execute(text('DROP INDEX ix_score_attempt_key'))
+    for index in Score.__table__.indexes:
+        if index.name == 'uq_score_user_id_attempt_key':
+            _create_index(index)
+
+
+def applied_versions():
+    return {version for (version,) in db.session.query(SchemaMigration.version)}
+
+
+def upgrade_schema():
+    """Apply every migration the database has not recorded yet, in version order.
+
+    Migrations are idempotent, so a fresh database built by create_all() simply records
+    them, and several workers starting at once may run the same one safely.
+    """
+    done = applied_versions()
+    for version, description, fn in MIGRATIONS:
+        if version in done:
+            continue
+        logger.info("Applying schema migration %s: %s", version, description)
+        fn(inspect(db.engine))
+        db.session.execute(
+            dialect_insert(db.engine, SchemaMigration).values(
+                version=version, description=description,
+                applied_at=datetime.datetime.utcnow()
+            ).on_conflict_do_nothing(index_elements=['version'])
+        )
+        db.session.commit()
@@ -1,7 +1,9 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
 from flask_bcrypt import Bcrypt 
+from sqlalchemy import event
 import datetime as dt
+import passwords
 
 # This is the SQLAlchemy object that we will use to define our models (tables)
 #milestone-2 completed
@@ -25,10 +27,13 @@ class User(db.Model):
         return f"<User {self.email}>"
     
     def check_password (self, password):
-        return bcrypt.check_password_hash(self.password, password)
+        return passwords.check_password(self.password, password)
     
     def set_password(self, password):
-        self.password = bcrypt.generate_password_hash(password).decode('utf-8') #utf-8 converts from binary to text
+        self.password = passwords.hash_password(password) # hashed on the password process pool
+
+    def password_needs_rehash(self):
+        return passwords.needs_rehash(self.password)
 
 # ----------------------
 # Subject Table
@@ -48,7 +53,7 @@ class Chapter(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     description = db.Column(db.Text)
-    subject_id = db.Column(db.Integer, db.ForeignKey('subject.id'), nullable=False)
+    subject_id = db.Column(db.Integer, db.ForeignKey('subject.id'), nullable=False, index=True)
     quizzes = db.relationship('Quiz', backref='chapter', lazy=True)
 
     def __repr__(self):
@@ -56,22 +61,29 @@ class Chapter(db.Model):
 # ----------------------
 # Quiz Table
 # ----------------------
+def quiz_end_datetime(start_datetime, duration_hours, duration_minutes):
+    """End of a quiz window; a missing duration means 0 hours and 30 minutes"""
+    if not start_datetime:
+        return None
+    hours = duration_hours if duration_hours is not None else 0
+    minutes = duration_minutes if duration_minutes is not None else 30
+    return start_datetime + dt.timedelta(hours=hours, minutes=minutes)
+
 class Quiz(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    chapter_id = db.Column(db.Integer, db.ForeignKey('chapter.id'), nullable=False)
+    chapter_id = db.Column(db.Integer, db.ForeignKey('chapter.id'), nullable=False, index=True)
     title = db.Column(db.String(100), nullable=False)
-    start_datetime = db.Column(db.DateTime, nullable=False)  # Quiz start date and time
+    start_datetime = db.Column(db.DateTime, nullable=False, index=True)  # Quiz start date and time
+    end_datetime = db.Column(db.DateTime, index=True)  # start_datetime + duration, kept in sync on save
     duration_hours = db.Column(db.Integer, default=0)  # Hours part of duration
     duration_minutes = db.Column(db.Integer, default=30)  # Minutes part of duration
+    question_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # Kept in step with Question rows
     scores = db.relationship('Score', backref='quiz', lazy=True)
     questions = db.relationship('Question', backref='quiz', lazy=True)
 
-    @property
-    def end_datetime(self):
+    def compute_end_datetime(self):
         """Calculate the end datetime based on start time and duration"""
-        if not self.start_datetime:
-            return None
-        return self.start_datetime + dt.timedelta(hours=self.duration_hours, minutes=self.duration_minutes)
+        return quiz_end_datetime(self.start_datetime, self.duration_hours, self.duration_minutes)
 
     IST = dt.timezone(dt.timedelta(hours=5, minutes=30))
     @property
@@ -88,12 +100,18 @@ class Quiz(db.Model):
 
     def __repr__(self):
         return f"<Quiz {self.title}>"
+
+# Store the quiz window so "active now" is an indexed range query
+@event.listens_for(Quiz, 'before_insert')
+@event.listens_for(Quiz, 'before_update')
+def set_quiz_end_datetime(mapper, connection, quiz):
+    quiz.end_datetime = quiz.compute_end_datetime()
 # ----------------------
 # Question Table
 # ----------------------
 class Question(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    quiz_id = db.Column(db.Integer, db.ForeignKey('quiz.id'), nullable=False)
+    quiz_id = db.Column(db.Integer, db.ForeignKey('quiz.id'), nullable=False, index=True)
     question_text = db.Column(db.Text, nullable=False)
     option1 = db.Column(db.String(255), nullable=False)
     option2 = db.Column(db.String(255), nullable=False)
@@ -103,15 +121,134 @@ class Question(db.Model):
 
     def __repr__(self):
         return f"<Question {self.id}>"
+
+# Keep Quiz.question_count in step, inside the transaction that adds or removes the question
+@event.listens_for(Question, 'after_insert')
+def count_inserted_question(mapper, connection, question):
+    connection.execute(
+        Quiz.__table__.update().where(Quiz.id == question.quiz_id)
+        .values(question_count=Quiz.question_count + 1)
+    )
+
+@event.listens_for(Question, 'after_delete')
+def count_deleted_question(mapper, connection, question):
+    connection.execute(
+        Quiz.__table__.update().where(Quiz.id == question.quiz_id)
+        .values(question_count=Quiz.question_count - 1)
+    )
 # ----------------------
 # Score Table
 # ----------------------
 class Score(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    quiz_id = db.Column(db.Integer, db.ForeignKey('quiz.id'), nullable=False)
+    quiz_id = db.Column(db.Integer, db.ForeignKey('quiz.id'), nullable=False, index=True)
     score = db.Column(db.Integer)
     date_taken = db.Column(db.DateTime, default=datetime.utcnow)
+    attempt_key = db.Column(db.String(64))  # Client-supplied id that makes resubmits idempotent
+    __table_args__ = (
+        # A user's attempts, newest first, without a scan; also serves lookups by user_id alone
+        db.Index('ix_score_user_id_date_taken', 'user_id', 'date_taken'),
+        # Attempt keys come from clients, so they are only unique per user
+        db.Index('uq_score_user_id_attempt_key', 'user_id', 'attempt_key', unique=True),
+    )
+
+    def __repr__(self):
+        return f"<Score User:{self.user_id} Quiz:{self.quiz_id} Score:{self.score}>"
+# ----------------------
+# Attempt Session Table
+# ----------------------
+class AttemptSession(db.Model):
+    """A quiz attempt in progress, kept on the server so it survives a refresh or crash"""
+    id = db.Column(db.String(32), primary_key=True)  # Also the Score.attempt_key of the final score
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    quiz_id = db.Column(db.Integer, db.ForeignKey('quiz.id'), nullable=False)
+    started_at = db.Column(db.DateTime, nullable=False)  # IST, like the quiz window
+    deadline = db.Column(db.DateTime, nullable=False, index=True)
+    question_ids = db.Column(db.LargeBinary, nullable=False)  # int64 question ids, in answer order
+    answers = db.Column(db.LargeBinary, nullable=False)  # One byte per question: 0 unanswered, else option 1-4
+    revision = db.Column(db.Integer, nullable=False, default=0)  # Highest autosave sequence applied
+    status = db.Column(db.String(10), nullable=False, default='open')  # open or submitted
+    score = db.Column(db.Integer)
+    submitted_at = db.Column(db.DateTime)
+    # At most one open attempt per user and quiz
+    __table_args__ = (
+        db.Index('uq_attempt_session_open', 'user_id', 'quiz_id', unique=True,
+                 sqlite_where=db.text("status = 'open'"), postgresql_where=db.text("status = 'open'")),
+    )
+
+    def __repr__(self):
+        return f"<AttemptSession {self.id} User:{self.user_id} Quiz:{self.quiz_id}>"
+
+# ----------------------
+# Score Rollup Tables
+# ----------------------
+# Percentage histogram buckets: 0-9%, 10-19%, ..., 90-99%, and 100% (or more)
+HISTOGRAM_BUCKETS = 11
+
+class ScoreRollup:
+    """Running aggregates over a set of Score rows, maintained by stats.py"""
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    score_sum = db.Column(db.Integer, nullable=False, default=0)
+    best_score = db.Column(db.Integer)
+    # Attempts at quizzes that had questions, the only ones a percentage exists for
+    graded_attempts = db.Column(db.Integer, nullable=False, default=0)
+    question_sum = db.Column(db.Integer, nullable=False, default=0)
+    percentage_sum = db.Column(db.Float, nullable=False, default=0)
+    best_percentage = db.Column(db.Float)
+    last_attempt_at = db.Column(db.DateTime)
+
+for _bucket in range(HISTOGRAM_BUCKETS):
+    setattr(ScoreRollup, f'bucket_{_bucket}', db.Column(db.Integer, nullable=False, default=0))
+
+class UserStats(ScoreRollup, db.Model):
+    __tablename__ = 'user_stats'
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True, autoincrement=False)
+
+    def __repr__(self):
+        return f"<UserStats User:{self.user_id} Attempts:{self.attempts}>"
+
+class QuizStats(ScoreRollup, db.Model):
+    __tablename__ = 'quiz_stats'
+    quiz_id = db.Column(db.Integer, db.ForeignKey('quiz.id'), primary_key=True, autoincrement=False)
+
+    def __repr__(self):
+        return f"<QuizStats Quiz:{self.quiz_id} Attempts:{self.attempts}>"
+
+# ----------------------
+# Cache Version Table
+# ----------------------
+class CacheVersion(db.Model):
+    name = db.Column(db.String(100), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<CacheVersion {self.name}:{self.version}>"
+
+# ----------------------
+# Reminder Delivery Table
+# ----------------------
+class ReminderDelivery(db.Model):
+    """One row per user per reminder window, so nobody is reminded twice for the same day"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    window_date = db.Column(db.Date, nullable=False)  # IST day the reminder covers
+    run_id = db.Column(db.String(32), nullable=False, index=True)  # Scheduler run that claimed the row
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+    __table_args__ = (db.UniqueConstraint('user_id', 'window_date'),)
+
+    def __repr__(self):
+        return f"<ReminderDelivery User:{self.user_id} {self.window_date}>"
+
+# ----------------------
+# Schema Migration Table
+# ----------------------
+class SchemaMigration(db.Model):
+    """Schema migrations already applied to this database (see migrations.py)"""
+    version = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    description = db.Column(db.String(200), nullable=False)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     def __repr__(self):
-        return f"<Score User:{self.user_id} Quiz:{self.quiz_id} Score:{self.score}>"
\ No newline at end of file
+        return f"<SchemaMigration {self.version}>"
\ No newline at end of file
@@ -0,0 +1,113 @@
+from urllib.parse import urlencode
+from flask import request
+from models import db
+from serialization import json_response, row_type
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+
+class PageRequestError(ValueError):
+    """Bad limit/after/fields/filter query parameters"""
+
+
+class Field:
+    """An output field: the columns it needs and how to turn their values into JSON.
+
+    Without `render` the single column's value is emitted as is (datetimes as ISO 8601).
+    """
+
+    def __init__(self, *columns, render=None):
+        self.columns = columns
+        self.render = render
+
+
+def equals(column, cast=int):
+    """Filter on column == value, with the query string value converted by `cast`"""
+    def build(value):
+        try:
+            return column == cast(value)
+        except ValueError:
+            raise PageRequestError(f"Invalid value for {column.key}: {value}")
+    return build
+
+
+def _page_size():
+    limit = request.args.get('limit', DEFAULT_PAGE_SIZE)
+    try:
+        limit = int(limit)
+    except ValueError:
+        raise PageRequestError("limit must be an integer")
+    return min(max(limit, 1), MAX_PAGE_SIZE)
+
+
+def _selected_fields(fields):
+    requested = request.args.get('fields')
+    if not requested:
+        return list(fields)
+    names = [name.strip() for name in requested.split(',') if name.strip()]
+    unknown = [name for name in names if name not in fields]
+    if unknown:
+        raise PageRequestError(f"Unknown fields: {', '.join(unknown)}")
+    # The key is always returned so the client can page on it
+    return ['id'] + [name for name in names if name != 'id']
+
+
+def paginate(model, fields, filters=None, criteria=()):
+    """One page of `model` ordered by primary key, as a JSON list.
+
+    ?after=<id> continues after the last row of the previous page, ?limit=<n> sets
+    the page size (capped at MAX_PAGE_SIZE), ?fields=a,b loads only those columns and
+    any key of `filters` narrows the rows. When more rows follow, the id to pass as
+    `after` is sent in the X-Next-Cursor header along with a Link rel="next" URL.
+    """
+    limit = _page_size()
+    after = request.args.get('after')
+    names = _selected_fields(fields)
+
+    # Load just the columns the selected fields need, the key first
+    columns = [model.id]
+    for name in names:
+        for column in fields[name].columns:
+            if not any(column is c for c in columns):
+                columns.append(column)
+    positions = {id(column): i for i, column in enumerate(columns)}
+
+    query = db.session.query(*columns).filter(*criteria)
+    for name, build in (filters or {}).items():
+        value = request.args.get(name)
+        if value is not None:
+            query = query.filter(build(value))
+    if after is not None:
+        try:
+            query = query.filter(model.id > int(after))
+        except ValueError:
+            raise PageRequestError("after must be an id")
+
+    rows = query.order_by(model.id).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    # One __slots__ object per row, filled straight from the column tuple
+    dto = row_type(f'{model.__name__}Row', tuple(names))
+    plain = [positions[id(fields[name].columns[0])] for name in names if fields[name].render is None]
+    if len(plain) == len(names):
+        items = [dto(*[row[i] for i in plain]) for row in rows]
+    else:
+        renderers = [
+            (fields[name].render, [positions[id(column)] for column in fields[name].columns])
+            for name in names
+        ]
+        items = [
+            dto(*[render(*[row[i] for i in indexes]) if render else row[indexes[0]]
+                  for render, indexes in renderers])
+            for row in rows
+        ]
+    response = json_response(items)
+    if has_more:
+        cursor = rows[-1][0]
+        args = request.args.to_dict()
+        args['after'] = cursor
+        response.headers['X-Next-Cursor'] = str(cursor)
+        response.headers['Link'] = f'<{request.base_url}?{urlencode(args)}>; rel="next"'
+    return response
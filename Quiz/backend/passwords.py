@@ -0,0 +1,127 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import bcrypt
+
+
+# Hash workers per web process; several web processes share the machine's cores
+DEFAULT_WORKERS = min(2, os.cpu_count() or 1)
+
+
+class PasswordHasherBusy(Exception):
+    """Raised when too many hashes are already waiting; the client should retry later"""
+
+    def __init__(self, retry_after):
+        super().__init__("Password hashing is overloaded")
+        self.retry_after = retry_after
+
+
+# Run inside the pool processes; module-level so they can be pickled by reference
+def _hash(password, rounds):
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def _check(password_hash, password):
+    return bcrypt.checkpw(password.encode('utf-8'), password_hash.encode('utf-8'))
+
+
+def hash_rounds(password_hash):
+    """Cost factor stored in a bcrypt hash ($2b$<rounds>$...)"""
+    try:
+        return int(password_hash.split('$')[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+class PasswordHasher:
+    """bcrypt on a bounded process pool.
+
+    Hashes run in separate processes so they use every core and do not hold the
+    GIL of the web worker. At most `max_pending` hashes are in flight per web
+    process; beyond that callers get PasswordHasherBusy instead of queueing.
+    With workers=0 hashing runs inline (useful for scripts and tests).
+    """
+
+    def __init__(self, rounds=12, workers=None, max_pending=None, timeout=30, retry_after=1):
+        self.rounds = rounds
+        self.workers = DEFAULT_WORKERS if workers is None else workers
+        self.max_pending = max_pending or max(1, self.workers) * 4
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._pool = None
+        self._pool_pid = None
+        self._pool_lock = threading.Lock()
+
+    def _executor(self):
+        # A pool created before a fork (e.g. gunicorn --preload) belongs to the parent.
+        # Workers come from a forkserver rather than a fork of this process: by now it runs
+        # threads (journal flushers, the log listener) whose locks a forked child could inherit
+        # held. The server preloads this module, so workers start with bcrypt and nothing else.
+        # As with any non-fork pool, a script that hashes must keep its own code under
+        # `if __name__ == '__main__'`; flask run, gunicorn and celery already do.
+        if self._pool is None or self._pool_pid != os.getpid():
+            with self._pool_lock:
+                if self._pool is None or self._pool_pid != os.getpid():
+                    context = multiprocessing.get_context('forkserver')
+                    context.set_forkserver_preload([__name__])
+                    self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+                    self._pool_pid = os.getpid()
+        return self._pool
+
+    def _run(self, fn, *args):
+        if self.workers <= 0:
+            return fn(*args)
+        if not self._slots.acquire(blocking=False):
+            raise PasswordHasherBusy(self.retry_after)
+        try:
+            return self._executor().submit(fn, *args).result(timeout=self.timeout)
+        finally:
+            self._slots.release()
+
+    def hash(self, password):
+        return self._run(_hash, password, self.rounds)
+
+    def check(self, password_hash, password):
+        try:
+            return self._run(_check, password_hash, password)
+        except ValueError:
+            # Not a bcrypt hash
+            return False
+
+    def needs_rehash(self, password_hash):
+        """True when the stored hash was made with a different cost than the configured one"""
+        return hash_rounds(password_hash) != self.rounds
+
+    def shutdown(self):
+        if self._pool is not None and self._pool_pid == os.getpid():
+            self._pool.shutdown(wait=False, cancel_futures=True)
+        self._pool = None
+
+
+password_hasher = PasswordHasher(workers=0)
+
+
+def init_password_hasher(app):
+    global password_hasher
+    password_hasher = PasswordHasher(
+        rounds=int(app.config.get('BCRYPT_LOG_ROUNDS', 12)),
+        workers=app.config.get('PASSWORD_HASH_WORKERS'),
+        max_pending=app.config.get('PASSWORD_HASH_MAX_PENDING'),
+        timeout=float(app.config.get('PASSWORD_HASH_TIMEOUT', 30)),
+        retry_after=int(app.config.get('PASSWORD_HASH_RETRY_AFTER', 1))
+    )
+    return password_hasher
+
+
+def hash_password(password):
+    return password_hasher.hash(password)
+
+
+def check_password(password_hash, password):
+    return password_hasher.check(password_hash, password)
+
+
+def needs_rehash(password_hash):
+    return password_hasher.needs_rehash(password_hash)
@@ -0,0 +1,292 @@
+"""On-demand profiling of live requests.
+
+An admin either arms profiling for the next N requests to an endpoint (shared by
+every worker on the host through a small file in PROFILE_DIR), or sends a single
+request with an `X-Profile` header. A profiled request is sampled by a background
+thread that reads the request thread's stack every PROFILE_SAMPLE_INTERVAL
+seconds and counts collapsed stacks (flamegraph.pl / speedscope input), or, with
+format "pstats", runs under cProfile. Results are written to PROFILE_DIR and only
+the newest PROFILE_MAX_FILES are kept.
+
+Unprofiled requests pay for one header lookup and, at most once a second, a
+stat() of the arming file.
+"""
+import cProfile
+import datetime
+import fcntl
+import json
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from flask import current_app, g, request
+from flask_jwt_extended import get_jwt, verify_jwt_in_request
+from werkzeug.exceptions import HTTPException, NotFound
+
+FORMATS = {'collapsed': 'collapsed', 'pstats': 'pstats'}
+PROFILE_NAME_PATTERN = re.compile(r'^[0-9]{8}T[0-9]{12}-[a-z0-9_-]+-[0-9a-f]{8}\.(collapsed|pstats)$')
+# How often each worker re-checks whether profiling was armed
+ARMED_CHECK_SECONDS = 1.0
+
+_armed = {'checked_at': 0.0, 'mtime': None, 'state': None}
+_armed_lock = threading.Lock()
+
+
+def profile_dir():
+    path = current_app.config.get('PROFILE_DIR') or os.path.join(current_app.instance_path, 'profiles')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _armed_path():
+    return os.path.join(profile_dir(), 'armed.json')
+
+
+def _read_armed(f):
+    f.seek(0)
+    try:
+        state = json.loads(f.read() or 'null')
+    except ValueError:
+        return None
+    if not state or state.get('remaining', 0) <= 0 or state.get('expires_at', 0) < time.time():
+        return None
+    return state
+
+
+def _write_armed(f, state):
+    f.seek(0)
+    f.truncate()
+    f.write(json.dumps(state) if state else '')
+    f.flush()
+
+
+def known_endpoint(endpoint):
+    """Whether `endpoint` is a URL rule of the app or a path one of them matches"""
+    if any(rule.rule == endpoint for rule in current_app.url_map.iter_rules()):
+        return True
+    try:
+        current_app.url_map.bind('localhost').match(endpoint, method='GET')
+    except NotFound:
+        return False
+    except HTTPException:
+        # Wrong method or a redirect: the path itself is routed
+        return True
+    return True
+
+
+def arm(endpoint, count, fmt='collapsed', armed_by=None):
+    """Profile the next `count` requests whose URL rule or path is `endpoint`"""
+    state = {
+        'endpoint': endpoint,
+        'remaining': count,
+        'format': fmt,
+        'armed_by': armed_by,
+        'armed_at': time.time(),
+        'expires_at': time.time() + int(current_app.config.get('PROFILE_ARM_TTL', 600))
+    }
+    with open(_armed_path(), 'a+') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        _write_armed(f, state)
+    return state
+
+
+def disarm():
+    try:
+        os.remove(_armed_path())
+    except FileNotFoundError:
+        pass
+
+
+def armed_state():
+    """What is armed right now, read from disk"""
+    try:
+        with open(_armed_path()) as f:
+            fcntl.flock(f, fcntl.LOCK_SH)
+            return _read_armed(f)
+    except FileNotFoundError:
+        return None
+
+
+def _cached_armed_state():
+    """The armed state as this worker last saw it; re-read when the file changes"""
+    now = time.monotonic()
+    if now - _armed['checked_at'] < ARMED_CHECK_SECONDS:
+        return _armed['state']
+    with _armed_lock:
+        _armed['checked_at'] = now
+        try:
+            mtime = os.stat(_armed_path()).st_mtime_ns
+        except FileNotFoundError:
+            _armed['mtime'] = _armed['state'] = None
+            return None
+        if mtime != _armed['mtime']:
+            _armed['mtime'] = mtime
+            _armed['state'] = armed_state()
+        return _armed['state']
+
+
+def _claim(rule, path):
+    """Take one of the armed slots for this request; returns the format, or None"""
+    state = _cached_armed_state()
+    if state is None or state['endpoint'] not in (rule, path):
+        return None
+    try:
+        with open(_armed_path(), 'r+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            state = _read_armed(f)
+            if state is None or state['endpoint'] not in (rule, path):
+                return None
+            state['remaining'] -= 1
+            _write_armed(f, state if state['remaining'] > 0 else None)
+            return state['format']
+    except FileNotFoundError:
+        return None
+
+
+def _requested_by_admin():
+    try:
+        verify_jwt_in_request(optional=True)
+        return get_jwt().get('role') == 'admin'
+    except Exception:
+        return False
+
+
+def _frame_name(code):
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+
+class StackSampler:
+    """Counts one thread's collapsed stacks from a background thread"""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None:
+                names.append(_frame_name(frame.f_code))
+                frame = frame.f_back
+            if names:
+                self.stacks[';'.join(reversed(names))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f'{stack} {count}\n')
+
+
+def _profile_name(rule, fmt):
+    slug = re.sub(r'[^a-z0-9]+', '_', rule.lower()).strip('_') or 'root'
+    return f"{datetime.datetime.now().strftime('%Y%m%dT%H%M%S%f')}-{slug[:60]}-{uuid.uuid4().hex[:8]}.{FORMATS[fmt]}"
+
+
+def _start_profile():
+    header = request.headers.get('X-Profile')
+    if header is None and _cached_armed_state() is None:
+        return
+    rule = request.url_rule.rule if request.url_rule else request.path
+    if header is not None:
+        fmt = header if header in FORMATS else 'collapsed'
+        if not _requested_by_admin():
+            return
+    else:
+        fmt = _claim(rule, request.path)
+        if fmt is None:
+            return
+
+    name = _profile_name(rule, fmt)
+    if fmt == 'pstats':
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is active in this process
+            return
+    else:
+        profiler = StackSampler(threading.get_ident(), float(current_app.config.get('PROFILE_SAMPLE_INTERVAL', 0.005)))
+        profiler.start()
+    g.profile = (name, profiler)
+
+
+def _tag_response(response):
+    profile = g.get('profile')
+    if profile is not None:
+        response.headers['X-Profile-Id'] = profile[0]
+    return response
+
+
+def _finish_profile(exc):
+    # Runs after a streamed body is fully sent, so generators are profiled too
+    profile = g.pop('profile', None)
+    if profile is None:
+        return
+    name, profiler = profile
+    path = os.path.join(profile_dir(), name)
+    if isinstance(profiler, cProfile.Profile):
+        profiler.disable()
+        profiler.dump_stats(path)
+    else:
+        profiler.stop()
+        profiler.write(path)
+    _enforce_retention()
+
+
+def _enforce_retention():
+    keep = int(current_app.config.get('PROFILE_MAX_FILES', 50))
+    profiles = sorted(name for name in os.listdir(profile_dir()) if PROFILE_NAME_PATTERN.match(name))
+    for name in profiles[:max(0, len(profiles) - keep)]:
+        try:
+            os.remove(os.path.join(profile_dir(), name))
+        except FileNotFoundError:
+            pass
+
+
+def list_profiles():
+    """Captured profiles, newest first"""
+    directory = profile_dir()
+    profiles = []
+    for name in sorted(os.listdir(directory), reverse=True):
+        if not PROFILE_NAME_PATTERN.match(name):
+            continue
+        try:
+            info = os.stat(os.path.join(directory, name))
+        except FileNotFoundError:
+            continue
+        profiles.append({
+            'name': name,
+            'format': name.rsplit('.', 1)[1],
+            'size': info.st_size,
+            'created_at': datetime.datetime.fromtimestamp(info.st_mtime).isoformat()
+        })
+    return profiles
+
+
+def profile_path(name):
+    if not PROFILE_NAME_PATTERN.match(name):
+        raise ValueError('Invalid profile name')
+    return os.path.join(profile_dir(), name)
+
+
+def init_profiling(app):
+    """Register the request hooks unless PROFILING_ENABLED is off"""
+    if not app.config.get('PROFILING_ENABLED', True):
+        return
+    app.before_request(_start_profile)
+    app.after_request(_tag_response)
+    app.teardown_request(_finish_profile)
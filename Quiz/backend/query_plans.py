@@ -0,0 +1,71 @@
+"""Query-plan check for the hot queries.
+
+Runs EXPLAIN on the lookups the API does on every request and exits with status 1
+if any of them reads a whole table instead of using an index:
+
+    python query_plans.py
+    DATABASE_URL=postgresql://... python query_plans.py
+
+On PostgreSQL sequential scans are disabled for the check, so a small table does
+not hide a missing index.
+"""
+import json
+import sys
+from sqlalchemy import select, text
+from models import db, Chapter, Quiz, Question, Score
+from quiz_schedule import active_quizzes_query, ist_now
+
+# name -> (table that must be searched through an index, statement)
+HOT_QUERIES = {
+    'scores by user': ('score', lambda: select(Score.quiz_id, Score.score, Score.date_taken)
+                       .where(Score.user_id == 1).order_by(Score.date_taken.desc())),
+    'scores page by user': ('score', lambda: select(Score.id, Score.score)
+                            .where(Score.user_id == 1, Score.id > 0).order_by(Score.id)),
+    'scores by quiz': ('score', lambda: select(Score.id).where(Score.quiz_id == 1)),
+    'questions by quiz': ('question', lambda: select(Question.id, Question.correct_option)
+                          .where(Question.quiz_id == 1)),
+    'quizzes by chapter': ('quiz', lambda: select(Quiz.id).where(Quiz.chapter_id == 1)),
+    'chapters by subject': ('chapter', lambda: select(Chapter.id).where(Chapter.subject_id == 1)),
+    'active quizzes': ('quiz', lambda: active_quizzes_query(ist_now()).statement),
+}
+
+
+def explain(connection, statement):
+    """The query plan as a list of lines"""
+    dialect = connection.dialect
+    sql = str(statement.compile(dialect=dialect, compile_kwargs={'literal_binds': True}))
+    if dialect.name == 'sqlite':
+        return [row[-1] for row in connection.execute(text('EXPLAIN QUERY PLAN ' + sql))]
+    return [row[0] for row in connection.execute(text('EXPLAIN ' + sql))]
+
+
+def is_table_scan(dialect_name, table, plan):
+    if dialect_name == 'sqlite':
+        # "SCAN score" reads every row; "SEARCH score USING INDEX ..." does not
+        return any(line.startswith(f'SCAN {table}') for line in plan)
+    return any(f'Seq Scan on {table}' in line for line in plan)
+
+
+def check_query_plans():
+    """{query name: plan} for every hot query that scans its table"""
+    scans = {}
+    with db.engine.connect() as connection:
+        if connection.dialect.name == 'postgresql':
+            connection.execute(text('SET enable_seqscan = off'))
+        for name, (table, build) in HOT_QUERIES.items():
+            plan = explain(connection, build())
+            if is_table_scan(connection.dialect.name, table, plan):
+                scans[name] = plan
+    return scans
+
+
+def main():
+    from app import app
+    with app.app_context():
+        scans = check_query_plans()
+    print(json.dumps({'checked': len(HOT_QUERIES), 'table_scans': scans}, indent=2))
+    return 1 if scans else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
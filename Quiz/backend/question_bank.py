@@ -0,0 +1,195 @@
+"""Bulk import and export of questions as CSV or JSON Lines.
+
+Both directions stream: uploads are parsed row by row and inserted in batches,
+exports are written row by row from a server-side cursor, so a question bank of
+any size moves with constant memory. Files carry the same columns either way:
+
+    quiz_id, question_text, option1, option2, option3, option4, correct_option
+"""
+import csv
+import io
+import json
+from sqlalchemy import bindparam, insert, update
+from models import db, Quiz, Question
+from grading import parse_option, invalidate_answer_key
+from catalog import bump_catalog_version
+from quiz_payloads import invalidate_quiz_payload
+
+QUESTION_COLUMNS = ['quiz_id', 'question_text', 'option1', 'option2', 'option3', 'option4', 'correct_option']
+TEXT_COLUMNS = ['question_text', 'option1', 'option2', 'option3', 'option4']
+FORMATS = ('csv', 'jsonl')
+IMPORT_BATCH_SIZE = 500
+# Per-row errors reported back; the total count is always given
+MAX_REPORTED_ERRORS = 100
+
+
+class ImportFormatError(ValueError):
+    """The upload cannot be read as the requested format"""
+
+
+def read_rows(stream, fmt):
+    """Yield (line number, row dict) from a binary stream without reading it all into memory"""
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    try:
+        if fmt == 'csv':
+            reader = csv.DictReader(text)
+            if not reader.fieldnames or 'question_text' not in reader.fieldnames:
+                raise ImportFormatError("CSV needs a header row with the question columns")
+            for row in reader:
+                yield reader.line_num, row
+        else:
+            for number, line in enumerate(text, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    yield number, None
+                    continue
+                yield number, row if isinstance(row, dict) else None
+    except UnicodeDecodeError:
+        raise ImportFormatError("Upload is not UTF-8 text")
+    finally:
+        text.detach()
+
+
+def _validate(row, quiz_id, max_lengths):
+    """(values for the insert, list of problems) for one parsed row"""
+    if row is None:
+        return None, ["not a JSON object"]
+    problems = []
+    values = {}
+    for column in TEXT_COLUMNS:
+        value = row.get(column)
+        value = str(value).strip() if value is not None else ''
+        if not value:
+            problems.append(f"{column} is required")
+        elif max_lengths.get(column) and len(value) > max_lengths[column]:
+            problems.append(f"{column} is longer than {max_lengths[column]} characters")
+        values[column] = value
+
+    option = parse_option(row.get('correct_option'))
+    if option is None:
+        problems.append("correct_option must be 1-4 or A-D")
+    values['correct_option'] = option
+
+    if quiz_id is None:
+        try:
+            quiz_id = int(row.get('quiz_id'))
+        except (TypeError, ValueError):
+            problems.append("quiz_id is required")
+    values['quiz_id'] = quiz_id
+    return values, problems
+
+
+class ImportResult:
+    def __init__(self):
+        self.rows = 0
+        self.inserted = 0
+        self.error_count = 0
+        self.errors = []
+        self.per_quiz = {}
+
+    def fail(self, line, problems):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line, 'errors': problems})
+
+    def to_json(self):
+        return {'rows': self.rows, 'inserted': self.inserted, 'error_count': self.error_count,
+                'errors': self.errors}
+
+
+def import_questions(stream, fmt, quiz_id=None, skip_invalid=False):
+    """Validate and insert questions from an upload in one transaction.
+
+    Rows are checked and inserted IMPORT_BATCH_SIZE at a time with executemany. With
+    `quiz_id` every row goes to that quiz and the file's own quiz_id is ignored, which
+    is how a bank exported from one deployment is loaded into another. Unless
+    `skip_invalid` is set, any invalid row rolls the whole import back.
+    """
+    result = ImportResult()
+    max_lengths = {column: getattr(Question.__table__.c[column].type, 'length', None) for column in TEXT_COLUMNS}
+    known_quizzes = set()
+
+    def flush(batch):
+        # One lookup per batch for quiz ids not seen in earlier batches
+        unseen = {values['quiz_id'] for _, values in batch} - known_quizzes
+        if unseen:
+            known_quizzes.update(
+                quiz for (quiz,) in db.session.query(Quiz.id).filter(Quiz.id.in_(unseen))
+            )
+        valid = []
+        for line, values in batch:
+            if values['quiz_id'] in known_quizzes:
+                valid.append(values)
+            else:
+                result.fail(line, [f"quiz {values['quiz_id']} does not exist"])
+        if valid and (skip_invalid or not result.error_count):
+            db.session.execute(insert(Question), valid)
+            result.inserted += len(valid)
+            for values in valid:
+                result.per_quiz[values['quiz_id']] = result.per_quiz.get(values['quiz_id'], 0) + 1
+
+    batch = []
+    try:
+        for line, row in read_rows(stream, fmt):
+            result.rows += 1
+            values, problems = _validate(row, quiz_id, max_lengths)
+            if problems:
+                result.fail(line, problems)
+                continue
+            batch.append((line, values))
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                flush(batch)
+                batch = []
+        if batch:
+            flush(batch)
+    except (ImportFormatError, csv.Error):
+        db.session.rollback()
+        raise
+
+    if result.error_count and not skip_invalid:
+        db.session.rollback()
+        result.inserted = 0
+        return result
+
+    if result.per_quiz:
+        # Bulk inserts skip the ORM listeners that keep question_count in step
+        db.session.execute(
+            update(Quiz.__table__).where(Quiz.id == bindparam('quiz')).values(
+                question_count=Quiz.question_count + bindparam('added')
+            ),
+            [{'quiz': quiz, 'added': added} for quiz, added in result.per_quiz.items()]
+        )
+        bump_catalog_version()
+        for quiz in result.per_quiz:
+            invalidate_answer_key(quiz)
+            invalidate_quiz_payload(quiz)
+    db.session.commit()
+    return result
+
+
+def export_questions(fmt, quiz_id=None):
+    """Yield the question bank (optionally one quiz) as CSV or JSON Lines text"""
+    query = db.session.query(*[Question.__table__.c[column] for column in QUESTION_COLUMNS])
+    if quiz_id is not None:
+        query = query.filter(Question.quiz_id == quiz_id)
+    rows = query.order_by(Question.id).yield_per(1000)
+
+    if fmt == 'jsonl':
+        for row in rows:
+            yield json.dumps(dict(zip(QUESTION_COLUMNS, row)), ensure_ascii=False) + '\n'
+        return
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(QUESTION_COLUMNS)
+    for row in rows:
+        writer.writerow(row)
+        # Hand the text over every few rows instead of one tiny chunk per row
+        if buffer.tell() > 16384:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+    yield buffer.getvalue()
@@ -0,0 +1,34 @@
+"""Upkeep of the denormalized Quiz.question_count.
+
+Mapper listeners on Question adjust the count in the same transaction as the
+insert or delete. Bulk statements bypass them, so if the counts ever drift (e.g.
+questions loaded with raw SQL), recompute them all with:
+
+    python question_counts.py
+"""
+import sys
+from sqlalchemy import func, select, update
+from models import db, Quiz, Question
+
+
+def repair_question_counts():
+    """Recompute every quiz's count from the Question table; returns how many were wrong"""
+    actual = select(func.count(Question.id)).where(Question.quiz_id == Quiz.id).scalar_subquery()
+    result = db.session.execute(
+        update(Quiz).where(Quiz.question_count != actual).values(question_count=actual)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return result.rowcount
+
+
+def main():
+    from app import app
+    with app.app_context():
+        fixed = repair_question_counts()
+    print(f"Repaired question_count on {fixed} quiz(zes)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
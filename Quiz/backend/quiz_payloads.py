@@ -0,0 +1,159 @@
+"""Cached quiz payloads (a quiz with its questions, minus the answers).
+
+When a quiz starts, every student asks for it within seconds. Payloads are
+cached per quiz and built by one thread per process while the others wait for
+it, so the burst costs one query per quiz rather than one per student. A
+background thread builds payloads of quizzes about to start ahead of time and
+drops those of quizzes that have ended. Question and quiz edits invalidate the
+payload through its cache version.
+"""
+import datetime
+import json
+import logging
+import threading
+from models import db, Quiz, Question
+from grading import get_answer_key
+from quiz_schedule import IST, ist_now
+from versions import KeyedLocks, bump_version, current_version
+
+logger = logging.getLogger(__name__)
+
+_payloads = {}
+_lock = threading.Lock()
+_build_locks = KeyedLocks()
+
+
+def _payload_version(quiz_id):
+    return f'quiz-payload:{quiz_id}'
+
+
+def invalidate_quiz_payload(quiz_id):
+    """Drop a quiz's cached payload once the current transaction commits"""
+    bump_version(_payload_version(quiz_id))
+
+
+class QuizPayload:
+    """A quiz's window and its questions, with the response body serialized once"""
+    __slots__ = ('version', 'quiz_id', 'start_datetime', 'end_datetime', 'duration_hours', 'duration_minutes',
+                 'questions', 'body')
+
+    def __init__(self, version, quiz, questions):
+        self.version = version
+        self.quiz_id = quiz.id
+        self.start_datetime = quiz.start_datetime
+        self.end_datetime = quiz.end_datetime
+        self.duration_hours = quiz.duration_hours
+        self.duration_minutes = quiz.duration_minutes
+        self.questions = [{
+            'id': q.id,
+            'question_text': q.question_text,
+            'option1': q.option1,
+            'option2': q.option2,
+            'option3': q.option3,
+            'option4': q.option4
+        } for q in questions]
+        start_time = quiz.start_datetime.replace(tzinfo=IST) if quiz.start_datetime else None
+        end_time = quiz.end_datetime.replace(tzinfo=IST) if quiz.end_datetime else None
+        self.body = json.dumps({
+            'id': quiz.id,
+            'title': quiz.title,
+            'start_datetime': start_time.isoformat() if start_time else None,
+            'duration_hours': quiz.duration_hours,
+            'duration_minutes': quiz.duration_minutes,
+            'end_datetime': end_time.isoformat() if end_time else None,
+            'questions': self.questions
+        })
+
+    def is_active(self, now, grace=datetime.timedelta(0)):
+        """Whether the quiz is open at `now`, counting `grace` past its end as open"""
+        if not self.start_datetime or not self.end_datetime:
+            return False
+        return self.start_datetime <= now <= self.end_datetime + grace
+
+
+def _build(quiz_id, version):
+    quiz = db.session.get(Quiz, quiz_id)
+    if quiz is None:
+        return None
+    questions = db.session.query(
+        Question.id, Question.question_text, Question.option1, Question.option2,
+        Question.option3, Question.option4
+    ).filter(Question.quiz_id == quiz_id).order_by(Question.id).all()
+    return QuizPayload(version, quiz, questions)
+
+
+def get_quiz_payload(quiz_id):
+    """The cached payload for the quiz's current version, or None if there is no such quiz"""
+    version = current_version(_payload_version(quiz_id))
+    payload = _payloads.get(quiz_id)
+    if payload is None or payload.version != version:
+        with _build_locks(quiz_id):
+            payload = _payloads.get(quiz_id)
+            if payload is None or payload.version != version:
+                payload = _build(quiz_id, version)
+                if payload is None:
+                    return None
+                with _lock:
+                    _payloads[quiz_id] = payload
+    return payload
+
+
+def prewarm_quiz_payloads(lead_seconds):
+    """Build payloads and answer keys of quizzes starting within `lead_seconds`; forget ended ones"""
+    now = ist_now()
+    with _lock:
+        for quiz_id in [quiz_id for quiz_id, payload in _payloads.items()
+                        if payload.end_datetime and payload.end_datetime < now]:
+            del _payloads[quiz_id]
+
+    starting = [quiz_id for (quiz_id,) in db.session.query(Quiz.id).filter(
+        Quiz.start_datetime > now,
+        Quiz.start_datetime <= now + datetime.timedelta(seconds=lead_seconds)
+    )]
+    for quiz_id in starting:
+        get_quiz_payload(quiz_id)
+        get_answer_key(quiz_id)
+    return len(starting)
+
+
+class PayloadPrewarmer:
+    """Background thread running prewarm_quiz_payloads() every `interval` seconds"""
+
+    def __init__(self, app, lead_seconds, interval):
+        self.app = app
+        self.lead_seconds = lead_seconds
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                with self.app.app_context():
+                    prewarm_quiz_payloads(self.lead_seconds)
+            except Exception:
+                logger.exception("Quiz payload prewarm failed")
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='quiz-payload-prewarm', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+
+payload_prewarmer = None
+
+
+def init_quiz_payloads(app):
+    """Start pre-warming unless QUIZ_PAYLOAD_PREWARM_SECONDS is 0"""
+    global payload_prewarmer
+    lead_seconds = int(app.config.get('QUIZ_PAYLOAD_PREWARM_SECONDS', 60))
+    if lead_seconds <= 0:
+        return None
+    # Check often enough that every quiz is seen at least once inside its lead time
+    interval = float(app.config.get('QUIZ_PAYLOAD_PREWARM_INTERVAL', 0)) or max(1.0, lead_seconds / 4)
+    payload_prewarmer = PayloadPrewarmer(app, lead_seconds, interval)
+    payload_prewarmer.start()
+    return payload_prewarmer
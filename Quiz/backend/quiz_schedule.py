@@ -0,0 +1,115 @@
+import datetime
+import heapq
+import threading
+from models import Quiz
+from catalog import CATALOG_VERSION
+from versions import current_version
+
+IST = datetime.timezone(datetime.timedelta(hours=5, minutes=30))
+
+# Transition kinds; at the same instant a start is applied before an end
+START = 0
+END = 1
+
+
+def ist_now():
+    """Current IST wall time as a naive datetime, matching how quiz times are stored"""
+    return datetime.datetime.now(IST).replace(tzinfo=None)
+
+
+def quiz_window_entry(quiz):
+    start_time = quiz.start_datetime.replace(tzinfo=IST)
+    end_time = quiz.end_datetime.replace(tzinfo=IST)
+    return {
+        "id": quiz.id,
+        "title": quiz.title,
+        "start_datetime": start_time.isoformat(),
+        "end_datetime": end_time.isoformat(),
+        "duration_hours": quiz.duration_hours,
+        "duration_minutes": quiz.duration_minutes
+    }
+
+
+def active_quizzes_query(now):
+    """Quizzes whose window contains now (indexed range on start/end)"""
+    return Quiz.query.filter(
+        Quiz.start_datetime <= now,
+        Quiz.end_datetime >= now
+    ).order_by(Quiz.start_datetime, Quiz.id)
+
+
+def upcoming_quizzes_query(now, hours):
+    """Quizzes starting within the next `hours` hours"""
+    return Quiz.query.filter(
+        Quiz.start_datetime > now,
+        Quiz.start_datetime <= now + datetime.timedelta(hours=hours)
+    ).order_by(Quiz.start_datetime, Quiz.id)
+
+
+class QuizSchedule:
+    """Active quizzes served from memory, advanced by a heap of upcoming start/end transitions.
+
+    The schedule loads every quiz whose window overlaps [now, now + horizon] once,
+    then only pops transitions as time passes. It reloads when the catalog version
+    changes or the horizon runs out.
+    """
+
+    def __init__(self, horizon_hours=24):
+        self.horizon = datetime.timedelta(hours=horizon_hours)
+        self._lock = threading.Lock()
+        self._version = None
+        self._valid_until = None
+        self._events = []
+        self._entries = {}
+        self._active = {}
+
+    def _load(self, now, version):
+        quizzes = Quiz.query.filter(
+            Quiz.end_datetime >= now,
+            Quiz.start_datetime <= now + self.horizon
+        ).all()
+
+        self._events = []
+        self._entries = {}
+        self._active = {}
+        for quiz in quizzes:
+            entry = quiz_window_entry(quiz)
+            self._entries[quiz.id] = entry
+            if quiz.start_datetime <= now:
+                self._active[quiz.id] = entry
+            else:
+                self._events.append((quiz.start_datetime, START, quiz.id))
+            self._events.append((quiz.end_datetime, END, quiz.id))
+        heapq.heapify(self._events)
+        self._version = version
+        self._valid_until = now + self.horizon
+
+    def _advance(self, now):
+        events = self._events
+        while events:
+            when, kind, quiz_id = events[0]
+            # A quiz is active while start <= now <= end
+            if when > now or (when == now and kind == END):
+                break
+            heapq.heappop(events)
+            if kind == START:
+                self._active[quiz_id] = self._entries[quiz_id]
+            else:
+                self._active.pop(quiz_id, None)
+
+    def next_transition(self):
+        """When the set of active quizzes next changes (None if nothing is scheduled)"""
+        return self._events[0][0] if self._events else None
+
+    def active(self, now=None):
+        now = now or ist_now()
+        version = current_version(CATALOG_VERSION)
+        with self._lock:
+            if version != self._version or now >= self._valid_until:
+                self._load(now, version)
+            else:
+                self._advance(now)
+            return sorted(self._active.values(), key=lambda entry: (entry["start_datetime"], entry["id"]))
+
+
+quiz_schedule = QuizSchedule()
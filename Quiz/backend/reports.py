@@ -0,0 +1,70 @@
+import csv
+import io
+from models import db, User, UserStats
+
+# Column headings of the user performance CSV
+USER_PERFORMANCE_HEADER = [
+    'User ID',
+    'Full Name',
+    'Email',
+    'Role',
+    'Qualification',
+    'Date of Birth',
+    'Total Quizzes Taken',
+    'Average Score (%)',
+    'Best Score (%)',
+    'Total Questions Attempted',
+    'Last Quiz Date'
+]
+
+
+def user_performance_rows():
+    """Per-user performance aggregates, read from the user_stats rollup"""
+    return db.session.query(
+        User.id,
+        User.full_name,
+        User.email,
+        User.role,
+        User.qualification,
+        User.date_of_birth,
+        UserStats.attempts.label('total_quizzes'),
+        UserStats.question_sum.label('total_questions'),
+        UserStats.percentage_sum.label('total_percentage'),
+        UserStats.best_percentage,
+        UserStats.last_attempt_at.label('last_quiz_date')
+    ).outerjoin(UserStats, UserStats.user_id == User.id).order_by(User.id).yield_per(1000)
+
+
+def generate_user_performance_csv(rows):
+    """Yield the performance report as CSV text, one line at a time"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def flush():
+        value = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+        return value
+
+    writer.writerow(USER_PERFORMANCE_HEADER)
+    yield flush()
+
+    for row in rows:
+        total_quizzes = row.total_quizzes or 0
+        average_score = (row.total_percentage or 0) / total_quizzes if total_quizzes > 0 else 0
+        last_quiz_date = row.last_quiz_date
+
+        writer.writerow([
+            row.id,
+            row.full_name or 'N/A',
+            row.email,
+            row.role,
+            row.qualification or 'N/A',
+            row.date_of_birth.strftime('%Y-%m-%d') if row.date_of_birth else 'N/A',
+            total_quizzes,
+            round(average_score, 2),
+            round(row.best_percentage or 0, 2),
+            row.total_questions or 0,
+            last_quiz_date.strftime('%Y-%m-%d %H:%M:%S') if last_quiz_date else 'N/A'
+        ])
+        yield flush()
@@ -1,17 +1,84 @@
-from flask import Blueprint, jsonify, request, render_template, send_file
-from flask_jwt_extended import create_access_token, decode_token, get_jwt, jwt_required
-from models import db, bcrypt, Subject, Quiz, Question, Score, User, Chapter
+from flask import Blueprint, current_app, jsonify, request, render_template, send_file, Response, stream_with_context
+from flask_jwt_extended import create_access_token, decode_token, jwt_required
+from redis import RedisError
+from models import db, bcrypt, Subject, Quiz, Question, Score, User, Chapter, UserStats, QuizStats, AttemptSession
 from rbac import role_required
+from reports import user_performance_rows, generate_user_performance_csv
+from catalog import catalog_tree_json, catalog_snapshot, quiz_history, bump_catalog_version
+from quiz_schedule import quiz_schedule, quiz_window_entry, upcoming_quizzes_query, ist_now
+from passwords import PasswordHasherBusy
+from pagination import Field, PageRequestError, equals, paginate
+from identity import current_user_id, invalidate_user
+from grading import AnswerError, grade_answers, invalidate_answer_key
+from quiz_payloads import get_quiz_payload, invalidate_quiz_payload
+from submission_buffer import queue_submission
+from attempts import AttemptError, open_attempt, get_attempt, resume_attempt, attempt_json, save_answers, finalize_attempt, is_expired
+from question_bank import FORMATS as QUESTION_FORMATS, ImportFormatError, import_questions, export_questions
+from stats import rebuild_stats, rebuild_all_stats, stats_json
+from leaderboards import GLOBAL_KEY, quiz_key, chapter_key, leaderboard, discard_quiz, move_quiz, discard_user, rebuild_leaderboards
+from profiling import FORMATS as PROFILE_FORMATS, known_endpoint, arm, disarm, armed_state, list_profiles, profile_path
+from export_jobs import EXPORT_REPORTS, ExportDispatchError, start_export, read_job, artifact_path, export_download_name
 from email_service import send_registration_confirmation, send_new_quiz_notification
-import datetime
 import csv
-import io
-import tempfile
+import datetime
+import hashlib
+import json
+import logging
 import os
+from werkzeug.http import http_date
 
 IST = datetime.timezone(datetime.timedelta(hours=5, minutes=30))
 
 routes = Blueprint('routes', __name__)
+logger = logging.getLogger(__name__)
+
+
+# Fields each paginated list endpoint can return (?fields=...)
+USER_FIELDS = {
+    'id': Field(User.id),
+    'email': Field(User.email),
+    'full_name': Field(User.full_name),
+    'qualification': Field(User.qualification),
+    'date_of_birth': Field(User.date_of_birth),
+    'role': Field(User.role)
+}
+CHAPTER_FIELDS = {
+    'id': Field(Chapter.id),
+    'name': Field(Chapter.name),
+    'description': Field(Chapter.description),
+    'subject_id': Field(Chapter.subject_id)
+}
+QUIZ_FIELDS = {
+    'id': Field(Quiz.id),
+    'title': Field(Quiz.title),
+    'chapter_id': Field(Quiz.chapter_id),
+    'start_datetime': Field(Quiz.start_datetime),
+    'end_datetime': Field(Quiz.end_datetime),
+    'duration_hours': Field(Quiz.duration_hours),
+    'duration_minutes': Field(Quiz.duration_minutes),
+    'question_count': Field(Quiz.question_count)
+}
+QUIZ_STATUS_CRITERIA = {
+    'active': lambda now: db.and_(Quiz.start_datetime <= now, Quiz.end_datetime >= now),
+    'upcoming': lambda now: Quiz.start_datetime > now,
+    'expired': lambda now: Quiz.end_datetime < now
+}
+QUESTION_FIELDS = {
+    'id': Field(Question.id),
+    'quiz_id': Field(Question.quiz_id),
+    'question_text': Field(Question.question_text),
+    'option1': Field(Question.option1),
+    'option2': Field(Question.option2),
+    'option3': Field(Question.option3),
+    'option4': Field(Question.option4),
+    'correct_option': Field(Question.correct_option)
+}
+SCORE_FIELDS = {
+    'id': Field(Score.id),
+    'quiz_id': Field(Score.quiz_id),
+    'score': Field(Score.score),
+    'date_taken': Field(Score.date_taken, render=http_date)  # Kept in the format jsonify gave it
+}
 
 # Render registration form
 @routes.route('/register', methods=['GET'])
@@ -30,11 +97,9 @@ def register():
         return jsonify({"message": "User already exists"}), 400
     
     dob = data.get('date_of_birth', None)
-    print("dob1 is", dob)
     if dob:
         try:
             dob = datetime.datetime.strptime(dob, "%Y-%m-%d").date()
-            print("dob2 is", dob)
         except Exception:
             return jsonify({"message": "Invalid date format. Use YYYY-MM-DD."}), 400
     
@@ -68,26 +133,31 @@ def login():
         else:
             data = request.form
             
-        print("Login attempt for email:", data.get('email'))
+        logger.debug("Login attempt for email: %s", data.get('email'))
         
         if not data.get('email') or not data.get('password'):
             return jsonify({"message": "Email and password are required"}), 400
             
         user = User.query.filter_by(email=data['email']).first()
         if not user:
-            print("User not found:", data.get('email'))
+            logger.info("Login failed, user not found: %s", data.get('email'))
             return jsonify({"message": "Invalid credentials"}), 401
             
         if not user.check_password(data['password']):
-            print("Invalid password for user:", data.get('email'))
+            logger.info("Login failed, invalid password for user: %s", data.get('email'))
             return jsonify({"message": "Invalid credentials"}), 401
 
+        # Upgrade hashes made with an older cost factor while we have the plain password
+        if user.password_needs_rehash():
+            user.set_password(data['password'])
+            db.session.commit()
+
         access_token = create_access_token(
             identity=user.email,
-            additional_claims={"role": user.role}
+            additional_claims={"role": user.role, "uid": user.id}
         )
         
-        print("Login successful for:", user.email, "with role:", user.role)
+        logger.debug("Login successful for: %s with role: %s", user.email, user.role)
         return jsonify({
             "access_token": access_token,
             "user": {
@@ -96,10 +166,29 @@ def login():
                 "full_name": user.full_name
             }
         }), 200
+    except PasswordHasherBusy:
+        raise
     except Exception as e:
-        print("Login error:", str(e))
+        logger.exception("Login error: %s", e)
         return jsonify({"message": "An error occurred during login"}), 500
 
+# Bad paging, field or filter parameters on a list endpoint
+@routes.app_errorhandler(PageRequestError)
+def page_request_error(e):
+    return jsonify({"message": str(e)}), 400
+
+# Password hashing is overloaded: ask the client to retry instead of queueing
+@routes.app_errorhandler(PasswordHasherBusy)
+def password_hasher_busy(e):
+    response = jsonify({"message": "Server is busy, please retry shortly"})
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response, 503
+
+# Attempt sessions report their own status codes
+@routes.app_errorhandler(AttemptError)
+def attempt_error(e):
+    return jsonify({"message": e.message}), e.status
+
 #admin-only route
 @routes.route('/admin-only', methods=['GET'])
 @role_required('admin')
@@ -115,7 +204,6 @@ def user_only():
 
 @routes.route("/")
 def home():
-    print("This is backend print")
     return "Hello from Flask"
 
 #Protect Admin Management Routes
@@ -137,6 +225,7 @@ def create_quiz():
             duration_minutes=int(data.get('duration_minutes', 30))
         )
         db.session.add(quiz)
+        bump_catalog_version()
         db.session.commit()
 
         # Get the chapter to include subject information in the notification
@@ -173,6 +262,7 @@ def update_quiz(quiz_id):
         return jsonify({"message": "Quiz not found"}), 404
     
     try:
+        old_chapter_id = quiz.chapter_id
         if 'title' in data:
             quiz.title = data['title']
             
@@ -197,7 +287,10 @@ def update_quiz(quiz_id):
         if 'duration_minutes' in data:
             quiz.duration_minutes = int(data['duration_minutes'])
         
+        bump_catalog_version()
+        invalidate_quiz_payload(quiz_id)
         db.session.commit()
+        move_quiz(quiz_id, old_chapter_id, quiz.chapter_id)
         return jsonify({
             "message": "Quiz updated successfully",
             "quiz": {
@@ -235,6 +328,7 @@ def toggle_quiz(quiz_id):
             total_minutes = (quiz.duration_hours * 60) + quiz.duration_minutes
             quiz.end_datetime = quiz.start_datetime + datetime.timedelta(minutes=total_minutes)
         
+        invalidate_quiz_payload(quiz_id)
         db.session.commit()
         
         return jsonify({
@@ -253,15 +347,24 @@ def delete_quiz(quiz_id):
         if not quiz:
             return jsonify({"message": "Quiz not found"}), 404
         
-        # Delete related scores first
+        # Delete related scores first, then recount the rollups of everyone who took the quiz
+        user_ids = [user_id for (user_id,) in db.session.query(Score.user_id).filter_by(quiz_id=quiz_id).distinct()]
         Score.query.filter_by(quiz_id=quiz_id).delete()
+        QuizStats.query.filter_by(quiz_id=quiz_id).delete()
+        AttemptSession.query.filter_by(quiz_id=quiz_id).delete()
+        rebuild_stats(user_ids=user_ids)
         
-        # Delete related questions
+        # Delete related questions; the quiz row, and with it question_count, goes below
         Question.query.filter_by(quiz_id=quiz_id).delete()
         
         # Now delete the quiz
+        chapter_id = quiz.chapter_id
         db.session.delete(quiz)
+        bump_catalog_version()
+        invalidate_answer_key(quiz_id)
+        invalidate_quiz_payload(quiz_id)
         db.session.commit()
+        discard_quiz(quiz_id, chapter_id)
         
         return jsonify({"message": "Quiz deleted successfully"}), 200
     except Exception as e:
@@ -316,26 +419,25 @@ def update_user(user_id):
 @role_required('admin')
 def delete_user(user_id):
     user = User.query.get_or_404(user_id)
+    # Delete the user's scores first, then recount the rollups of the quizzes they took
+    quiz_chapters = db.session.query(Score.quiz_id, Quiz.chapter_id).join(Quiz, Quiz.id == Score.quiz_id).filter(
+        Score.user_id == user_id
+    ).distinct().all()
+    Score.query.filter_by(user_id=user_id).delete()
+    UserStats.query.filter_by(user_id=user_id).delete()
+    AttemptSession.query.filter_by(user_id=user_id).delete()
+    rebuild_stats(quiz_ids=[quiz_id for quiz_id, _ in quiz_chapters])
     db.session.delete(user)
     db.session.commit()
+    invalidate_user(user.email)
+    discard_user(user_id, quiz_chapters)
     return jsonify({"message": "User deleted"})
 
 # Admin: List all users
 @routes.route('/list_users', methods=['GET'])
 @role_required('admin')
 def list_users():
-    users = User.query.all()
-    return jsonify([
-        {
-            "id": u.id,
-            "email": u.email,
-            "full_name": u.full_name,
-            "qualification": u.qualification,
-            "date_of_birth": str(u.date_of_birth) if u.date_of_birth else None,
-            "role": u.role
-        }
-        for u in users
-    ])
+    return paginate(User, USER_FIELDS, filters={'role': equals(User.role, str)})
 
 # Create subjects
 @routes.route('/create_subjects', methods=['POST'])
@@ -344,6 +446,7 @@ def create_subject():
     data = request.json
     subject = Subject(name=data['name'], description=data.get('description', ''))
     db.session.add(subject)
+    bump_catalog_version()
     db.session.commit()
     return jsonify({"message": "Subject created", "id": subject.id}), 201
 
@@ -357,6 +460,7 @@ def update_subject(subject_id):
         return jsonify({"message": "Subject not found"}), 404
     subject.name = data['name']
     subject.description = data.get('description', '')
+    bump_catalog_version()
     db.session.commit()
     return jsonify({"message": "Subject updated"}), 200
 
@@ -369,6 +473,7 @@ def delete_subject(subject_id):
     if not subject:
         return jsonify({"message": "Subject not found"}), 404
     db.session.delete(subject)
+    bump_catalog_version()
     db.session.commit()
     return jsonify({"message": "Subject deleted"}), 200
 
@@ -387,9 +492,59 @@ def create_question():
         correct_option=data['correct_option']
     )
     db.session.add(question)
+    bump_catalog_version()
+    invalidate_answer_key(question.quiz_id)
+    invalidate_quiz_payload(question.quiz_id)
     db.session.commit()
     return jsonify({"message": "Question created", "id": question.id}), 201
 
+def question_file_format(filename=None):
+    """csv or jsonl, from ?format=, the upload's file name or the content type"""
+    fmt = request.args.get('format')
+    if not fmt and filename and '.' in filename:
+        fmt = filename.rsplit('.', 1)[1].lower()
+    if not fmt:
+        fmt = 'jsonl' if 'json' in (request.mimetype or '') else 'csv'
+    return {'ndjson': 'jsonl', 'json': 'jsonl'}.get(fmt, fmt)
+
+# Bulk import questions from a CSV or JSON Lines upload (multipart "file" or the raw body)
+@routes.route('/api/questions/import', methods=['POST'])
+@role_required('admin')
+def import_question_bank():
+    upload = request.files.get('file')
+    fmt = question_file_format(upload.filename if upload else None)
+    if fmt not in QUESTION_FORMATS:
+        return jsonify({"message": "format must be csv or jsonl"}), 400
+    stream = upload.stream if upload else request.stream
+    try:
+        result = import_questions(
+            stream, fmt,
+            quiz_id=request.args.get('quiz_id', type=int),
+            skip_invalid=request.args.get('skip_invalid') in ('1', 'true')
+        )
+    except ImportFormatError as e:
+        return jsonify({"message": str(e)}), 400
+    except csv.Error as e:
+        return jsonify({"message": f"Malformed CSV: {e}"}), 400
+    if result.error_count and not result.inserted:
+        return jsonify(result.to_json()), 400
+    return jsonify(result.to_json()), 201 if result.inserted else 200
+
+# Stream the question bank (or ?quiz_id=N) as CSV or JSON Lines
+@routes.route('/api/questions/export', methods=['GET'])
+@role_required('admin')
+def export_question_bank():
+    fmt = question_file_format()
+    if fmt not in QUESTION_FORMATS:
+        return jsonify({"message": "format must be csv or jsonl"}), 400
+    quiz_id = request.args.get('quiz_id', type=int)
+    filename = f"questions{f'_quiz{quiz_id}' if quiz_id else ''}.{fmt}"
+    return Response(
+        stream_with_context(export_questions(fmt, quiz_id)),
+        mimetype='text/csv' if fmt == 'csv' else 'application/x-ndjson',
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+
 # Edit/Update questions
 @routes.route('/update_questions/<int:question_id>', methods=['PUT'])
 @role_required('admin')
@@ -402,6 +557,9 @@ def update_question(question_id):
     question.option3 = data['option3']
     question.option4 = data['option4']
     question.correct_option = data['correct_option']
+    bump_catalog_version()
+    invalidate_answer_key(question.quiz_id)
+    invalidate_quiz_payload(question.quiz_id)
     db.session.commit()
     return jsonify({"message": "Question updated"})
 
@@ -411,194 +569,275 @@ def update_question(question_id):
 def delete_question(question_id):
     question = Question.query.get_or_404(question_id)
     db.session.delete(question)
+    bump_catalog_version()
+    invalidate_answer_key(question.quiz_id)
+    invalidate_quiz_payload(question.quiz_id)
     db.session.commit()
     return jsonify({"message": "Question deleted"})
 
-# Attempt a quiz
+# Attempt a quiz; kept for older clients and graded on the server like /api/grade-quiz
 @routes.route('/attempt_quiz/<int:quiz_id>', methods=['POST'])
 @role_required('user')
 def attempt_quiz(quiz_id):
-    data = request.json
-    # Example: Save user's answers and calculate score
-    user_email = get_jwt()['sub']
-    user = User.query.filter_by(email=user_email).first()
-    score = Score(user_id=user.id, quiz_id=quiz_id, score=data['score'])
-    db.session.add(score)
-    db.session.commit()
-    return jsonify({"message": "Quiz attempted", "score": data['score']}), 201
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        data = dict(data, quizId=quiz_id)
+    return grade_submission(data)
 
 # View user's own scores
 @routes.route('/my_scores', methods=['GET'])
 @role_required('user')
 def view_scores():
-    user_email = get_jwt()['sub']
-    user = User.query.filter_by(email=user_email).first()
-    scores = Score.query.filter_by(user_id=user.id).all()
-    return jsonify([
-        {"quiz_id": s.quiz_id, "score": s.score, "date_taken": s.date_taken}
-        for s in scores
-    ])
+    return paginate(Score, SCORE_FIELDS, filters={'quiz_id': equals(Score.quiz_id)},
+                    criteria=[Score.user_id == current_user_id()])
 #allow users to list available quizzes
 @routes.route('/available_quizzes', methods=['GET'])
 @role_required('user')
 def available_quizzes():
-    now = datetime.datetime.now(IST)
-    quizzes = Quiz.query.all()
-    
-    print(f"DEBUG: Current time (IST): {now}")
-    print(f"DEBUG: Total quizzes found: {len(quizzes)}")
-    
-    available_quizzes = []
-    for quiz in quizzes:
-        print(f"DEBUG: Checking quiz '{quiz.title}'")
-        print(f"DEBUG: Quiz start_datetime: {quiz.start_datetime}")
-        print(f"DEBUG: Quiz end_datetime: {quiz.end_datetime}")
-        
-        if quiz.start_datetime and quiz.end_datetime:
-            # Ensure timezone awareness
-            start_time = quiz.start_datetime.replace(tzinfo=IST) if quiz.start_datetime.tzinfo is None else quiz.start_datetime
-            end_time = quiz.end_datetime.replace(tzinfo=IST) if quiz.end_datetime.tzinfo is None else quiz.end_datetime
-            
-            print(f"DEBUG: Start time (IST): {start_time}")
-            print(f"DEBUG: End time (IST): {end_time}")
-            print(f"DEBUG: Is active? {start_time <= now <= end_time}")
-            
-            # Only include active quizzes
-            if start_time <= now <= end_time:
-                available_quizzes.append({
-                    "id": quiz.id, 
-                    "title": quiz.title,
-                    "start_datetime": start_time.isoformat(),
-                    "end_datetime": end_time.isoformat(),
-                    "duration_hours": quiz.duration_hours,
-                    "duration_minutes": quiz.duration_minutes,
-                    "status": "active"
-                })
-                print(f"DEBUG: Added quiz '{quiz.title}' to available list")
-    
-    print(f"DEBUG: Final available quizzes count: {len(available_quizzes)}")
-    return jsonify(available_quizzes)
+    # Served from the in-memory schedule until the next start/end transition
+    return jsonify([dict(entry, status="active") for entry in quiz_schedule.active()])
+
+# Quizzes starting within the next N hours (default 24)
+@routes.route('/upcoming_quizzes', methods=['GET'])
+@role_required('user')
+def upcoming_quizzes():
+    hours = request.args.get('hours', 24, type=int)
+    if hours < 0:
+        return jsonify({"message": "hours must not be negative"}), 400
+    quizzes = upcoming_quizzes_query(ist_now(), hours).all()
+    return jsonify([dict(quiz_window_entry(quiz), status="upcoming") for quiz in quizzes])
 
 # Get all subjects with their chapters and quizzes
 @routes.route('/api/subjects', methods=['GET'])
 @jwt_required()  # Add JWT requirement
 def get_subjects():
-    subjects = Subject.query.all()
-    now = datetime.datetime.now(IST)
-    
-    def get_quiz_status(quiz):
-        if not quiz.start_datetime:
-            return 'upcoming'
-        # Ensure timezone awareness
-        start_time = quiz.start_datetime.replace(tzinfo=IST)
-        end_time = quiz.end_datetime.replace(tzinfo=IST)
-        if now < start_time:
-            return 'upcoming'
-        elif now > end_time:
-            return 'expired'
-        return 'active'
-
-    return jsonify([{
-        'id': subject.id,
-        'name': subject.name,
-        'description': subject.description,
-        'chapters': [{
-            'id': chapter.id,
-            'name': chapter.name,
-            'description': chapter.description,
-            'quizzes': [{
-                'id': quiz.id,
-                'title': quiz.title,
-                'start_datetime': quiz.start_datetime.isoformat() if quiz.start_datetime else None,
-                'duration_hours': quiz.duration_hours,
-                'duration_minutes': quiz.duration_minutes,
-                'end_datetime': quiz.end_datetime.isoformat() if quiz.end_datetime else None,
-                'status': get_quiz_status(quiz),
-                'questions': [{
-                    'id': question.id,
-                    'question_text': question.question_text,
-                    'option1': question.option1,
-                    'option2': question.option2,
-                    'option3': question.option3,
-                    'option4': question.option4
-                } for question in quiz.questions]
-            } for quiz in chapter.quizzes]
-        } for chapter in subject.chapters]
-    } for subject in subjects])
+    # The tree is cached as JSON per catalog version; only quiz statuses are computed here
+    return Response(catalog_tree_json(), mimetype='application/json')
 
 # Get quiz details with questions
 @routes.route('/api/quizzes/<int:quiz_id>', methods=['GET'])
 @role_required('user')
 def get_quiz(quiz_id):
-    quiz = Quiz.query.get_or_404(quiz_id)
-    now = datetime.datetime.now(IST)
+    # Served from the per-quiz cache; a burst of students at the start time costs one query
+    payload = get_quiz_payload(quiz_id)
+    if payload is None:
+        return jsonify({"message": "Quiz not found"}), 404
     
     # Check if quiz is active
-    if not quiz.start_datetime or not quiz.end_datetime:
+    if not payload.start_datetime or not payload.end_datetime:
         return jsonify({"message": "Quiz is not available"}), 403
     
-    start_time = quiz.start_datetime.replace(tzinfo=IST) if quiz.start_datetime.tzinfo is None else quiz.start_datetime
-    end_time = quiz.end_datetime.replace(tzinfo=IST) if quiz.end_datetime.tzinfo is None else quiz.end_datetime
-    
     # Only allow access if quiz is currently active
-    if not (start_time <= now <= end_time):
+    if not payload.is_active(ist_now()):
         return jsonify({"message": "Quiz is not currently active"}), 403
     
-    questions = Question.query.filter_by(quiz_id=quiz.id).all()
+    return Response(payload.body, mimetype='application/json')
+
+def submission_error(data):
+    """Why a submission cannot be queued, as (message, status), or None.
+
+    Checked before the 202: a record the flusher cannot insert would otherwise be
+    acknowledged and then lost.
+    """
+    if not isinstance(data, dict):
+        return "Expected a JSON object", 400
+    quiz_id = data.get('quizId')
+    if not isinstance(quiz_id, int) or isinstance(quiz_id, bool):
+        return "quizId must be a quiz id", 400
+    # The idempotency key: a retry with the same attemptId is stored once
+    attempt_id = data.get('attemptId')
+    if not isinstance(attempt_id, str) or not 0 < len(attempt_id) <= 64:
+        return "attemptId must be a string of 1 to 64 characters", 400
+    if not isinstance(data.get('answers'), dict):
+        return "answers must map question ids to options", 400
+    # Cached per quiz, so this costs no query while a quiz is being taken
+    payload = get_quiz_payload(quiz_id)
+    if payload is None:
+        return "Quiz not found", 404
+    # Submissions still in flight when the quiz closes get the autosave grace period
+    grace = datetime.timedelta(seconds=current_app.config.get('AUTOSAVE_GRACE_SECONDS', 5))
+    if not payload.is_active(ist_now(), grace):
+        return "Quiz is not currently active", 403
+    return None
+
+def grade_submission(data):
+    """Grade a submission's answers on the server and queue the score; a client-sent score is ignored"""
+    error = submission_error(data)
+    if error:
+        return jsonify({"message": error[0]}), error[1]
+    try:
+        score, total_questions = grade_answers(data['quizId'], data['answers'])
+    except AnswerError as e:
+        return jsonify({"message": str(e)}), 400
+    if total_questions == 0:
+        return jsonify({"message": "Quiz not found"}), 404
+
+    # Acknowledge once the score is in the durable queue; the flusher inserts it in a batch
+    attempt_key = queue_submission(current_user_id(), data['quizId'], score, data['attemptId'])
+
     return jsonify({
-        'id': quiz.id,
-        'title': quiz.title,
-        'start_datetime': start_time.isoformat(),
-        'duration_hours': quiz.duration_hours,
-        'duration_minutes': quiz.duration_minutes,
-        'end_datetime': end_time.isoformat(),
-        'questions': [{
-            'id': q.id,
-            'question_text': q.question_text,
-            'option1': q.option1,
-            'option2': q.option2,
-            'option3': q.option3,
-            'option4': q.option4,
-            'correct_option': q.correct_option
-        } for q in questions]
-    })
-
-# Submit quiz attempt
+        'message': 'Quiz submitted successfully',
+        'score': score,
+        'total_questions': total_questions,
+        'attempt_id': attempt_key
+    }), 202
+
+# Submit quiz attempt; kept for older clients and graded on the server like /api/grade-quiz
 @routes.route('/api/submit-quiz', methods=['POST'])
 @role_required('user')
 def submit_quiz():
-    data = request.json
-    user_email = get_jwt()['sub']
-    user = User.query.filter_by(email=user_email).first()
-    
-    score = Score(
-        user_id=user.id,
-        quiz_id=data['quizId'],
-        score=data['score']
-    )
-    db.session.add(score)
-    db.session.commit()
-    
+    return grade_submission(request.get_json(silent=True))
+
+# Grade a quiz attempt on the server from the raw answers
+@routes.route('/api/grade-quiz', methods=['POST'])
+@role_required('user')
+def grade_quiz():
+    return grade_submission(request.get_json(silent=True))
+
+# Start a quiz attempt on the server, or resume the open one
+@routes.route('/api/quizzes/<int:quiz_id>/attempts', methods=['POST'])
+@role_required('user')
+def start_attempt(quiz_id):
+    session, created = open_attempt(current_user_id(), quiz_id)
+    return jsonify(attempt_json(session)), 201 if created else 200
+
+# Resume an attempt after a refresh or on another device
+@routes.route('/api/attempts/<attempt_id>', methods=['GET'])
+@role_required('user')
+def get_attempt_state(attempt_id):
+    session = resume_attempt(get_attempt(attempt_id, current_user_id()))
+    if session.status == 'open' and is_expired(session):
+        finalize_attempt(session)
+    return jsonify(attempt_json(session, with_questions=session.status == 'open'))
+
+# Autosave answer changes; they reach the database with the next batched flush
+@routes.route('/api/attempts/<attempt_id>/answers', methods=['PATCH'])
+@role_required('user')
+def autosave_answers(attempt_id):
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"message": "Expected a JSON object"}), 400
+    save_answers(attempt_id, current_user_id(), data.get('seq'), data.get('answers'))
+    return jsonify({'seq': data['seq']}), 202
+
+# Submit an attempt, optionally with its last unsaved answers, and grade it
+@routes.route('/api/attempts/<attempt_id>/submit', methods=['POST'])
+@role_required('user')
+def submit_attempt(attempt_id):
+    # The body is optional; answers sent with it are the last unsaved ones
+    data = request.get_json(silent=True)
+    if data is None:
+        data = {}
+    if not isinstance(data, dict):
+        return jsonify({"message": "Expected a JSON object"}), 400
+    session = get_attempt(attempt_id, current_user_id())
+    score, total_questions = finalize_attempt(session, data.get('answers'))
     return jsonify({
         'message': 'Quiz submitted successfully',
-        'score': data['score']
-    }), 201
+        'score': score,
+        'total_questions': total_questions,
+        'attempt_id': session.id
+    }), 202
 
 # Get user's quiz history
 @routes.route('/api/quiz-history', methods=['GET'])
 @role_required('user')
 def get_quiz_history():
-    user_email = get_jwt()['sub']
-    user = User.query.filter_by(email=user_email).first()
-    scores = Score.query.filter_by(user_id=user.id).all()
-    
-    return jsonify([{
-        'quiz_id': score.quiz_id,
-        'quiz_title': score.quiz.title,
-        'score': score.score,
-        'total_questions': len(score.quiz.questions),
-        'date_taken': score.date_taken.strftime('%Y-%m-%d %H:%M:%S')
-    } for score in scores])
+    return jsonify(quiz_history(current_user_id()))
+
+# Everything the student dashboard needs on load, in one response
+@routes.route('/api/dashboard-bootstrap', methods=['GET'])
+@role_required('user')
+def dashboard_bootstrap():
+    user_id = current_user_id()
+    snapshot = catalog_snapshot()
+    now = datetime.datetime.now(IST)
+
+    # The payload only changes with the catalog, a quiz starting or ending, or the user's attempts
+    rollup = db.session.get(UserStats, user_id)
+    attempts = rollup.attempts if rollup else 0
+    last_attempt_at = rollup.last_attempt_at if rollup else None
+    etag = hashlib.sha1(
+        f"{snapshot.version}:{snapshot.status_epoch(now)}:{user_id}:{attempts}:{last_attempt_at}".encode()
+    ).hexdigest()
+    # Weak comparison: compressed responses carry the ETag as W/"..."
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        lists = snapshot.lists.render(now)
+        history = json.dumps(quiz_history(user_id, snapshot), separators=(',', ':'))
+        user_stats = json.dumps(stats_json(rollup), separators=(',', ':'))
+        response = Response(lists[:-1] + ',"history":' + history + ',"stats":' + user_stats + '}',
+                            mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+# The caller's attempt count, averages, best and percentage histogram
+@routes.route('/api/stats/me', methods=['GET'])
+@role_required('user')
+def my_stats():
+    return jsonify(stats_json(db.session.get(UserStats, current_user_id())))
+
+# Admin: one user's rollup
+@routes.route('/api/stats/users/<int:user_id>', methods=['GET'])
+@role_required('admin')
+def user_stats(user_id):
+    return jsonify(stats_json(db.session.get(UserStats, user_id)))
+
+# Admin: one quiz's rollup; average_percentage doubles as its difficulty
+@routes.route('/api/stats/quizzes/<int:quiz_id>', methods=['GET'])
+@role_required('admin')
+def quiz_stats(quiz_id):
+    return jsonify(stats_json(db.session.get(QuizStats, quiz_id)))
+
+# Admin: recompute every rollup from the Score table in the background
+@routes.route('/api/stats/rebuild', methods=['POST'])
+@role_required('admin')
+def rebuild_stats_job():
+    try:
+        task = rebuild_all_stats.delay()
+    except Exception as e:
+        logger.error("Failed to queue stats rebuild: %s", e)
+        return jsonify({"error": f"Failed to queue rebuild: {str(e)}"}), 503
+    return jsonify({"message": "Rebuild queued", "task_id": task.id}), 202
+
+# Leaderboards: ?limit=N (default 10, at most 100) top entries plus the caller's own rank
+LEADERBOARD_MAX_LIMIT = 100
+
+def leaderboard_response(key):
+    limit = min(max(request.args.get('limit', 10, type=int), 1), LEADERBOARD_MAX_LIMIT)
+    try:
+        return jsonify(leaderboard(key, current_user_id(), limit))
+    except RedisError as e:
+        logger.error("Leaderboard read failed: %s", e)
+        return jsonify({"message": "Leaderboard is unavailable"}), 503
+
+@routes.route('/api/leaderboards/global', methods=['GET'])
+@jwt_required()
+def global_leaderboard():
+    return leaderboard_response(GLOBAL_KEY)
+
+@routes.route('/api/leaderboards/quizzes/<int:quiz_id>', methods=['GET'])
+@jwt_required()
+def quiz_leaderboard(quiz_id):
+    return leaderboard_response(quiz_key(quiz_id))
+
+@routes.route('/api/leaderboards/chapters/<int:chapter_id>', methods=['GET'])
+@jwt_required()
+def chapter_leaderboard(chapter_id):
+    return leaderboard_response(chapter_key(chapter_id))
+
+# Admin: rebuild every leaderboard from the Score table
+@routes.route('/api/leaderboards/rebuild', methods=['POST'])
+@role_required('admin')
+def rebuild_leaderboards_now():
+    try:
+        boards = rebuild_leaderboards()
+    except RedisError as e:
+        logger.error("Leaderboard rebuild failed: %s", e)
+        return jsonify({"message": "Leaderboard is unavailable"}), 503
+    return jsonify({"message": "Leaderboards rebuilt", "boards": boards})
 
 # Create Chapter
 @routes.route('/create_chapters', methods=['POST'])
@@ -611,6 +850,7 @@ def create_chapter():
         subject_id=data['subject_id']
     )
     db.session.add(chapter)
+    bump_catalog_version()
     db.session.commit()
     return jsonify({"message": "Chapter created", "id": chapter.id}), 201
 
@@ -623,6 +863,7 @@ def update_chapter(chapter_id):
     chapter.name = data['name']
     chapter.description = data.get('description', chapter.description)
     chapter.subject_id = data.get('subject_id', chapter.subject_id)
+    bump_catalog_version()
     db.session.commit()
     return jsonify({"message": "Chapter updated"}), 200
 
@@ -632,6 +873,7 @@ def update_chapter(chapter_id):
 def delete_chapter(chapter_id):
     chapter = Chapter.query.get_or_404(chapter_id)
     db.session.delete(chapter)
+    bump_catalog_version()
     db.session.commit()
     return jsonify({"message": "Chapter deleted"}), 200
 
@@ -646,13 +888,7 @@ def get_chapters():
         response.headers['Access-Control-Allow-Methods'] = 'GET,OPTIONS'
         response.headers['Access-Control-Allow-Headers'] = 'Content-Type,Authorization'
         return response, 200
-    chapters = Chapter.query.all()
-    return jsonify([{
-        'id': chapter.id,
-        'name': chapter.name,
-        'description': chapter.description,
-        'subject_id': chapter.subject_id
-    } for chapter in chapters])
+    return paginate(Chapter, CHAPTER_FIELDS, filters={'subject_id': equals(Chapter.subject_id)})
 
 # Fix CORS for /api/quizzes
 @routes.route('/api/quizzes', methods=['GET', 'OPTIONS'])
@@ -665,50 +901,31 @@ def get_quizzes():
         response.headers['Access-Control-Allow-Methods'] = 'GET,OPTIONS'
         response.headers['Access-Control-Allow-Headers'] = 'Content-Type,Authorization'
         return response, 200
-    
-    quizzes = Quiz.query.all()
-    now = datetime.datetime.now(IST)
-    
-    def get_quiz_status(quiz):
-        if not quiz.start_datetime or not quiz.end_datetime:
+
+    now = ist_now()
+
+    def get_quiz_status(start_datetime, end_datetime):
+        if not start_datetime or not end_datetime:
             return 'inactive'
-        start_time = quiz.start_datetime.replace(tzinfo=IST) if quiz.start_datetime.tzinfo is None else quiz.start_datetime
-        end_time = quiz.end_datetime.replace(tzinfo=IST) if quiz.end_datetime.tzinfo is None else quiz.end_datetime
-        if now < start_time:
+        if now < start_datetime:
             return 'upcoming'
-        elif now > end_time:
+        elif now > end_datetime:
             return 'expired'
         return 'active'
-    
-    return jsonify([{
-        'id': quiz.id,
-        'title': quiz.title,
-        'chapter_id': quiz.chapter_id,
-        'start_datetime': quiz.start_datetime.isoformat() if quiz.start_datetime else None,
-        'end_datetime': quiz.end_datetime.isoformat() if quiz.end_datetime else None,
-        'duration_hours': quiz.duration_hours,
-        'duration_minutes': quiz.duration_minutes,
-        'status': get_quiz_status(quiz)
-    } for quiz in quizzes])
+
+    def status_filter(status):
+        if status not in QUIZ_STATUS_CRITERIA:
+            raise PageRequestError(f"Invalid value for status: {status}")
+        return QUIZ_STATUS_CRITERIA[status](now)
+
+    fields = dict(QUIZ_FIELDS, status=Field(Quiz.start_datetime, Quiz.end_datetime, render=get_quiz_status))
+    return paginate(Quiz, fields, filters={'chapter_id': equals(Quiz.chapter_id), 'status': status_filter})
 
 # Get all questions (for admin)
 @routes.route('/api/questions', methods=['GET'])
 @role_required('admin')
 def get_questions():
-    questions = Question.query.all()
-    return jsonify([
-        {
-            'id': q.id,
-            'quiz_id': q.quiz_id,
-            'question_text': q.question_text,
-            'option1': q.option1,
-            'option2': q.option2,
-            'option3': q.option3,
-            'option4': q.option4,
-            'correct_option': q.correct_option
-        }
-        for q in questions
-    ])
+    return paginate(Question, QUESTION_FIELDS, filters={'quiz_id': equals(Question.quiz_id)})
 
 # Debug endpoint to check quiz status
 @routes.route('/debug/quizzes', methods=['GET'])
@@ -742,84 +959,105 @@ def debug_quizzes():
 @role_required('admin')
 def export_user_performance():
     try:
-        # Get all users with their performance data
-        users = User.query.all()
-        
-        # Create a temporary file to store CSV data
-        temp_file = tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.csv', newline='')
-        
-        # Write CSV data
-        writer = csv.writer(temp_file)
-        
-        # Write header
-        writer.writerow([
-            'User ID',
-            'Full Name', 
-            'Email',
-            'Role',
-            'Qualification',
-            'Date of Birth',
-            'Total Quizzes Taken',
-            'Average Score (%)',
-            'Best Score (%)',
-            'Total Questions Attempted',
-            'Last Quiz Date'
-        ])
-        
-        # Write user data with performance metrics
-        for user in users:
-            # Get user's scores
-            scores = Score.query.filter_by(user_id=user.id).all()
-            
-            # Calculate performance metrics
-            total_quizzes = len(scores)
-            total_questions = sum(len(score.quiz.questions) for score in scores) if scores else 0
-            
-            if scores:
-                # Calculate average score percentage
-                total_score_percentage = 0
-                best_score_percentage = 0
-                last_quiz_date = None
-                
-                for score in scores:
-                    if score.quiz.questions:
-                        score_percentage = (score.score / len(score.quiz.questions)) * 100
-                        total_score_percentage += score_percentage
-                        best_score_percentage = max(best_score_percentage, score_percentage)
-                        
-                        if not last_quiz_date or score.date_taken > last_quiz_date:
-                            last_quiz_date = score.date_taken
-                
-                average_score = total_score_percentage / total_quizzes if total_quizzes > 0 else 0
-            else:
-                average_score = 0
-                best_score_percentage = 0
-                last_quiz_date = None
-            
-            # Write user row
-            writer.writerow([
-                user.id,
-                user.full_name or 'N/A',
-                user.email,
-                user.role,
-                user.qualification or 'N/A',
-                user.date_of_birth.strftime('%Y-%m-%d') if user.date_of_birth else 'N/A',
-                total_quizzes,
-                round(average_score, 2),
-                round(best_score_percentage, 2),
-                total_questions,
-                last_quiz_date.strftime('%Y-%m-%d %H:%M:%S') if last_quiz_date else 'N/A'
-            ])
-        
-        temp_file.close()
-        
-        # Return the file for download
-        return send_file(
-            temp_file.name,
-            as_attachment=True,
-            download_name=f'user_performance_report_{datetime.datetime.now().strftime("%Y%m%d_%H%M%S")}.csv',
-            mimetype='text/csv'
+        rows = user_performance_rows()
+        filename = f'user_performance_report_{datetime.datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
+        # Stream the CSV row by row instead of building it in a temp file
+        return Response(
+            stream_with_context(generate_user_performance_csv(rows)),
+            mimetype='text/csv',
+            headers={'Content-Disposition': f'attachment; filename={filename}'}
         )
-        
     except Exception as e:
         return jsonify({"error": f"Failed to export data: {str(e)}"}), 500
+
+
+# Start a background export job (returns the existing job if one is still live)
+@routes.route('/api/exports/<report>', methods=['POST'])
+@role_required('admin')
+def start_export_job(report):
+    if report not in EXPORT_REPORTS:
+        return jsonify({"message": "Unknown report"}), 404
+    try:
+        job = start_export(report)
+    except ExportDispatchError as e:
+        return jsonify({"error": f"Failed to queue export: {str(e)}"}), 503
+    return jsonify(job), 202
+
+# Poll an export job's progress
+@routes.route('/api/exports/jobs/<job_id>', methods=['GET'])
+@role_required('admin')
+def get_export_job(job_id):
+    try:
+        job = read_job(job_id)
+    except ValueError:
+        job = None
+    if not job:
+        return jsonify({"message": "Export job not found"}), 404
+    return jsonify(job)
+
+# Download a finished export
+@routes.route('/api/exports/jobs/<job_id>/download', methods=['GET'])
+@role_required('admin')
+def download_export_job(job_id):
+    try:
+        job = read_job(job_id)
+    except ValueError:
+        job = None
+    if not job:
+        return jsonify({"message": "Export job not found"}), 404
+    if job['status'] != 'done':
+        return jsonify({"message": "Export is not ready", "status": job['status']}), 409
+    return send_file(
+        artifact_path(job),
+        as_attachment=True,
+        download_name=export_download_name(job),
+        mimetype=EXPORT_REPORTS[job['report']]['mimetype']
+    )
+
+
+# What profiling is armed, if any
+@routes.route('/api/admin/profiling', methods=['GET'])
+@role_required('admin')
+def get_profiling():
+    return jsonify({'armed': armed_state(), 'formats': sorted(PROFILE_FORMATS)})
+
+# Profile the next N requests to an endpoint (a URL rule such as /api/quizzes/<int:quiz_id>, or a path)
+@routes.route('/api/admin/profiling', methods=['POST'])
+@role_required('admin')
+def arm_profiling():
+    data = request.get_json(silent=True) or {}
+    endpoint = data.get('endpoint')
+    if not isinstance(endpoint, str) or not endpoint.startswith('/') or not known_endpoint(endpoint):
+        return jsonify({"message": "Unknown endpoint"}), 400
+    count = data.get('count', 10)
+    if not isinstance(count, int) or isinstance(count, bool) or not 1 <= count <= 100:
+        return jsonify({"message": "count must be between 1 and 100"}), 400
+    fmt = data.get('format', 'collapsed')
+    if fmt not in PROFILE_FORMATS:
+        return jsonify({"message": f"format must be one of {', '.join(sorted(PROFILE_FORMATS))}"}), 400
+    return jsonify({'armed': arm(endpoint, count, fmt, armed_by=current_user_id())}), 201
+
+# Stop profiling before the armed requests are used up
+@routes.route('/api/admin/profiling', methods=['DELETE'])
+@role_required('admin')
+def disarm_profiling():
+    disarm()
+    return jsonify({'armed': None})
+
+# Captured profiles, newest first
+@routes.route('/api/admin/profiles', methods=['GET'])
+@role_required('admin')
+def get_profiles():
+    return jsonify(list_profiles())
+
+# Download one captured profile
+@routes.route('/api/admin/profiles/<name>', methods=['GET'])
+@role_required('admin')
+def download_profile(name):
+    try:
+        path = profile_path(name)
+    except ValueError:
+        path = None
+    if path is None or not os.path.exists(path):
+        return jsonify({"message": "Profile not found"}), 404
+    return send_file(path, as_attachment=True, download_name=name, mimetype='application/octet-stream')
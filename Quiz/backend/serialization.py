@@ -0,0 +1,146 @@
+"""JSON encoding, row DTOs and response compression shared by the API.
+
+orjson is used when it is installed (JSON_ENCODER=stdlib turns it off); it
+encodes dicts, lists, dataclasses and datetimes in C. List endpoints build a
+__slots__ dataclass per row straight from the selected column tuple, so no ORM
+objects or per-row dicts are created. Responses above COMPRESS_MIN_SIZE bytes
+are gzip- or deflate-encoded when the client accepts it.
+"""
+import dataclasses
+import datetime
+import gzip
+import json
+import threading
+import zlib
+from collections import OrderedDict
+from functools import lru_cache
+from flask import current_app, request
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # Optional; the stdlib encoder is used without it
+    orjson = None
+
+# Encodings we can produce, in order of preference
+ENCODINGS = ['gzip', 'deflate']
+COMPRESSIBLE_MIMETYPES = {'application/json', 'text/csv', 'text/html', 'text/plain', 'application/javascript',
+                          'text/css'}
+
+# Many clients get byte-identical bodies (the catalog, a quiz payload); compress each once
+COMPRESSED_CACHE_ENTRIES = 64
+COMPRESSED_CACHE_MAX_BODY = 256 * 1024
+
+_use_orjson = orjson is not None
+_compressed = OrderedDict()
+_compressed_lock = threading.Lock()
+
+
+def _default(value):
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    if dataclasses.is_dataclass(value):
+        return {field.name: getattr(value, field.name) for field in dataclasses.fields(value)}
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(value):
+    """Compact UTF-8 JSON bytes; datetimes as ISO 8601, dataclasses as objects"""
+    if _use_orjson:
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(value, default=_default, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def json_response(value, status=200):
+    return current_app.response_class(dumps(value), status=status, mimetype='application/json')
+
+
+@lru_cache(maxsize=256)
+def row_type(name, field_names):
+    """A __slots__ dataclass with the given fields, one per model and field selection"""
+    return dataclasses.make_dataclass(name, field_names, slots=True)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Flask's JSON provider with orjson underneath, keeping Flask's output conventions.
+
+    Dates still go through Flask's default (HTTP date strings) and keys stay sorted,
+    so jsonify() returns the same JSON as before, only faster.
+    """
+
+    def dumps(self, obj, **kwargs):
+        if not _use_orjson or kwargs:
+            return super().dumps(obj, **kwargs)
+        return self._orjson_dumps(obj).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if not _use_orjson or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def _orjson_dumps(self, obj):
+        option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=self.default, option=option)
+
+    def response(self, *args, **kwargs):
+        pretty = (self.compact is None and self._app.debug) or self.compact is False
+        if not _use_orjson or pretty:
+            return super().response(*args, **kwargs)
+        body = self._orjson_dumps(self._prepare_response_obj(args, kwargs)) + b'\n'
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+def _compress(body, encoding, level):
+    key = (encoding, level, body)
+    with _compressed_lock:
+        compressed = _compressed.get(key)
+        if compressed is not None:
+            _compressed.move_to_end(key)
+            return compressed
+    if encoding == 'gzip':
+        compressed = gzip.compress(body, compresslevel=level, mtime=0)
+    else:
+        compressed = zlib.compress(body, level)
+    if len(body) <= COMPRESSED_CACHE_MAX_BODY:
+        with _compressed_lock:
+            _compressed[key] = compressed
+            if len(_compressed) > COMPRESSED_CACHE_ENTRIES:
+                _compressed.popitem(last=False)
+    return compressed
+
+
+def compress_response(response):
+    """Encode a large, compressible response with the best encoding the client accepts"""
+    if (response.direct_passthrough or response.is_streamed or response.status_code < 200
+            or response.status_code in (204, 206, 304) or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+    body = response.get_data()
+    if len(body) < current_app.config.get('COMPRESS_MIN_SIZE', 1024):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = request.accept_encodings.best_match(ENCODINGS)
+    if encoding is None:
+        return response
+    compressed = _compress(body, encoding, current_app.config.get('COMPRESS_LEVEL', 6))
+    if len(compressed) >= len(body):
+        return response
+
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+    # The encoded bytes differ from the identity representation; only a weak validator still holds
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def init_serialization(app):
+    global _use_orjson
+    _use_orjson = orjson is not None and app.config.get('JSON_ENCODER', 'orjson') != 'stdlib'
+    app.json = FastJSONProvider(app)
+    if app.config.get('COMPRESS_MIN_SIZE', 1024) > 0:
+        app.after_request(compress_response)
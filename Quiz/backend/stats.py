@@ -0,0 +1,161 @@
+"""Per-user and per-quiz score rollups (user_stats and quiz_stats).
+
+Whatever inserts scores calls record_scores() with the rows it actually inserted,
+in the same transaction, so the rollups never disagree with the Score table.
+rebuild_stats() recomputes them from scratch, e.g. to backfill an existing database
+or after scores are deleted.
+"""
+import logging
+from celery import shared_task
+from sqlalchemy import case, delete, func, insert, select, text
+from database import dialect_insert
+from models import db, Quiz, Score, UserStats, QuizStats, HISTOGRAM_BUCKETS
+
+logger = logging.getLogger(__name__)
+
+BUCKETS = [f'bucket_{i}' for i in range(HISTOGRAM_BUCKETS)]
+# Rollup columns that merge by addition
+SUMMED = ['attempts', 'score_sum', 'graded_attempts', 'question_sum', 'percentage_sum'] + BUCKETS
+# Column order of the grouped rebuild query
+ROLLUP_COLUMNS = ['attempts', 'score_sum', 'best_score', 'graded_attempts', 'question_sum',
+                  'percentage_sum', 'best_percentage', 'last_attempt_at'] + BUCKETS
+
+
+def percentage_bucket(percentage):
+    return min(HISTOGRAM_BUCKETS - 1, max(0, int(percentage // 10)))
+
+
+def _greatest(current, new):
+    return case((current.is_(None), new), (new.is_(None), current), (new > current, new), else_=current)
+
+
+def _empty_totals():
+    totals = dict.fromkeys(SUMMED, 0)
+    totals.update(best_score=None, best_percentage=None, last_attempt_at=None)
+    return totals
+
+
+def _fold(totals, score, question_count, date_taken):
+    totals['attempts'] += 1
+    totals['score_sum'] += score
+    totals['best_score'] = score if totals['best_score'] is None else max(totals['best_score'], score)
+    if question_count:
+        percentage = score * 100.0 / question_count
+        totals['graded_attempts'] += 1
+        totals['question_sum'] += question_count
+        totals['percentage_sum'] += percentage
+        best = totals['best_percentage']
+        totals['best_percentage'] = percentage if best is None else max(best, percentage)
+        totals[BUCKETS[percentage_bucket(percentage)]] += 1
+    if date_taken is not None and (totals['last_attempt_at'] is None or date_taken > totals['last_attempt_at']):
+        totals['last_attempt_at'] = date_taken
+
+
+def _upsert(model, key, totals):
+    """Merge per-entity totals into a rollup table with one executemany upsert"""
+    table = model.__table__
+    statement = dialect_insert(db.engine, model)
+    excluded = statement.excluded
+    updates = {name: table.c[name] + excluded[name] for name in SUMMED}
+    updates['best_score'] = _greatest(table.c.best_score, excluded.best_score)
+    updates['best_percentage'] = _greatest(table.c.best_percentage, excluded.best_percentage)
+    updates['last_attempt_at'] = _greatest(table.c.last_attempt_at, excluded.last_attempt_at)
+    # Sorted so concurrent writers lock rows in the same order
+    rows = [dict(values, **{key: entity_id}) for entity_id, values in sorted(totals.items())]
+    db.session.execute(statement.on_conflict_do_update(index_elements=[key], set_=updates), rows)
+
+
+def record_scores(scores):
+    """Fold newly inserted (user_id, quiz_id, score, date_taken) rows into the rollups.
+
+    Runs in the caller's transaction; pass only rows that were really inserted.
+    """
+    scores = list(scores)
+    if not scores:
+        return
+    quiz_ids = {quiz_id for _, quiz_id, _, _ in scores}
+    question_counts = dict(db.session.query(Quiz.id, Quiz.question_count).filter(Quiz.id.in_(quiz_ids)))
+
+    by_user, by_quiz = {}, {}
+    for user_id, quiz_id, score, date_taken in scores:
+        score = score or 0
+        question_count = question_counts.get(quiz_id, 0)
+        for totals in (by_user.setdefault(user_id, _empty_totals()), by_quiz.setdefault(quiz_id, _empty_totals())):
+            _fold(totals, score, question_count, date_taken)
+
+    _upsert(UserStats, 'user_id', by_user)
+    _upsert(QuizStats, 'quiz_id', by_quiz)
+
+
+def _aggregate(group_column):
+    """The rollup columns for every group_column value, computed from Score in one grouped query"""
+    question_count = func.coalesce(Quiz.question_count, 0)
+    graded = question_count > 0
+    score = func.coalesce(Score.score, 0)
+    percentage = case((graded, score * 100.0 / func.nullif(question_count, 0)), else_=None)
+    bucket = case(*[(percentage >= 10 * i, i) for i in range(HISTOGRAM_BUCKETS - 1, 0, -1)], else_=0)
+    graded_bucket = case((graded, bucket), else_=None)
+    return select(
+        group_column,
+        func.count(Score.id),
+        func.sum(score),
+        func.max(score),
+        func.sum(case((graded, 1), else_=0)),
+        func.sum(case((graded, question_count), else_=0)),
+        func.coalesce(func.sum(percentage), 0),
+        func.max(percentage),
+        func.max(Score.date_taken),
+        *[func.sum(case((graded_bucket == i, 1), else_=0)) for i in range(HISTOGRAM_BUCKETS)]
+    ).select_from(Score).outerjoin(Quiz, Quiz.id == Score.quiz_id).group_by(group_column)
+
+
+def _rebuild(model, key, score_column, ids):
+    key_column = model.__table__.c[key]
+    aggregate = _aggregate(score_column)
+    clear = delete(model)
+    if ids is not None:
+        aggregate = aggregate.where(score_column.in_(ids))
+        clear = clear.where(key_column.in_(ids))
+    db.session.execute(clear)
+    db.session.execute(insert(model).from_select([key] + ROLLUP_COLUMNS, aggregate))
+
+
+def rebuild_stats(user_ids=None, quiz_ids=None):
+    """Recompute rollups from the Score table: all of them, or only the given users and quizzes"""
+    if db.engine.dialect.name == 'postgresql':
+        # Concurrent record_scores() calls wait, then apply on top of the rebuilt rows
+        db.session.execute(text('LOCK TABLE user_stats, quiz_stats IN SHARE ROW EXCLUSIVE MODE'))
+    if user_ids is None and quiz_ids is None:
+        _rebuild(UserStats, 'user_id', Score.user_id, None)
+        _rebuild(QuizStats, 'quiz_id', Score.quiz_id, None)
+    else:
+        if user_ids:
+            _rebuild(UserStats, 'user_id', Score.user_id, list(user_ids))
+        if quiz_ids:
+            _rebuild(QuizStats, 'quiz_id', Score.quiz_id, list(quiz_ids))
+
+
+@shared_task
+def rebuild_all_stats():
+    """Backfill job: recompute every rollup row"""
+    rebuild_stats()
+    db.session.commit()
+    logger.info("Rebuilt user and quiz statistics")
+
+
+def stats_json(rollup):
+    """A rollup row as the API returns it"""
+    if rollup is None:
+        return {'attempts': 0, 'graded_attempts': 0, 'average_score': None, 'best_score': None,
+                'average_percentage': None, 'best_percentage': None, 'last_attempt_at': None,
+                'histogram': [0] * HISTOGRAM_BUCKETS}
+    return {
+        'attempts': rollup.attempts,
+        'graded_attempts': rollup.graded_attempts,
+        'average_score': round(rollup.score_sum / rollup.attempts, 2) if rollup.attempts else None,
+        'best_score': rollup.best_score,
+        'average_percentage': round(rollup.percentage_sum / rollup.graded_attempts, 2) if rollup.graded_attempts else None,
+        'best_percentage': round(rollup.best_percentage, 2) if rollup.best_percentage is not None else None,
+        'last_attempt_at': rollup.last_attempt_at.strftime('%Y-%m-%d %H:%M:%S') if rollup.last_attempt_at else None,
+        'histogram': [getattr(rollup, name) for name in BUCKETS]
+    }
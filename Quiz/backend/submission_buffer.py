@@ -0,0 +1,265 @@
+import abc
+import atexit
+import datetime
+import fcntl
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from sqlalchemy.exc import InterfaceError, OperationalError, TimeoutError as PoolTimeoutError
+from models import db, Score, User
+from database import dialect_insert
+from stats import record_scores
+from leaderboards import update_leaderboards
+
+logger = logging.getLogger(__name__)
+
+# The database is unreachable or busy: keep the file and retry it whole on the next flush
+RETRYABLE_ERRORS = (OperationalError, InterfaceError, PoolTimeoutError)
+
+
+class JournalBuffer(abc.ABC):
+    """Durable write-behind journal of JSON records, applied to the database in batches.
+
+    Request threads append one JSON line per record to an append-only file and
+    return. A background thread periodically rotates the file and hands its
+    records to _insert() in batches; _insert() must be idempotent, since a file
+    that fails part-way is replayed. The file is shared safely between processes
+    with flock. Records that cannot be applied (unreadable lines, or records that
+    fail on their own with anything but a connection error) are moved to the
+    dead-letter file `<path>.dead` so they do not hold back the rest.
+    """
+    thread_name = 'journal-flusher'
+
+    def __init__(self, app, path, flush_interval=0.5, batch_size=500, fsync=True):
+        self.app = app
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.fsync = fsync
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.dead_letter_path = f'{path}.dead'
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def _write(self, record):
+        """Append one record to the live file"""
+        line = (json.dumps(record) + '\n').encode('utf-8')
+
+        while True:
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_SH)
+                # The flusher may have rotated the file while we waited for the lock
+                if os.fstat(fd).st_ino != os.stat(self.path).st_ino:
+                    continue
+                os.write(fd, line)
+                if self.fsync:
+                    os.fsync(fd)
+                return
+            except FileNotFoundError:
+                continue
+            finally:
+                os.close(fd)
+
+    def _rotate(self):
+        """Move the live file aside so new appends start a fresh one"""
+        try:
+            fd = os.open(self.path, os.O_RDWR)
+        except FileNotFoundError:
+            return
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            if os.fstat(fd).st_size:
+                os.rename(self.path, f'{self.path}.{time.time_ns()}.{os.getpid()}.flushing')
+        finally:
+            os.close(fd)
+
+    def flush(self, wait=False):
+        """Apply every queued record; returns the number of records read.
+
+        With wait=True files another process is flushing are waited for instead of
+        skipped, so on return everything appended before the call has been applied.
+        """
+        with self._flush_lock:
+            self._rotate()
+            flushed = 0
+            for path in sorted(glob.glob(f'{self.path}.*.flushing')):
+                try:
+                    fd = os.open(path, os.O_RDONLY)
+                except FileNotFoundError:
+                    continue
+                try:
+                    # Another process is already flushing this file
+                    fcntl.flock(fd, fcntl.LOCK_EX if wait else fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    # Leave it and everything after it for later, so files apply in order
+                    os.close(fd)
+                    break
+                if os.fstat(fd).st_nlink == 0:
+                    # The other process finished and removed it while we waited
+                    os.close(fd)
+                    continue
+                try:
+                    with os.fdopen(fd, 'r', closefd=False) as f:
+                        batch = []
+                        for line in f:
+                            if not line.strip():
+                                continue
+                            try:
+                                batch.append((line, json.loads(line)))
+                            except ValueError:
+                                self._dead_letter(line, "unreadable JSON")
+                                continue
+                            if len(batch) >= self.batch_size:
+                                flushed += self._apply(batch)
+                                batch = []
+                        if batch:
+                            flushed += self._apply(batch)
+                    os.unlink(path)
+                except Exception:
+                    # Keep the file; inserts are idempotent so the next flush retries it
+                    logger.exception("Failed to flush %s", path)
+                finally:
+                    os.close(fd)
+            return flushed
+
+    def _apply(self, batch):
+        """Insert (line, record) pairs; on a data error, retry them one by one and set aside the bad ones"""
+        try:
+            return self._insert([record for _, record in batch])
+        except RETRYABLE_ERRORS:
+            raise
+        except Exception as e:
+            if len(batch) == 1:
+                self._dead_letter(batch[0][0], repr(e))
+                return 0
+            logger.warning("Batch of %d records failed; retrying them one at a time", len(batch))
+            return sum(self._apply([item]) for item in batch)
+
+    def _dead_letter(self, line, reason):
+        """Append a record that cannot be applied to the dead-letter file, as it was queued"""
+        logger.error("Moving a journal record to %s: %s", self.dead_letter_path, reason,
+                     extra={'record': line.strip()[:500]})
+        with open(self.dead_letter_path, 'a', encoding='utf-8') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.write(line if line.endswith('\n') else line + '\n')
+
+    @abc.abstractmethod
+    def _insert(self, records):
+        """Apply a batch of records; returns how many were read. Must be idempotent."""
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Journal flush failed")
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=self.thread_name, daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def stop(self):
+        """Stop the flusher thread and drain whatever is still queued"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+
+class SubmissionBuffer(JournalBuffer):
+    """Durable write-behind queue for quiz scores.
+
+    Scores are inserted in one multi-row INSERT per batch, skipping (user, attempt
+    key) pairs that are already stored, so replays and client retries never
+    double-insert.
+    """
+    thread_name = 'submission-flusher'
+
+    def append(self, user_id, quiz_id, score, attempt_key):
+        """Queue a score under the client's attempt key; returns the key"""
+        record = {
+            'attempt_key': attempt_key,
+            'user_id': int(user_id),
+            'quiz_id': int(quiz_id),
+            'score': score,
+            'date_taken': datetime.datetime.utcnow().isoformat()
+        }
+        self._write(record)
+        return record['attempt_key']
+
+    def _insert(self, records):
+        with self.app.app_context():
+            # Records queued before the user id was taken from the token carry an email instead
+            emails = {record['user_email'] for record in records if 'user_id' not in record}
+            user_ids = dict(
+                db.session.query(User.email, User.id).filter(User.email.in_(emails)).all()
+            ) if emails else {}
+            # Drop scores for users deleted while their submission was queued
+            queued_ids = {record['user_id'] for record in records if 'user_id' in record}
+            existing_ids = {
+                user_id for (user_id,) in db.session.query(User.id).filter(User.id.in_(queued_ids))
+            } if queued_ids else set()
+
+            rows = {}
+            for record in records:
+                if 'user_id' in record:
+                    user_id = record['user_id'] if record['user_id'] in existing_ids else None
+                else:
+                    user_id = user_ids.get(record['user_email'])
+                if user_id is None:
+                    logger.warning("Dropping submission for unknown user %s",
+                                   record.get('user_id') or record.get('user_email'))
+                    continue
+                rows[user_id, record['attempt_key']] = {
+                    'attempt_key': record['attempt_key'],
+                    'user_id': user_id,
+                    'quiz_id': record['quiz_id'],
+                    'score': record['score'],
+                    'date_taken': datetime.datetime.fromisoformat(record['date_taken'])
+                }
+
+            if rows:
+                statement = dialect_insert(db.engine, Score).on_conflict_do_nothing(
+                    index_elements=['user_id', 'attempt_key']
+                ).returning(Score.user_id, Score.quiz_id, Score.score, Score.date_taken)
+                # RETURNING yields only the rows that were new, so replays do not count twice
+                inserted = db.session.execute(statement, list(rows.values())).all()
+                record_scores(inserted)
+                db.session.commit()
+                update_leaderboards(inserted)
+            logger.debug("Flushed %d submissions", len(rows))
+            return len(records)
+
+
+submission_buffer = None
+
+
+def init_submission_buffer(app):
+    global submission_buffer
+    path = app.config.get('SUBMISSION_QUEUE_PATH') or os.path.join(app.instance_path, 'submissions.log')
+    submission_buffer = SubmissionBuffer(
+        app,
+        path,
+        flush_interval=float(app.config.get('SUBMISSION_FLUSH_INTERVAL', 0.5)),
+        batch_size=int(app.config.get('SUBMISSION_BATCH_SIZE', 500)),
+        fsync=app.config.get('SUBMISSION_FSYNC', True)
+    )
+    submission_buffer.start()
+    return submission_buffer
+
+
+def queue_submission(user_id, quiz_id, score, attempt_key):
+    """Durably queue a quiz score for batched insertion; returns its attempt key.
+
+    The key must come from the client (or the attempt session), so that a retried
+    submission carries the same key and is stored once.
+    """
+    return submission_buffer.append(user_id, quiz_id, score, attempt_key)
@@ -1,38 +1,106 @@
 from flask_mail import Message
-from backend import create_app
-from backend.celery_config import init_celery, mail_settings
-from backend.models import User
-from flask_mail import Mail
+from celery import shared_task
+from sqlalchemy import exists, literal, select, update
+from models import db, User, Quiz, Score, ReminderDelivery
+from database import dialect_insert
+from email_service import MAIL_BATCH_SIZE, MAIL_MAX_RETRIES, send_messages, retry_failed
+import datetime
+import logging
+import uuid
 
-app = create_app()
-app.config.update(mail_settings)
-mail = Mail(app)
-celery = init_celery(app)
+logger = logging.getLogger(__name__)
 
-@celery.task
+IST = datetime.timezone(datetime.timedelta(hours=5, minutes=30))
+
+
+def reminder_message(email, full_name):
+    return Message(
+        subject="Daily Quiz Reminder",
+        recipients=[email],
+        body=f"""
+        Hello {full_name},
+
+        Don't forget to take your daily quiz today! Keep learning and improving.
+
+        Best regards,
+        Quiz Master Team
+        """
+    )
+
+
+def todays_quiz_ids(window_date):
+    """Quizzes whose window overlaps the given IST day (indexed range on start/end)"""
+    day_start = datetime.datetime.combine(window_date, datetime.time.min)
+    day_end = day_start + datetime.timedelta(days=1)
+    return select(Quiz.id).where(Quiz.start_datetime < day_end, Quiz.end_datetime >= day_start)
+
+
+@shared_task
 def send_daily_quiz_reminder():
     """
-    Send daily quiz reminder to all users via email
+    Remind users who have not attempted any of today's quizzes, at most once per day.
+
+    Eligible users are claimed in the delivery ledger with a single INSERT ... SELECT,
+    so each hourly run only picks up users that became eligible since the last one,
+    then the claimed users are sent to in batches across the workers.
     """
-    with app.app_context():
-        users = User.query.all()
-        for user in users:
-            try:
-                msg = Message(
-                    subject="Daily Quiz Reminder",
-                    recipients=[user.email],
-                    body=f"""
-                    Hello {user.username},
-
-                    Don't forget to take your daily quiz today! Keep learning and improving.
-
-                    Best regards,
-                    Quiz Master Team
-                    """
-                )
-                mail.send(msg)
-            except Exception as e:
-                print(f"Failed to send email to {user.email}: {str(e)}")
-                continue
+    window_date = datetime.datetime.now(IST).date()
+    quiz_ids = todays_quiz_ids(window_date)
+    if db.session.execute(quiz_ids.limit(1)).first() is None:
+        return 0
+
+    run_id = uuid.uuid4().hex
+    eligible = select(
+        User.id,
+        literal(window_date, db.Date),
+        literal(run_id, db.String),
+        literal(datetime.datetime.utcnow(), db.DateTime)
+    ).where(
+        User.role != 'admin',
+        ~exists().where(Score.user_id == User.id, Score.quiz_id.in_(quiz_ids)),
+        ~exists().where(ReminderDelivery.user_id == User.id, ReminderDelivery.window_date == window_date)
+    )
+    db.session.execute(
+        dialect_insert(db.engine, ReminderDelivery).from_select(
+            ['user_id', 'window_date', 'run_id', 'created_at'], eligible
+        ).on_conflict_do_nothing(index_elements=['user_id', 'window_date'])
+    )
+    db.session.commit()
+
+    claimed = db.session.query(ReminderDelivery.user_id).filter_by(run_id=run_id).order_by(
+        ReminderDelivery.user_id
+    ).yield_per(1000)
+    batch, batches, users = [], 0, 0
+    for (user_id,) in claimed:
+        batch.append(user_id)
+        if len(batch) >= MAIL_BATCH_SIZE:
+            send_reminder_batch.delay(batch, window_date.isoformat())
+            batches, users, batch = batches + 1, users + len(batch), []
+    if batch:
+        send_reminder_batch.delay(batch, window_date.isoformat())
+        batches, users = batches + 1, users + len(batch)
+    logger.info("Queued daily quiz reminders for %d users in %d batches", users, batches)
+    return users
+
+
+@shared_task(bind=True, max_retries=MAIL_MAX_RETRIES)
+def send_reminder_batch(self, user_ids, window_date):
+    """Send reminders to one batch of claimed users and mark them as sent in the ledger"""
+    users = db.session.query(User.id, User.email, User.full_name).filter(User.id.in_(user_ids)).all()
+    failed = send_messages([(user_id, reminder_message(email, full_name)) for user_id, email, full_name in users])
+
+    failed_ids = set(failed)
+    sent = [user_id for user_id, _, _ in users if user_id not in failed_ids]
+    if sent:
+        db.session.execute(
+            update(ReminderDelivery).where(
+                ReminderDelivery.user_id.in_(sent),
+                ReminderDelivery.window_date == datetime.date.fromisoformat(window_date)
+            ).values(sent_at=datetime.datetime.utcnow())
+        )
+        db.session.commit()
+    logger.info("Daily quiz reminder sent to %d of %d users", len(sent), len(user_ids))
+    if failed:
+        retry_failed(self, failed, (failed, window_date))
 
 # You can add more tasks here for different notification methods (SMS, G-chat)
@@ -0,0 +1,52 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import benchmark
+
+# A small benchmark dataset in a scratch directory. The app reads its settings on import,
+# so they are set here, before any test imports it.
+SEED_ARGS = benchmark.parse_args(['--users', '20', '--subjects', '2', '--chapters', '2',
+                                  '--quizzes', '3', '--questions', '5', '--scores', '3'])
+benchmark.configure_environment(SEED_ARGS, tempfile.mkdtemp(prefix='quiz-tests-'))
+os.environ['BCRYPT_LOG_ROUNDS'] = '4'
+os.environ['PASSWORD_HASH_WORKERS'] = '0'
+os.environ['QUIZ_PAYLOAD_PREWARM_SECONDS'] = '0'
+
+
+@pytest.fixture(scope='session')
+def seeded():
+    """(app, active quiz ids, student emails) for the seeded database"""
+    from app import app
+    from catalog import bump_catalog_version
+    from leaderboards import rebuild_leaderboards
+    import models
+    with app.app_context():
+        active_ids, emails = benchmark.seed(SEED_ARGS, models.db, models, models.bcrypt)
+        # Seeding bypasses the routes, so refresh what they cache
+        bump_catalog_version()
+        models.db.session.commit()
+        rebuild_leaderboards()
+    return app, active_ids, emails
+
+
+@pytest.fixture(scope='session')
+def app(seeded):
+    return seeded[0]
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture(scope='session')
+def student_headers(seeded):
+    app, _, emails = seeded
+    response = app.test_client().post('/login', json={'email': emails[0], 'password': benchmark.PASSWORD})
+    assert response.status_code == 200, response.get_json()
+    return {'Authorization': f"Bearer {response.get_json()['access_token']}"}
@@ -0,0 +1,78 @@
+"""A local SMTP server that accepts mail into memory, for testing delivery without a relay"""
+import socketserver
+import threading
+
+
+class SmtpSink(socketserver.ThreadingTCPServer):
+    """Counts connections and records (recipient, message) pairs.
+
+    `reject` maps a recipient to how many more times its RCPT TO is refused with a 550.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), _SmtpHandler)
+        self.connections = 0
+        self.delivered = []
+        self.reject = {}
+        self.lock = threading.Lock()
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
+
+
+class _SmtpHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode('ascii') + b'\r\n')
+
+    def handle(self):
+        sink = self.server
+        with sink.lock:
+            sink.connections += 1
+        recipients = []
+        self.reply('220 sink ready')
+        while True:
+            line = self.rfile.readline().decode('utf-8', 'replace').strip()
+            command = line[:4].upper()
+            if not line or command == 'QUIT':
+                self.reply('221 bye')
+                return
+            if command in ('EHLO', 'HELO'):
+                self.reply('250 sink')
+            elif command == 'MAIL':
+                recipients = []
+                self.reply('250 OK')
+            elif command == 'RCPT':
+                recipient = line.split(':', 1)[1].strip().strip('<>')
+                with sink.lock:
+                    refused = sink.reject.get(recipient, 0) > 0
+                    if refused:
+                        sink.reject[recipient] -= 1
+                if refused:
+                    self.reply('550 mailbox unavailable')
+                else:
+                    recipients.append(recipient)
+                    self.reply('250 OK')
+            elif command == 'DATA':
+                self.reply('354 end with .')
+                lines = []
+                while (data := self.rfile.readline()) not in (b'.\r\n', b'.\n', b''):
+                    lines.append(data)
+                with sink.lock:
+                    sink.delivered.extend((recipient, b''.join(lines)) for recipient in recipients)
+                self.reply('250 OK')
+            elif command in ('RSET', 'NOOP'):
+                self.reply('250 OK')
+            else:
+                self.reply('502 not implemented')
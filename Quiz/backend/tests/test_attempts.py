@@ -0,0 +1,45 @@
+import pytest
+
+from attempts import AutosaveJournal
+
+
+@pytest.fixture
+def attempt(client, student_headers, seeded):
+    quiz_id = seeded[1][-1]
+    response = client.post(f'/api/quizzes/{quiz_id}/attempts', headers=student_headers)
+    assert response.status_code in (200, 201)
+    return response.get_json()
+
+
+def test_autosave_rejects_a_non_object_body(client, student_headers, attempt):
+    response = client.patch(f"/api/attempts/{attempt['attempt_id']}/answers", headers=student_headers, json=[1, 2])
+    assert response.status_code == 400
+    response = client.post(f"/api/attempts/{attempt['attempt_id']}/submit", headers=student_headers, json=[1, 2])
+    assert response.status_code == 400
+
+
+def test_submit_grades_autosaves_still_in_the_journal(client, student_headers, attempt):
+    question = attempt['questions'][0]
+    response = client.patch(f"/api/attempts/{attempt['attempt_id']}/answers", headers=student_headers,
+                            json={'seq': 1, 'answers': {str(question['id']): 1}})
+    assert response.status_code == 202
+    response = client.get(f"/api/attempts/{attempt['attempt_id']}", headers=student_headers)
+    assert response.get_json()['answers'] == {str(question['id']): 1}
+
+
+def test_pending_index_follows_rotation_and_flushes(app, tmp_path):
+    journal = AutosaveJournal(app, str(tmp_path / 'autosave.log'))
+    journal.append('a1', 1, 1, {'10': 2})
+    journal.append('a2', 1, 1, {'11': 3})
+    assert [record['seq'] for record in journal.pending('a1')] == [1]
+
+    # Rotated files are still indexed, and not read twice
+    journal._rotate()
+    journal.append('a1', 1, 2, {'10': 4})
+    assert [record['answers'] for record in journal.pending('a1')] == [{'10': 2}, {'10': 4}]
+
+    # Once a file is flushed and removed, its records are applied and leave the index
+    for path in tmp_path.glob('autosave.log.*.flushing'):
+        path.unlink()
+    assert [record['seq'] for record in journal.pending('a1')] == [2]
+    assert journal.pending('a2') == []
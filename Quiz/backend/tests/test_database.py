@@ -0,0 +1,102 @@
+import os
+
+import pytest
+from sqlalchemy import Column, Integer, MetaData, Table, create_engine, select, text
+from sqlalchemy.exc import OperationalError
+
+import database
+
+
+def test_database_url_defaults_to_sqlite(monkeypatch):
+    monkeypatch.delenv('DATABASE_URL', raising=False)
+    assert database.database_url() == database.DEFAULT_DATABASE_URL
+
+
+def test_database_url_rewrites_heroku_scheme(monkeypatch):
+    monkeypatch.setenv('DATABASE_URL', 'postgres://quiz:secret@db:5432/quiz')
+    assert database.database_url() == 'postgresql://quiz:secret@db:5432/quiz'
+
+
+def test_engine_options_leave_sqlite_alone():
+    assert database.engine_options('sqlite:///quiz.db') == {}
+
+
+def test_engine_options_read_pool_settings(monkeypatch):
+    monkeypatch.setenv('DB_POOL_SIZE', '3')
+    monkeypatch.setenv('DB_MAX_OVERFLOW', '4')
+    monkeypatch.setenv('DB_POOL_TIMEOUT', '5')
+    monkeypatch.setenv('DB_POOL_RECYCLE', '60')
+    monkeypatch.setenv('DB_POOL_PRE_PING', '0')
+    assert database.engine_options('postgresql://quiz@db/quiz') == {
+        'pool_size': 3, 'max_overflow': 4, 'pool_timeout': 5, 'pool_recycle': 60, 'pool_pre_ping': False
+    }
+
+
+def test_engine_options_pool_defaults(monkeypatch):
+    for name in ('DB_POOL_SIZE', 'DB_MAX_OVERFLOW', 'DB_POOL_TIMEOUT', 'DB_POOL_RECYCLE', 'DB_POOL_PRE_PING'):
+        monkeypatch.delenv(name, raising=False)
+    assert database.engine_options('postgresql://quiz@db/quiz') == {
+        'pool_size': 10, 'max_overflow': 20, 'pool_timeout': 30, 'pool_recycle': 1800, 'pool_pre_ping': True
+    }
+
+
+def test_sqlite_connections_use_wal_and_pragmas(tmp_path, monkeypatch):
+    monkeypatch.setitem(database._sqlite_settings, 'busy_timeout', 1234)
+    engine = create_engine(f"sqlite:///{tmp_path / 'pragmas.db'}")
+    try:
+        with engine.connect() as connection:
+            assert connection.execute(text('PRAGMA journal_mode')).scalar() == 'wal'
+            assert connection.execute(text('PRAGMA synchronous')).scalar() == 1  # NORMAL
+            assert connection.execute(text('PRAGMA busy_timeout')).scalar() == 1234
+    finally:
+        engine.dispose()
+
+
+def test_postgres_engine_gets_the_pool_options(monkeypatch):
+    monkeypatch.setenv('DB_POOL_SIZE', '3')
+    monkeypatch.setenv('DB_MAX_OVERFLOW', '4')
+    url = 'postgresql://quiz@localhost/quiz'
+    engine = create_engine(url, **database.engine_options(url))
+    try:
+        assert engine.pool.size() == 3
+        assert engine.pool._max_overflow == 4
+        assert engine.pool._pre_ping
+    finally:
+        engine.dispose()
+
+
+def test_sqlite_pragmas_skip_other_drivers():
+    class Connection:
+        def cursor(self):
+            raise AssertionError('PRAGMAs sent to a non-SQLite connection')
+
+    database.set_sqlite_pragmas(Connection(), None)
+
+
+@pytest.fixture
+def postgres_engine():
+    """An engine for TEST_POSTGRES_URL; skipped when it is unset or the server does not answer"""
+    url = os.getenv('TEST_POSTGRES_URL')
+    if not url:
+        pytest.skip('TEST_POSTGRES_URL is not set')
+    engine = create_engine(url, **database.engine_options(url))
+    try:
+        with engine.connect():
+            pass
+    except OperationalError as e:
+        engine.dispose()
+        pytest.skip(f'PostgreSQL is not reachable: {e}')
+    yield engine
+    engine.dispose()
+
+
+def test_postgres_upsert_and_pool(postgres_engine):
+    table = Table('quiz_test_upsert', MetaData(), Column('id', Integer, primary_key=True),
+                  Column('value', Integer), prefixes=['TEMPORARY'])
+    with postgres_engine.begin() as connection:
+        table.create(connection)
+        statement = database.dialect_insert(connection, table).on_conflict_do_nothing(index_elements=['id'])
+        connection.execute(statement, [{'id': 1, 'value': 1}, {'id': 2, 'value': 2}])
+        connection.execute(statement, [{'id': 1, 'value': 10}])
+        assert connection.execute(select(table.c.value).order_by(table.c.id)).scalars().all() == [1, 2]
+    assert postgres_engine.pool.checkedout() == 0
@@ -0,0 +1,66 @@
+import uuid
+
+import pytest
+
+from models import db, Question, Quiz
+
+
+def submission(quiz_id, answers, **extra):
+    return dict(extra, attemptId=uuid.uuid4().hex, quizId=quiz_id, answers=answers)
+
+
+@pytest.fixture(scope='module')
+def quiz(seeded):
+    """(active quiz id, [(question id, correct option)], a closed quiz id)"""
+    app, active_ids, _ = seeded
+    with app.app_context():
+        questions = db.session.query(Question.id, Question.correct_option).filter_by(
+            quiz_id=active_ids[0]
+        ).order_by(Question.id).all()
+        closed_id = db.session.query(Quiz.id).filter(Quiz.id.notin_(active_ids)).order_by(Quiz.id).limit(1).scalar()
+    return active_ids[0], [tuple(row) for row in questions], closed_id
+
+
+def test_grades_answers_on_the_server(client, student_headers, quiz):
+    quiz_id, questions, _ = quiz
+    answers = {str(question_id): option for question_id, option in questions}
+    response = client.post('/api/grade-quiz', headers=student_headers, json=submission(quiz_id, answers))
+    assert response.status_code == 202
+    assert response.get_json()['score'] == len(questions)
+
+
+@pytest.mark.parametrize('path', ['/api/grade-quiz', '/api/submit-quiz'])
+def test_padded_spellings_of_one_question_are_rejected(client, student_headers, quiz, path):
+    quiz_id, questions, _ = quiz
+    question_id, option = questions[0]
+    answers = {spelling: option for spelling in
+               (str(question_id), f'0{question_id}', f' {question_id}', f'{question_id} ', f'+{question_id}')}
+    response = client.post(path, headers=student_headers, json=submission(quiz_id, answers))
+    assert response.status_code == 400
+
+
+def test_padded_key_counts_once(client, student_headers, quiz):
+    quiz_id, questions, _ = quiz
+    question_id, option = questions[0]
+    response = client.post('/api/grade-quiz', headers=student_headers,
+                           json=submission(quiz_id, {f' {question_id}': option}))
+    assert response.status_code == 202
+    assert response.get_json()['score'] == 1
+
+
+def test_client_score_is_ignored(client, student_headers, quiz):
+    quiz_id, _, _ = quiz
+    response = client.post('/api/submit-quiz', headers=student_headers,
+                           json=submission(quiz_id, {}, score=1000))
+    assert response.status_code == 202
+    assert response.get_json()['score'] == 0
+
+    response = client.post(f'/attempt_quiz/{quiz_id}', headers=student_headers,
+                           json={'attemptId': uuid.uuid4().hex, 'score': 1000})
+    assert response.status_code == 400
+
+
+def test_closed_quiz_is_not_graded(client, student_headers, quiz):
+    _, _, closed_id = quiz
+    response = client.post('/api/grade-quiz', headers=student_headers, json=submission(closed_id, {}))
+    assert response.status_code == 403
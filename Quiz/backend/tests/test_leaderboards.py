@@ -0,0 +1,88 @@
+import pytest
+from sqlalchemy import func
+
+import leaderboards
+from leaderboards import (GLOBAL_KEY, MemoryLeaderboardStore, chapter_key, discard_quiz, discard_user,
+                          leaderboard, move_quiz, quiz_key, rebuild_leaderboards)
+from models import db, Quiz, Score
+
+
+@pytest.fixture
+def store(monkeypatch):
+    store = MemoryLeaderboardStore()
+    monkeypatch.setattr(leaderboards, 'store', store)
+    return store
+
+
+def submit(store, quiz_id, chapter_id, user_id, score):
+    store.submit([([quiz_key(quiz_id), chapter_key(chapter_id), GLOBAL_KEY], str(user_id), score)])
+
+
+def scores(key):
+    return {entry['user_id']: entry['score'] for entry in leaderboard(key, limit=100)['top']}
+
+
+def test_best_score_replaces_a_worse_one_only(store):
+    submit(store, 1, 10, 7, 3)
+    submit(store, 1, 10, 7, 5)
+    submit(store, 1, 10, 7, 4)
+    assert scores(quiz_key(1)) == {7: 5}
+    # Chapter and global boards sum each user's best per quiz
+    submit(store, 2, 10, 7, 2)
+    assert scores(chapter_key(10)) == {7: 7}
+    assert scores(GLOBAL_KEY) == {7: 7}
+
+
+def test_ranks_and_ties(store):
+    submit(store, 1, 10, 1, 5)
+    submit(store, 1, 10, 2, 9)
+    submit(store, 1, 10, 3, 5)
+    board = leaderboard(quiz_key(1), user_id=1, limit=2)
+    # Equal scores are ordered like ZREVRANGE: by member, descending
+    assert [(entry['rank'], entry['user_id']) for entry in board['top']] == [(1, 2), (2, 3)]
+    assert board['me'] == {'rank': 3, 'user_id': 1, 'score': 5}
+    assert leaderboard(quiz_key(1), user_id=99)['me'] is None
+
+
+def test_discard_quiz_takes_its_scores_out_of_the_totals(store):
+    submit(store, 1, 10, 1, 4)
+    submit(store, 2, 10, 1, 3)
+    submit(store, 2, 10, 2, 6)
+    discard_quiz(2, 10)
+    assert scores(quiz_key(2)) == {}
+    assert scores(chapter_key(10)) == {1: 4}
+    # A member left with nothing is removed, not kept at zero
+    assert scores(GLOBAL_KEY) == {1: 4}
+
+
+def test_move_quiz_between_chapters(store):
+    submit(store, 1, 10, 1, 4)
+    submit(store, 2, 10, 1, 3)
+    move_quiz(2, 10, 20)
+    assert scores(chapter_key(10)) == {1: 4}
+    assert scores(chapter_key(20)) == {1: 3}
+    assert scores(GLOBAL_KEY) == {1: 7}
+
+
+def test_discard_user(store):
+    submit(store, 1, 10, 1, 4)
+    submit(store, 1, 10, 2, 6)
+    discard_user(2, [(1, 10)])
+    assert scores(quiz_key(1)) == scores(chapter_key(10)) == scores(GLOBAL_KEY) == {1: 4}
+
+
+def test_rebuild_from_the_score_table(app, store):
+    with app.app_context():
+        best = db.session.query(Score.quiz_id, Quiz.chapter_id, Score.user_id, func.max(Score.score)).join(
+            Quiz, Quiz.id == Score.quiz_id
+        ).group_by(Score.quiz_id, Quiz.chapter_id, Score.user_id).all()
+        rebuild_leaderboards()
+
+    expected = {}
+    for quiz_id, chapter_id, user_id, score in best:
+        expected.setdefault(quiz_key(quiz_id), {})[user_id] = score
+        for key in (chapter_key(chapter_id), GLOBAL_KEY):
+            expected.setdefault(key, {})
+            expected[key][user_id] = expected[key].get(user_id, 0) + score
+    assert expected
+    assert {key: scores(key) for key in expected} == expected
@@ -0,0 +1,23 @@
+import io
+import json
+import logging
+
+import logging_config
+
+
+def test_arguments_are_rendered_when_logged(monkeypatch):
+    monkeypatch.setattr(logging_config, '_listener', None)
+    root = logging.getLogger()
+    monkeypatch.setattr(root, 'handlers', list(root.handlers))
+    monkeypatch.setattr(root, 'level', root.level)
+    stream = io.StringIO()
+    logging_config.init_logging('INFO', stream)
+    try:
+        items = [1]
+        logging.getLogger('test').info("items %s", items, extra={'quiz_id': 3})
+        items.append(2)
+    finally:
+        logging_config.stop_logging()
+    entry = json.loads(stream.getvalue())
+    assert entry['message'] == 'items [1]'
+    assert entry['quiz_id'] == 3
@@ -0,0 +1,49 @@
+import pytest
+
+import email_service
+from email_service import MAIL_MAX_RETRIES, MAIL_RETRY_BACKOFF, send_new_quiz_batch
+from smtp_sink import SmtpSink
+
+RECIPIENTS = [('a@example.com', 'A'), ('b@example.com', 'B'), ('c@example.com', 'C')]
+
+
+@pytest.fixture
+def sink(app, monkeypatch):
+    """Point Flask-Mail at a local SMTP sink and record the countdowns of task retries"""
+    with SmtpSink() as sink:
+        monkeypatch.setitem(app.extensions, 'mail', email_service.mail.init_mail({
+            'MAIL_SERVER': '127.0.0.1', 'MAIL_PORT': sink.port, 'MAIL_DEFAULT_SENDER': 'quiz@example.com'
+        }))
+        sink.countdowns = []
+        retry = send_new_quiz_batch.retry
+
+        def record_retry(*args, countdown=None, **kwargs):
+            sink.countdowns.append(countdown)
+            return retry(*args, countdown=countdown, **kwargs)
+
+        monkeypatch.setattr(send_new_quiz_batch, 'retry', record_retry)
+        yield sink
+
+
+def test_batch_uses_one_connection(sink):
+    send_new_quiz_batch.apply(args=(RECIPIENTS, 'Algebra 1', 'Maths'))
+    assert sink.connections == 1
+    assert sorted(recipient for recipient, _ in sink.delivered) == [email for email, _ in RECIPIENTS]
+    assert sink.countdowns == []
+
+
+def test_failed_recipient_is_retried_alone_with_backoff(sink):
+    sink.reject['b@example.com'] = 2
+    send_new_quiz_batch.apply(args=(RECIPIENTS, 'Algebra 1', 'Maths'))
+    # One connection for the batch, then one per retry of the failed recipient only
+    assert sink.connections == 3
+    assert [recipient for recipient, _ in sink.delivered].count('b@example.com') == 1
+    assert len(sink.delivered) == len(RECIPIENTS)
+    assert sink.countdowns == [MAIL_RETRY_BACKOFF, MAIL_RETRY_BACKOFF * 2]
+
+
+def test_gives_up_after_the_last_retry(sink):
+    sink.reject['b@example.com'] = MAIL_MAX_RETRIES + 5
+    send_new_quiz_batch.apply(args=(RECIPIENTS, 'Algebra 1', 'Maths'))
+    assert sink.countdowns == [MAIL_RETRY_BACKOFF * 2 ** n for n in range(MAIL_MAX_RETRIES)]
+    assert 'b@example.com' not in [recipient for recipient, _ in sink.delivered]
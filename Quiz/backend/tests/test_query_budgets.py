@@ -0,0 +1,19 @@
+import pytest
+
+from instrumentation import query_budget
+
+# Statements each endpoint may run with cold caches, including the caller's identity lookup
+BUDGETS = {
+    '/available_quizzes': 2,
+    '/api/leaderboards/global': 1,
+    '/my_scores': 2,
+    '/api/dashboard-bootstrap': 5,
+}
+
+
+@pytest.mark.parametrize('path', BUDGETS)
+def test_endpoint_stays_within_query_budget(client, student_headers, path):
+    with query_budget(BUDGETS[path]):
+        response = client.get(path, headers=student_headers)
+    assert response.status_code == 200
+
@@ -0,0 +1,7 @@
+from query_plans import HOT_QUERIES, check_query_plans
+
+
+def test_hot_queries_use_indexes(app):
+    with app.app_context():
+        scans = check_query_plans()
+    assert scans == {}, f"{len(scans)} of {len(HOT_QUERIES)} hot queries scan their table: {scans}"
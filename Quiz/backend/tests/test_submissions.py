@@ -0,0 +1,22 @@
+import uuid
+
+import submission_buffer
+from models import db, Score
+
+
+def test_retried_submission_is_stored_once(app, client, student_headers, seeded):
+    quiz_id = seeded[1][0]
+    body = {'attemptId': uuid.uuid4().hex, 'quizId': quiz_id, 'answers': {}}
+    responses = [client.post('/api/submit-quiz', headers=student_headers, json=body) for _ in range(2)]
+    assert [response.status_code for response in responses] == [202, 202]
+    assert {response.get_json()['attempt_id'] for response in responses} == {body['attemptId']}
+
+    submission_buffer.submission_buffer.flush(wait=True)
+    with app.app_context():
+        assert db.session.query(Score).filter_by(attempt_key=body['attemptId']).count() == 1
+
+
+def test_submission_without_attempt_id_is_rejected(client, student_headers, seeded):
+    response = client.post('/api/submit-quiz', headers=student_headers,
+                           json={'quizId': seeded[1][0], 'answers': {}})
+    assert response.status_code == 400
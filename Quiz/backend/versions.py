@@ -0,0 +1,63 @@
+import threading
+import time
+from flask import current_app
+from sqlalchemy import event, update
+from sqlalchemy.orm import Session
+from models import db, CacheVersion
+
+# name -> (version, time it was read from the database)
+_versions = {}
+_lock = threading.Lock()
+
+
+class KeyedLocks:
+    """One lock per key, so a cache entry is built by one thread while others wait for it"""
+
+    def __init__(self):
+        self._locks = {}
+        self._guard = threading.Lock()
+
+    def __call__(self, key):
+        with self._guard:
+            return self._locks.setdefault(key, threading.Lock())
+
+
+def bump_version(name):
+    """Increment a cache version inside the current transaction; callers commit as usual"""
+    result = db.session.execute(
+        update(CacheVersion)
+        .where(CacheVersion.name == name)
+        .values(version=CacheVersion.version + 1)
+    )
+    if result.rowcount == 0:
+        db.session.add(CacheVersion(name=name, version=1))
+    db.session.info.setdefault('bumped_versions', set()).add(name)
+
+
+def current_version(name):
+    """Return a cache version, re-reading it from the database at most once per check interval"""
+    interval = current_app.config.get('CACHE_VERSION_CHECK_SECONDS', 1.0)
+    now = time.monotonic()
+    cached = _versions.get(name)
+    if cached and now - cached[1] < interval:
+        return cached[0]
+
+    version = db.session.query(CacheVersion.version).filter_by(name=name).scalar() or 0
+    with _lock:
+        _versions[name] = (version, now)
+    return version
+
+
+# Versions bumped by this process are re-read right after the commit,
+# other workers pick them up within the check interval
+@event.listens_for(Session, 'after_commit')
+def _forget_bumped_versions(session):
+    names = session.info.pop('bumped_versions', ())
+    with _lock:
+        for name in names:
+            _versions.pop(name, None)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_bumped_versions(session, previous_transaction):
+    session.info.pop('bumped_versions', None)
@@ -10,7 +10,7 @@ function authHeaders() {
   return token ? { Authorization: `Bearer ${token}` } : {};
 }
 
-export async function apiFetch(path, options = {}) {
+async function apiResponse(path, options = {}) {
   const token = getToken();
   if (!token) {
     window.location.href = "/login";
@@ -35,9 +35,28 @@ export async function apiFetch(path, options = {}) {
     throw error;
   }
 
+  return res;
+}
+
+export async function apiFetch(path, options = {}) {
+  const res = await apiResponse(path, options);
   return res.json();
 }
 
+// List endpoints return one page at a time; follow X-Next-Cursor to collect every row
+export async function apiFetchAll(path, pageSize = 500) {
+  const separator = path.includes("?") ? "&" : "?";
+  const rows = [];
+  let cursor = null;
+  do {
+    const after = cursor ? `&after=${cursor}` : "";
+    const res = await apiResponse(`${path}${separator}limit=${pageSize}${after}`);
+    rows.push(...(await res.json()));
+    cursor = res.headers.get("X-Next-Cursor");
+  } while (cursor);
+  return rows;
+}
+
 // Subjects
 export const getSubjects = () => apiFetch("/api/subjects");
 export const createSubject = (data) =>
@@ -56,7 +75,7 @@ export const deleteSubject = (id) =>
   apiFetch(`/delete_subjects/${id}`, { method: "DELETE" });
 
 // Chapters
-export const getChapters = () => apiFetch("/api/chapters");
+export const getChapters = () => apiFetchAll("/api/chapters");
 export const createChapter = (data) =>
   apiFetch("/create_chapters", {
     method: "POST",
@@ -73,7 +92,7 @@ export const deleteChapter = (id) =>
   apiFetch(`/delete_chapters/${id}`, { method: "DELETE" });
 
 // Quizzes
-export const getQuizzes = () => apiFetch("/api/quizzes");
+export const getQuizzes = () => apiFetchAll("/api/quizzes");
 export const createQuiz = (data) =>
   apiFetch("/create_quizzes", {
     method: "POST",
@@ -98,10 +117,33 @@ export const submitQuiz = (payload) =>
     headers: { "Content-Type": "application/json" },
     body: JSON.stringify(payload),
   });
+export const gradeQuiz = (payload) =>
+  apiFetch("/api/grade-quiz", {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify(payload),
+  });
+// Attempt sessions: start or resume, autosave answer changes, submit
+export const startAttempt = (quizId) =>
+  apiFetch(`/api/quizzes/${quizId}/attempts`, { method: "POST" });
+export const getAttempt = (attemptId) => apiFetch(`/api/attempts/${attemptId}`);
+export const saveAttemptAnswers = (attemptId, payload) =>
+  apiFetch(`/api/attempts/${attemptId}/answers`, {
+    method: "PATCH",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify(payload),
+  });
+export const submitAttempt = (attemptId, payload) =>
+  apiFetch(`/api/attempts/${attemptId}/submit`, {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify(payload),
+  });
 export const getQuizHistory = () => apiFetch("/api/quiz-history");
+export const getDashboardBootstrap = () => apiFetch("/api/dashboard-bootstrap");
 
 // Questions
-export const getQuestions = () => apiFetch("/api/questions");
+export const getQuestions = () => apiFetchAll("/api/questions");
 export const createQuestion = (data) =>
   apiFetch("/create_questions", {
     method: "POST",
@@ -117,8 +159,29 @@ export const updateQuestion = (id, data) =>
 export const deleteQuestion = (id) =>
   apiFetch(`/delete_questions/${id}`, { method: "DELETE" });
 
+// Bulk question banks (CSV or JSON Lines)
+export const importQuestions = (file, quizId) => {
+  const form = new FormData();
+  form.append("file", file);
+  const query = quizId ? `?quiz_id=${quizId}` : "";
+  return apiFetch(`/api/questions/import${query}`, { method: "POST", body: form });
+};
+export const exportQuestions = (format = "csv", quizId) => {
+  const token = getToken();
+  if (!token) {
+    throw new Error("No token");
+  }
+  const query = quizId ? `&quiz_id=${quizId}` : "";
+  return fetch(`${API_BASE}/api/questions/export?format=${format}${query}`, {
+    method: 'GET',
+    headers: {
+      'Authorization': `Bearer ${token}`,
+    },
+  });
+};
+
 // Users
-export const listUsers = () => apiFetch("/list_users");
+export const listUsers = () => apiFetchAll("/list_users");
 export const createUser = (data) =>
   apiFetch("/create_users", {
     method: "POST",
@@ -148,3 +211,21 @@ export const exportUserPerformance = () => {
     },
   });
 };
+
+// Background exports
+export const startExport = (report) =>
+  apiFetch(`/api/exports/${report}`, { method: "POST" });
+export const getExportJob = (jobId) => apiFetch(`/api/exports/jobs/${jobId}`);
+export const downloadExport = (jobId) => {
+  const token = getToken();
+  if (!token) {
+    throw new Error("No token");
+  }
+
+  return fetch(`${API_BASE}/api/exports/jobs/${jobId}/download`, {
+    method: 'GET',
+    headers: {
+      'Authorization': `Bearer ${token}`,
+    },
+  });
+};